@@ -18,10 +18,80 @@ DATABASE = {
     'PORT': os.environ.get('ODYSSEY_DB_PORT'),
 }
 
+# DATABASE may also be a list of dictionaries like the one above, migrate then
+# applies each build to every database, MIGRATION_CONCURRENCY at a time.
+MIGRATION_CONCURRENCY = 4
+
+# Deploy nodes migrating the same database take turns on an advisory lock keyed
+# by database and migration chain. 'block' waits for the lock and takes the
+# result the holder published, 'exit' returns at once with status locked.
+MIGRATION_LOCK = 'block'
+
+# Create indexes CONCURRENTLY and add constraints NOT VALID followed by VALIDATE
+# CONSTRAINT for manifest entries of type index and constraint. These blocks run
+# outside the build transaction.
+ONLINE_DDL = False
+
+# Lock timeout and retry policy per manifest entry type. Blocks that hit their
+# lock_timeout are retried up to retries times with exponential backoff starting
+# at backoff seconds, capped at max_backoff. With reorder, a waiting index block
+# is moved behind the following index blocks on other relations.
+# drift compares blocks against a snapshot of the database catalog: a drop of a
+# missing object or a create of an existing one is skipped with 'skip', run with
+# IF EXISTS / IF NOT EXISTS added with 'guard' and stops the build with 'fail'.
+# on_error decides what happens to a block that fails with anything but a lock
+# timeout: 'fail' stops the build, 'retry' rolls back to the block's savepoint and
+# retries like a lock timeout, 'skip' rolls back and carries on without it.
+# Manifest entries can override it with their own on_error.
+MIGRATION_POLICY = {
+    'default': {'lock_timeout': '5s', 'retries': 5, 'backoff': 0.5, 'max_backoff': 30, 'reorder': False, 'drift': None, 'on_error': 'fail'},
+    'index': {'lock_timeout': '2s', 'retries': 10, 'reorder': False},
+}
+
+# Manifest entries of type dml with action execute can run in batches by adding
+# chunk_size to the entry, for example:
+#   {name = "backfill", type = "dml", action = "execute", location = "...", chunk_size = 10000}
+# The source must be a keyset paginated template, see Engine.execute_chunked.
+# The blocks before a chunked block are committed and recorded first, so a rerun
+# of an interrupted build skips them and resumes the chunked block at its checkpoint.
+
+# Builds run in one transaction unless their entries name groups, for example:
+#   {name = "util.orders", type = "table", action = "create", group = "schema"}
+# Consecutive entries with the same group, or with none, then commit together and
+# a rerun after a failure resumes from the first group that did not commit.
+
 SQL_SRC = os.path.join(BASE_DIR, 'src')
 
+# Primary engine, its migrations are written to MIGRATION_FOLDER. build -e with
+# further engines writes theirs to MIGRATION_FOLDER/<engine>.
+ENGINE = 'postgres'
+
+# fixture dump --subset starts from these seed clauses, appended to
+# SELECT ... FROM <table> AS t, and follows foreign keys to every row they
+# reference. fixture load loads the files of FIXTURE_FOLDER in name order.
+FIXTURE_FOLDER = os.path.join(BASE_DIR, 'fixtures')
+FIXTURE_SUBSET = {
+    # 'public.orders': "WHERE t.created_at > now() - interval '7 days' LIMIT 1000",
+}
+FIXTURE_BATCH_SIZE = 10000
+
+# Encoding of the sql sources. Sources are copied into migrations as bytes, so
+# migrations are written in the same encoding. Must be ASCII compatible.
+SOURCE_ENCODING = 'UTF-8'
+
 MIGRATION_FOLDER = os.path.join(BASE_DIR, 'migrations')
 
+# Unix socket of the daemon command. While a daemon listens on it, build,
+# build --dry-run, migrate --dry-run and verify are answered by the daemon.
+DAEMON_SOCKET = os.path.join(BASE_DIR, '.odyssey_db.sock')
+
+MIGRATION_MAINIFEST = os.path.join(MIGRATION_FOLDER, 'manifest.toml')
+
+# Parsed manifest cache reused by later runs while the manifest is unchanged. Kept
+# out of MIGRATION_FOLDER so it is never committed with the migrations. None keeps
+# parses in memory only.
+MANIFEST_CACHE = os.path.join(BASE_DIR, '.odyssey_manifest_cache.json')
+
 LOGGING = {
     'format': '%(asctime)s [%(levelname)s] [%(module)s] - %(message)s',
 }
@@ -0,0 +1,160 @@
+import hashlib
+import json
+import logging
+import os
+import re
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Pack and index written by the archive command, stored in the migration folder.
+PACK_FILE = 'migrations.pack'
+PACK_INDEX = 'migrations.idx'
+
+# Same blocks as Builder BLOCK_REGEX, matched on the raw bytes of a migration.
+BLOCK_BYTES_REGEX = re.compile(
+    rb'-- ODESSEY BEGIN \|(.*?)\|(.*?)\n([\S\s]*?)\n-- ODESSEY END \|\1\|\2')
+
+
+class Pack:
+
+    def __init__(self, folder, encoding='UTF-8'):
+        """
+        Append only pack of archived migration files. The pack is the migration files
+        concatenated, the index maps every file name to its offset, length and blake2s
+        digest in the pack and every ODESSEY block to the offsets and blake2s digest of
+        its definition.
+
+        The index is replaced only after the pack has been written, so bytes past the
+        last indexed file are from an interrupted archive and are never read.
+
+        :param folder: Migration folder holding the pack and index
+        :type folder: [string]
+        :param encoding: Source encoding of the migrations, used to read block names
+        :type encoding: [string]
+        """
+        self.encoding = encoding
+        self.pack_file = Path(folder, PACK_FILE)
+        self.index_file = Path(folder, PACK_INDEX)
+        self._index = None
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = self.read_index()
+        return self._index
+
+    def read_index(self):
+        if not self.index_file.is_file():
+            return {'files': {}, 'blocks': {}}
+        return json.loads(self.index_file.read_text())
+
+    def block_key(self, objname, objtype):
+        return f"{objname}|{objtype}"
+
+    def names(self):
+        return list(self.index['files'])
+
+    def __contains__(self, name):
+        return name in self.index['files']
+
+    def holds(self, file):
+        """
+        Whether a migration file is archived with the same contents.
+
+        :param file: Path of the migration file
+        :type file: [string]
+        :return: True when the pack has the file under its name and digest
+        :rtype: [bool]
+        """
+        entry = self.index['files'].get(Path(file).name)
+        return entry is not None and hashlib.blake2s(Path(file).read_bytes()).hexdigest() == entry[2]
+
+    def read(self, name):
+        """
+        Reads an archived migration file.
+
+        :param name: File name, such as 0001_up.sql
+        :type name: [string]
+        :return: File contents, None when the file is not in the pack
+        :rtype: [bytes]
+        """
+        entry = self.index['files'].get(name)
+        if entry is None:
+            return None
+        offset, length, digest = entry
+        with open(self.pack_file, 'rb') as f:
+            f.seek(offset)
+            contents = f.read(length)
+        if hashlib.blake2s(contents).hexdigest() != digest:
+            logger.error(f"Archived migration {name} does not match its digest in {self.pack_file}.")
+            exit(-1)
+        return contents
+
+    def read_block(self, name, objname, objtype):
+        """
+        Reads the definition of one ODESSEY block of an archived migration file, without
+        reading the rest of the file.
+
+        :param name: File name, such as 0001_up.sql
+        :type name: [string]
+        :param objname: Name of sql object
+        :type objname: [string]
+        :param objtype: SQL type of object
+        :type objtype: [string]
+        :return: Block definition as found by Builder.search_definition, None when missing
+        :rtype: [bytes]
+        """
+        span = self.index['blocks'].get(name, {}).get(self.block_key(objname, objtype))
+        if span is None:
+            return None
+        start, end, digest = span
+        with open(self.pack_file, 'rb') as f:
+            f.seek(self.index['files'][name][0] + start)
+            contents = f.read(end - start)
+        if hashlib.blake2s(contents).hexdigest() != digest:
+            logger.error(f"Block {objname}|{objtype} of archived migration {name} does not match its digest in {self.pack_file}.")
+            exit(-1)
+        return contents
+
+    def index_blocks(self, contents):
+        blocks = {}
+        for match in BLOCK_BYTES_REGEX.finditer(contents):
+            key = self.block_key(match.group(1).decode(self.encoding), match.group(2).decode(self.encoding))
+            # Newline after the BEGIN marker up to and including the newline before END.
+            start, end = match.start(3) - 1, match.end(3) + 1
+            blocks.setdefault(key, [start, end, hashlib.blake2s(contents[start:end]).hexdigest()])
+        return blocks
+
+    def append(self, files):
+        """
+        Appends migration files to the pack and rewrites the index.
+
+        :param files: Paths of the migration files to archive
+        :type files: [list]
+        :return: Names of the archived files
+        :rtype: [list]
+        """
+        index = self.read_index()
+        added = []
+        with open(self.pack_file, 'ab') as f:
+            offset = f.seek(0, os.SEEK_END)
+            for file in files:
+                name = Path(file).name
+                if name in index['files']:
+                    logger.warning(f"{name} is already archived, skipping.")
+                    continue
+                contents = Path(file).read_bytes()
+                f.write(contents)
+                index['files'][name] = [offset, len(contents), hashlib.blake2s(contents).hexdigest()]
+                index['blocks'][name] = self.index_blocks(contents)
+                offset += len(contents)
+                added.append(name)
+            f.flush()
+            os.fsync(f.fileno())
+
+        temp_index = self.index_file.with_suffix('.tmp')
+        temp_index.write_text(json.dumps(index))
+        os.replace(temp_index, self.index_file)
+        self._index = index
+        return added
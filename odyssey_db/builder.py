@@ -1,24 +1,55 @@
+import codecs
 import logging
-import toml
 import hashlib
 import importlib.util
 import re
 from pathlib import Path
 from datetime import datetime
+from odyssey_db.archive import Pack
+from odyssey_db.manifest import Manifest, load_manifest, parse_manifest
+from odyssey_db.models import Block, ManifestEntry
 
 logger = logging.getLogger(__name__)
 
+BLOCK_REGEX = re.compile(
+    r'-- ODESSEY BEGIN \|(.*?)\|(.*?)\n([\S\s]*?)\n-- ODESSEY END \|\1\|\2')
+
+# Loose migration files the archive command packs, baselines stay loose.
+MIGRATION_FILE = re.compile(r'^(\d+)_(up|down)\.sql$')
+
+# Marker text that must encode to the same bytes in the source encoding.
+ODESSEY_MARKER = '\n-- ODESSEY BEGIN |END|\n'
+
+# Bytes decoded at a time when checking the encoding of a source.
+CHECK_CHUNK = 65536
+
 
 class Builder:
 
-    def __init__(self, settings):
+    def __init__(self, settings, engine=None):
+        """
+        Init method of the Builder class. Migrations of the ENGINE setting are kept in
+        MIGRATION_FOLDER, migrations of any other engine in a folder of its name below it.
+
+        :param settings: Settings module
+        :type settings: [module]
+        :param engine: Engine name the migrations are for, defaults to the ENGINE setting
+        :type engine: [string]
+        """
         self.MIGRATION_FOLDER = settings.MIGRATION_FOLDER
         self.MIGRATION_MAINIFEST = settings.MIGRATION_MAINIFEST
+        self.SOURCE_ENCODING = self.check_encoding(getattr(settings, 'SOURCE_ENCODING', 'UTF-8'))
+        self.MANIFEST_CACHE = getattr(settings, 'MANIFEST_CACHE', None)
+        self.ENGINE = engine or getattr(settings, 'ENGINE', 'postgres')
+        version_init_file = Path(self.MIGRATION_FOLDER, '__init__.py')
+        if self.ENGINE != getattr(settings, 'ENGINE', 'postgres'):
+            self.MIGRATION_FOLDER = str(Path(self.MIGRATION_FOLDER, self.ENGINE))
+        self.pack = Pack(self.MIGRATION_FOLDER, encoding=self.SOURCE_ENCODING)
 
         logger.debug(f"Migration Folder: {self.MIGRATION_FOLDER}")
         logger.debug(f"Manifest File: {self.MIGRATION_MAINIFEST}")
+        logger.debug(f"Source Encoding: {self.SOURCE_ENCODING}")
 
-        version_init_file = Path(self.MIGRATION_FOLDER, '__init__.py')
         if not version_init_file.is_file():
             logger.error(
                 "Unable to import version from: {}".format(version_init_file))
@@ -33,23 +64,95 @@ class Builder:
             self.__version__ = version.__version__
             self.__release__ = version.__release__
 
+    def check_encoding(self, encoding):
+        """
+        Validates the source encoding setting. Sources are copied into migrations without
+        decoding, which needs an encoding the ODESSEY markers are plain ASCII in.
+
+        :param encoding: Encoding name
+        :type encoding: [string]
+        :return: Canonical encoding name
+        :rtype: [string]
+        """
+        try:
+            name = codecs.lookup(encoding).name
+            valid = ODESSEY_MARKER.encode(name) == ODESSEY_MARKER.encode('ascii')
+        except (LookupError, UnicodeError) as e:
+            logger.error(f"Unknown source encoding {encoding}: {e}")
+            exit(-1)
+        if not valid:
+            logger.error(f"Source encoding {encoding} is not ASCII compatible.")
+            exit(-1)
+        return name
+
     def get_existing_files(self):
         files = []
         extensions = ['*_up.sql', ]
         [files.extend(Path(self.MIGRATION_FOLDER).glob(x)) for x in extensions]
+        loose = {x.name for x in files}
+        files.extend(Path(self.MIGRATION_FOLDER, x) for x in self.pack.names()
+                     if x.endswith('_up.sql') and x not in loose)
         return files
 
-    def read_manifest(self):
+    def migration_present(self, file):
+        """
+        Checks for a migration as a loose file or in the archive pack.
+
+        :param file: Path of the migration file
+        :type file: [Path]
+        :rtype: [bool]
+        """
+        return Path(file).is_file() or Path(file).name in self.pack
+
+    def read_migration_bytes(self, file):
+        """
+        Reads a migration from its loose file, or from the archive pack once archived.
+
+        :param file: Path of the migration file
+        :type file: [Path]
+        :return: Migration contents, None when the migration does not exist
+        :rtype: [bytes]
+        """
+        if Path(file).is_file():
+            return self.read_source_bytes(file)
+        return self.pack.read(Path(file).name)
+
+    def archive_migrations(self, upto):
+        """
+        Moves the loose up and down migrations up to a build into the archive pack. The
+        loose files are removed once the pack index has been written, as are loose files
+        an interrupted archive left behind with the same contents as their archived copy.
+
+        :param upto: Last build to archive
+        :type upto: [string]
+        :return: Names of the archived files
+        :rtype: [list]
+        """
+        files = sorted(x for x in Path(self.MIGRATION_FOLDER).glob('*.sql')
+                       if MIGRATION_FILE.match(x.name) and MIGRATION_FILE.match(x.name).group(1) <= upto)
+        archived = self.pack.append(files)
+        for file in files:
+            if file.name in archived or self.pack.holds(file):
+                file.unlink()
+        return archived
+
+    def read_manifest(self, file=None, store=True):
         """
         Parses manifest file for the list and order of objects to build
-        of up / down migrations.
+        of up / down migrations. The manifest setting is loaded through the
+        manifest cache, which is invalidated by the hash of the file.
 
-        :param file: Location of manifest fine in toml format
+        :param file: Location of manifest fine in toml format, or an open file. Defaults to the manifest setting.
         :type file: [string]
-        :return: Dictionary of toml contents
+        :param store: Write the manifest cache when the manifest was parsed, False for dry runs
+        :type store: [bool]
+        :return: Dictionary of toml contents, a Manifest unless read from an open file
         :rtype: [dict]
         """
-        toml_data = toml.load(self.MIGRATION_MAINIFEST)
+        if file is not None and not isinstance(file, (str, Path)):
+            return parse_manifest(file.read())
+        manifest_file = file if file is not None else self.MIGRATION_MAINIFEST
+        toml_data = load_manifest(manifest_file, cache_file=self.MANIFEST_CACHE if file is None else None, store=store)
         return toml_data
 
     def generate_file_hash(self, file):
@@ -63,7 +166,7 @@ class Builder:
         """
         file_hash = hashlib.blake2s()
         with open(file, "rb") as f:
-            while chunk := f.read(8192).encode('utf-8'):
+            while chunk := f.read(8192):
                 file_hash.update(chunk)
         digest = file_hash.hexdigest()
         return digest
@@ -78,11 +181,42 @@ class Builder:
         :rtype: [string]
         """
         all_file = None
-        with open(file) as f:
+        with open(file, encoding=self.SOURCE_ENCODING) as f:
             all_file = f.read()
-            a = type(all_file)
         return all_file
 
+    def read_source_bytes(self, file):
+        """
+        Reads entire sql source file into memory without decoding it.
+
+        :param file: Path to file
+        :type file: [string]
+        :return: File contents
+        :rtype: [bytes]
+        """
+        return Path(file).read_bytes()
+
+    def check_source(self, file, content):
+        """
+        Checks that the contents of a source decode in the source encoding, a chunk at a
+        time so no decoded copy of the file is kept. Sources found by Migrate are checked
+        when they are scanned, this is for the files of execute entries.
+
+        :param file: Path to file, for the error
+        :type file: [string]
+        :param content: File contents
+        :type content: [bytes]
+        """
+        decoder = codecs.getincrementaldecoder(self.SOURCE_ENCODING)()
+        view = memoryview(content)
+        try:
+            for start in range(0, len(view), CHECK_CHUNK):
+                decoder.decode(view[start:start + CHECK_CHUNK])
+            decoder.decode(b'', final=True)
+        except UnicodeDecodeError as e:
+            logger.error(f"Source file {file} is not valid {self.SOURCE_ENCODING}: {e}")
+            exit(-1)
+
     def wrap_odessey_cmd(self, objname, objtype, sql_cmd):
         """
         Appends header and footer information around a SQL statement. Header and footer information is used to quickly identify start/stop of object statement
@@ -101,31 +235,53 @@ class Builder:
         end = "\n-- ODESSEY END |{}|{}\n".format(objname, objtype)
         return ''.join([begin, sql_cmd, end])
 
-    def read_and_wrap(self, objname, objtype, file, sql_source=None):
+    def wrap_odessey_bytes(self, objname, objtype, sql_cmd):
+        """
+        Bytes version of wrap_odessey_cmd. Only the header and footer are encoded, the
+        SQL statement is copied as is.
+
+        :param objname: Name of sql object
+        :type objname: [string]
+        :param objtype: SQL type of object
+        :type objtype: [string]
+        :param sql_cmd: SQL statement for create/drop/migrate of object in the source encoding
+        :type sql_cmd: [bytes]
+        :return: Merged SQL statement and Odessy header/footer information for the object
+        :rtype: [bytes]
+        """
+        begin = "\n-- ODESSEY BEGIN |{}|{}\n".format(objname, objtype).encode(self.SOURCE_ENCODING, errors='strict')
+        end = "\n-- ODESSEY END |{}|{}\n".format(objname, objtype).encode(self.SOURCE_ENCODING, errors='strict')
+        return b''.join([begin, sql_cmd, end])
+
+    def read_and_wrap(self, objname, objtype, file, sql_source=None, check=False):
         if sql_source:
             sql_command = sql_source
         else:
             if Path(file).is_file():
-                sql_command = self.read_source_file(file)
+                sql_command = self.read_source_bytes(file)
+                if check:
+                    self.check_source(file, sql_command)
             else:
                 logger.error(f"Source file not found: {str(file)}")
                 exit(-1)
 
-        wrapped_command = self.wrap_odessey_cmd(
+        if isinstance(sql_command, str):
+            sql_command = sql_command.encode(self.SOURCE_ENCODING, errors='strict')
+        wrapped_command = self.wrap_odessey_bytes(
             objname=objname, objtype=objtype, sql_cmd=sql_command)
 
         return wrapped_command
 
     def migration_file_name(self,  build_number, direction):
         filename = ''.join([build_number, '_', direction, '.sql'])
-        full_path = ''.join([self.MIGRATION_FOLDER, '/', filename])
-        pathlib_path = Path(full_path)
+        pathlib_path = Path(self.MIGRATION_FOLDER, filename)
+        full_path = str(pathlib_path)
         logger.debug("Migration file: {}".format(str(full_path)))
         return pathlib_path
 
     def migration_file_exists(self, full_path):
         logger.debug("Checking if migration file {} exists.".format(full_path))
-        if Path.is_file(full_path):
+        if Path.is_file(full_path) or Path(full_path).name in self.pack:
             logger.warning("Migration file exits: {}".format(full_path))
             logger.warning(
                 "You must remove the migration file prior to running a build if you intend to regenerate this migration.")
@@ -137,16 +293,50 @@ class Builder:
         else:
             return False
 
+    def rewrite_migration(self, build_spec, db_engine):
+        """
+        Engine rewrite stage of a build. Wrapped commands are passed through unchanged unless
+        the engine rewrites blocks, then every block goes through Engine.rewrite_block.
+
+        :param build_spec: Wrapped commands from build_up_migration or build_down_migration
+        :type build_spec: [list]
+        :param db_engine: Database engine the migration is written for
+        :type db_engine: [Engine]
+        :return: Wrapped commands for the engine
+        :rtype: [list]
+        """
+        if not db_engine.REWRITE_BLOCKS:
+            return build_spec
+        spec = []
+        for item in build_spec:
+            for block in self.read_blocks(item):
+                block = db_engine.rewrite_block(block)
+                spec.append(self.wrap_odessey_bytes(
+                    objname=block.name, objtype=block.type, sql_cmd=block.sql.encode(self.SOURCE_ENCODING, errors='strict')))
+        return spec
+
     def write_migration(self, file, build_spec):
+        """
+        Writes a migration. Items already in bytes are written as is, text items are encoded
+        with the source encoding.
+
+        :param file: Path of the migration file
+        :type file: [Path]
+        :param build_spec: Wrapped commands of the migration
+        :type build_spec: [list]
+        :return: True when the file was written
+        :rtype: [bool]
+        """
         current_utc = datetime.utcnow()
         build_string = f"-- ODESSEY - Build Time UTC: {current_utc} - VERSION: {self.__version__} - RELEASE: {self.__release__}".encode(
-            encoding='UTF-8', errors='strict')
+            encoding=self.SOURCE_ENCODING, errors='strict')
         try:
             logger.debug("Writing migration file: {}".format(str(file)))
             with Path.open(file, 'wb',) as f:
                 for item in build_spec:
-                    f.write(item.encode(encoding='UTF-8', errors='strict'))
-                    f.flush()
+                    if isinstance(item, str):
+                        item = item.encode(encoding=self.SOURCE_ENCODING, errors='strict')
+                    f.write(item)
                 f.write(build_string)
                 f.flush()
             return True
@@ -155,81 +345,341 @@ class Builder:
                 "Could not write migration file: {} {}".format(str(file), str(e)))
             return False
 
-    def match_previous_definition(self, filename, objname, objtype):
+    def search_definition(self, contents, objname, objtype):
+        """
+        Searches migration contents for the ODESSEY block of an object.
 
-        start = r'-- ODESSEY BEGIN \|{}\|{}'.format(objname, objtype)
+        :param contents: Contents of a migration, text or bytes in the source encoding
+        :type contents: [string|bytes]
+        :param objname: Name of sql object
+        :type objname: [string]
+        :param objtype: SQL type of object
+        :type objtype: [string]
+        :return: Tuple of found flag and the block contents, of the same type as contents
+        :rtype: [tuple]
+        """
+        start = r'-- ODESSEY BEGIN \|{}\|{}'.format(re.escape(objname), re.escape(objtype))
         middle = r'([\S\s]*?)'
-        end = r'-- ODESSEY END \|{}\|{}'.format(objname, objtype)
+        end = r'-- ODESSEY END \|{}\|{}'.format(re.escape(objname), re.escape(objtype))
 
-        pattern = [start, middle, end]
-
-        regx = re.compile(start + middle + end)
+        pattern = start + middle + end
+        if isinstance(contents, bytes):
+            pattern = pattern.encode(self.SOURCE_ENCODING, errors='strict')
+        regx = re.compile(pattern)
 
         match = None
         found = False
+        results = re.search(regx, contents)
+        if results:
+            if results.group(1) is not None:
+                match = results.group(1)
+                found = True
+        return found, match
+
+    def match_previous_definition(self, filename, objname, objtype):
+        found = False
+        match = None
         logger.info(filename)
-        if Path(filename).is_file:
-            with Path.open(filename, 'r') as f:
-                contents = f.read()
-                results = re.search(regx, contents)
-                if results:
-                    if results.group(1) is not None:
-                        match = results.group(1)
-                        found = True
+        if Path(filename).is_file():
+            found, match = self.search_definition(
+                contents=self.read_source_bytes(filename), objname=objname, objtype=objtype)
+        elif Path(filename).name in self.pack:
+            match = self.pack.read_block(Path(filename).name, objname=objname, objtype=objtype)
+            found = match is not None
         else:
             logger.error(f"Rollback file does not exist: {filename}")
             exit(-1)
         return found, match
 
-    def build_cmds(self, manifest, source_file_info, old_migrations=None):
+    def read_blocks(self, contents):
+        """
+        Splits the contents of a migration into its ODESSEY blocks.
+
+        :param contents: Contents of a migration, bytes are decoded with the source encoding
+        :type contents: [string|bytes]
+        :return: List of blocks with the name, type and sql of each block
+        :rtype: [list]
+        """
+        if isinstance(contents, bytes):
+            contents = contents.decode(self.SOURCE_ENCODING)
+        return [Block.of(match.group(1), match.group(2), match.group(3)) for match in BLOCK_REGEX.finditer(contents)]
+
+    def migration_builds(self, direction="up", target="max"):
+        """
+        Selects the generated builds a migration in the given direction would visit.
+
+        :param direction: up or down
+        :type direction: [string]
+        :param target: Build to migrate to. max migrates up to the latest build, or down every
+            build, of which a migrate applies only the newest one the database has applied.
+        :type target: [string]
+        :return: Build numbers in the order they would be applied
+        :rtype: [list]
+        """
+        build_numbers = sorted([x.name.replace('_up.sql', '') for x in self.get_existing_files()])
+        if direction == "down":
+            return sorted([x for x in build_numbers if target == "max" or x > target], reverse=True)
+        return [x for x in build_numbers if target == "max" or x <= target]
+
+    def read_migration(self, build_number, direction, manifest=None):
+        """
+        Reads the ODESSEY blocks of a generated migration. When a manifest is given each
+        block carries the manifest entry it was built from as its entry.
+
+        :param build_number: Build number
+        :type build_number: [string]
+        :param direction: up or down
+        :type direction: [string]
+        :param manifest: Parsed manifest
+        :type manifest: [dict]
+        :return: List of blocks from read_blocks
+        :rtype: [list]
+        """
+        migration_file = self.migration_file_name(build_number=build_number, direction=direction)
+        contents = self.read_migration_bytes(migration_file)
+        if contents is None:
+            logger.error(f"Migration file not found: {migration_file}")
+            exit(-1)
+        blocks = self.read_blocks(contents)
+        if manifest and build_number in manifest:
+            entries = [ManifestEntry.coerce(x) for x in manifest[build_number][direction]]
+            if len(entries) == len(blocks) and all(
+                    x.name == y.name and x.type == y.type for (x, y) in zip(blocks, entries)):
+                blocks = [x._replace(entry=y) for (x, y) in zip(blocks, entries)]
+            else:
+                logger.warning(f"Manifest entries for {build_number} {direction} do not match the migration file, manifest options are ignored.")
+        return blocks
+
+    def squash_blocks(self, upto, db_engine, manifest=None):
+        """
+        Replays the up migrations up to a build and keeps the final definition of every object.
+        A create or rollback replaces the sql of the earlier definition of the object in its
+        first position, so objects created in between that depend on it still come after it.
+        A drop removes the object, blocks executed against it, blocks working on it as a
+        relation, such as its indexes and constraints, and, for a schema, the objects in it.
+        Other execute blocks are kept in order.
+
+        :param upto: Last build to squash
+        :type upto: [string]
+        :param db_engine: Database engine, finds the relation each block works on
+        :type db_engine: [Engine]
+        :param manifest: Parsed manifest, supplies the action of each block
+        :type manifest: [dict]
+        :return: Tuple of the squashed build numbers and the final blocks in order
+        :rtype: [tuple]
+        """
+        build_numbers = self.migration_builds(direction="up", target=upto)
+        if upto not in build_numbers:
+            logger.error(f"Build {upto} has no up migration, build it before squashing.")
+            exit(-1)
+
+        final = []
+        for build_number in build_numbers:
+            for block in self.read_migration(build_number=build_number, direction="up", manifest=manifest):
+                name = block.key
+                objtype = block.type_key
+                if block.entry is not None:
+                    action = block.entry.action_key
+                elif objtype in ('ddl', 'dml'):
+                    action = "execute"
+                elif re.match(r'\s*DROP\b', block.sql, re.IGNORECASE):
+                    action = "drop"
+                else:
+                    action = "create"
+                previous = next((x for x in final if x.key == name and x.type_key == objtype), None)
+                if action in ("create", "rollback", "drop"):
+                    final = [x for x in final if x is previous or not (
+                        x.key == name and x.type_key in (objtype, 'ddl', 'dml'))]
+                if action in ("create", "rollback") and previous is not None:
+                    final = [block if x is previous else x for x in final]
+                elif action == "drop":
+                    final = [x for x in final if x is not previous]
+                else:
+                    final.append(block)
+                if action == "drop" and objtype == "schema":
+                    final = [x for x in final if not x.key.startswith(name + '.')]
+                elif action == "drop":
+                    relation = db_engine.relation_key(block.name)
+                    final = [x for x in final if not (
+                        db_engine.block_relation(x) and db_engine.relation_key(db_engine.block_relation(x)) == relation)]
+        return build_numbers, final
+
+    def chain_hash(self, extra_files=None):
+        """
+        Generates a blake2s hexdigest key over every up migration and baseline in order, so
+        any change to the migration chain gives a new key.
+
+        :param extra_files: Further files to include, such as fixtures loaded after migrating
+        :type extra_files: [list]
+        :return: hexdigest key
+        :rtype: [string]
+        """
+        chain_hash = hashlib.blake2s()
+        files = sorted(self.get_existing_files()) + sorted(Path(self.MIGRATION_FOLDER).glob('*_baseline.sql'))
+        for file in files + [Path(x) for x in extra_files or []]:
+            chain_hash.update(file.name.encode('UTF-8'))
+            chain_hash.update(self.read_migration_bytes(file))
+        return chain_hash.hexdigest()
+
+    def get_baseline(self, target="max"):
+        """
+        Finds the newest baseline written by squash at or below a build.
+
+        :param target: Last build the baseline may squash, max for any
+        :type target: [string]
+        :return: Tuple of the baseline build number and file, or (None, None)
+        :rtype: [tuple]
+        """
+        baselines = sorted(x for x in Path(self.MIGRATION_FOLDER).glob('*_baseline.sql')
+                           if target == "max" or x.name.replace('_baseline.sql', '') <= target)
+        if not baselines:
+            return None, None
+        return baselines[-1].name.replace('_baseline.sql', ''), baselines[-1]
+
+    def read_baseline(self, target="max", manifest=None):
+        """
+        Reads the newest baseline at or below a build. The blocks carry the manifest
+        entries of the objects they define.
+
+        :param target: Last build the baseline may squash, max for any
+        :type target: [string]
+        :param manifest: Parsed manifest
+        :type manifest: [dict]
+        :return: Tuple of the baseline build number, the squashed build numbers and the blocks, or None
+        :rtype: [tuple]
+        """
+        baseline_build, baseline_file = self.get_baseline(target=target)
+        if baseline_build is None:
+            return None
+        contents = self.read_source_file(baseline_file)
+        squashed = contents.splitlines()[0].split('|')[2].split(',')
+        return baseline_build, squashed, self.baseline_entries(self.read_blocks(contents), squashed, manifest)
+
+    def baseline_entries(self, blocks, squashed, manifest):
+        """
+        Attaches to the blocks of a baseline the latest up entry of the squashed builds
+        for the same object, so options such as chunk_size apply to the baseline too.
+
+        :param blocks: Blocks of the baseline
+        :type blocks: [list]
+        :param squashed: Build numbers the baseline squashed
+        :type squashed: [list]
+        :param manifest: Parsed manifest
+        :type manifest: [dict]
+        :return: Blocks with their entries
+        :rtype: [list]
+        """
+        entries = {}
+        for build_number in squashed:
+            for entry in (manifest or {}).get(build_number, {}).get('up', []):
+                entry = ManifestEntry.coerce(entry)
+                entries[(entry.key, entry.type_key)] = entry
+        return [x._replace(entry=entries.get((x.key, x.type_key))) for x in blocks]
+
+    def pending_builds(self, manifest, existing_files):
+        """
+        Finds the manifest builds that do not have migration files yet.
+
+        :param manifest: Parsed manifest
+        :type manifest: [dict]
+        :param existing_files: Paths of the existing up migrations
+        :type existing_files: [list]
+        :return: Sorted list of build numbers still to generate
+        :rtype: [list]
+        """
+        existing_file_names = sorted([y.name for y in existing_files])
+        logger.debug(existing_file_names)
+
+        if not isinstance(manifest, Manifest):
+            manifest = Manifest(manifest)
+        next_target_migraion = manifest.next_pending([x.replace('_up.sql', '') for x in existing_file_names])
+        logger.info(f"Next target migration: {next_target_migraion}")
+
+        if next_target_migraion is None:
+            return []
+
+        for efile in existing_file_names:
+            if efile.replace('_up.sql', '') > next_target_migraion:
+                logger.error(f"Migration file greater than target exists: {efile}")
+                logger.error("Migration chain is broken. Previously generated files have likely been removed. Regenerating missing files will produce an inconsistant database migration chain. Find the last stable release to recover past migration files and build migrations from there.")
+                exit(-1)
+
+        return manifest.builds_from(next_target_migraion)
+
+    def find_source_file(self, source_file_info, objname):
+        """
+        Looks up the source file of an object in the source catalogue.
+
+        :param source_file_info: Flat list of source files or an index from Migrate.index_files_list
+        :type source_file_info: [list|dict]
+        :param objname: Name of sql object
+        :type objname: [string]
+        :return: Path of the source file or None
+        :rtype: [string]
+        """
+        if isinstance(source_file_info, dict):
+            return source_file_info.get(objname.lower())
+        key = objname.lower()
+        return next((item.file for item in source_file_info if item.key == key), None)
+
+    def build_cmds(self, manifest, source_file_info, old_migrations=None, pending=None):
         wrapped_command = None
         sql_command = None
-        if manifest['action'].lower() == "drop":
+        manifest = ManifestEntry.coerce(manifest)
+        if manifest.action_key == "drop":
             # Handle drop statements without needing a source file.
             sql_command = "DROP {} {};".format(
-                manifest['type'].upper(), manifest['name'])
-            wrapped_command = self.wrap_odessey_cmd(
-                objname=manifest['name'], objtype=manifest['type'], sql_cmd=sql_command)
-        elif manifest['action'].lower() == "create" and manifest['type'].lower() == 'schema':
+                manifest.type.upper(), manifest.name).encode(self.SOURCE_ENCODING, errors='strict')
+            wrapped_command = self.wrap_odessey_bytes(
+                objname=manifest.name, objtype=manifest.type, sql_cmd=sql_command)
+        elif manifest.action_key == "create" and manifest.type_key == 'schema':
             # Handle create schema statements without needing a source file.
             sql_command = "CREATE SCHEMA {};".format(
-                manifest['name'].lower())
-            wrapped_command = self.wrap_odessey_cmd(
-                objname=manifest['name'], objtype=manifest['type'], sql_cmd=sql_command)
-        elif manifest['action'].lower() == "create":
+                manifest.key).encode(self.SOURCE_ENCODING, errors='strict')
+            wrapped_command = self.wrap_odessey_bytes(
+                objname=manifest.name, objtype=manifest.type, sql_cmd=sql_command)
+        elif manifest.action_key == "create":
             # Wrap create statements using source files
             logger.debug(source_file_info)
-            source_file = next((item['file'] for item in source_file_info if item["name"].lower(
-            ) == manifest['name'].lower()), None)
+            source_file = self.find_source_file(
+                source_file_info=source_file_info, objname=manifest.name)
             if source_file:
                 wrapped_command = self.read_and_wrap(
-                    objname=manifest['name'], objtype=manifest['type'], file=source_file)
+                    objname=manifest.name, objtype=manifest.type, file=source_file)
                 source_file = None
             else:
                 logger.error(
-                    f"Source control file for object {manifest['name'].lower()} not found.")
+                    f"Source control file for object {manifest.key} not found.")
                 exit(-1)
-        elif manifest['action'].lower() == "execute":
+        elif manifest.action_key == "execute":
             # Wrap create statements using source files
-            source_file = manifest['location']
+            source_file = manifest.location
             if Path(source_file).is_file():
                 wrapped_command = self.read_and_wrap(
-                    objname=manifest['name'], objtype=manifest['type'], file=source_file)
+                    objname=manifest.name, objtype=manifest.type, file=source_file, check=True)
                 source_file = None
             else:
                 logger.error(f"Source file not found {source_file}")
                 exit(-1)
-        elif manifest['action'].lower() == "rollback":
+        elif manifest.action_key == "rollback":
+            # Search builds generated in memory, newest first, before the old migration files.
+            if pending:
+                for build_number in sorted(pending, reverse=True):
+                    result, sql_command = self.search_definition(
+                        contents=pending[build_number], objname=manifest.name, objtype=manifest.type)
+                    if result:
+                        return self.read_and_wrap(
+                            objname=manifest.name, objtype=manifest.type, file=None, sql_source=sql_command)
             # Search old migration files for last version of object source.
             if old_migrations:
                 for migration_file in old_migrations:
                     if migration_file:
-                        if Path(migration_file).is_file():
+                        if self.migration_present(migration_file):
                             result, sql_command = self.match_previous_definition(
-                                filename=migration_file, objname=manifest['name'], objtype=manifest['type'])
+                                filename=migration_file, objname=manifest.name, objtype=manifest.type)
                             if result:
                                 wrapped_command = self.read_and_wrap(
-                                    objname=manifest['name'], objtype=manifest['type'], file=None, sql_source=sql_command)
+                                    objname=manifest.name, objtype=manifest.type, file=None, sql_source=sql_command)
                                 break
                         else:
                             logger.error(f'Expected migration file {migration_file} does not exist! Cannot find a rollback version for manifest!')
@@ -263,17 +713,18 @@ class Builder:
         logger.debug(f"Up commands for build {build_number}: {cmds}")
         return cmds
 
-    def build_down_migration(self, build_number, config, source_file_info):
+    def build_down_migration(self, build_number, config, source_file_info, pending=None):
         cmds = []
-        files = sorted(Path(self.MIGRATION_FOLDER).glob(
-            '*_up.sql'), reverse=True)
+        files = sorted(self.get_existing_files(), reverse=True)
         previous_files = [x for x in files if x.name.replace(
             '_up.sql', '') < build_number]
+        if pending:
+            pending = {key: value for (key, value) in pending.items() if key < build_number}
         build_down = config[build_number]['down']
         if len(build_down) > 0:
             for manifest in build_down:
                 results = self.build_cmds(
-                    manifest=manifest, source_file_info=source_file_info, old_migrations=previous_files)
+                    manifest=manifest, source_file_info=source_file_info, old_migrations=previous_files, pending=pending)
                 if results:
                     cmds.append(results)
                 else:
@@ -0,0 +1,225 @@
+import json
+import logging
+import os
+import socket
+import time
+from pathlib import Path
+from odyssey_db.planner import Planner
+from odyssey_db.watch import Watcher
+
+logger = logging.getLogger(__name__)
+
+# Seconds a client has to send its request and read the response before it is dropped.
+CLIENT_TIMEOUT = 10
+
+
+class RequestLog(logging.Handler):
+    """
+    Collects the log records of one request, so the client can replay them.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append([record.levelno, record.name, record.module, record.getMessage()])
+
+
+class Daemon(Watcher):
+
+    def __init__(self, db_engines, migrator, settings, settings_file, source_files, socket_path, interval=0.5,
+                 client_timeout=CLIENT_TIMEOUT):
+        """
+        Keeps the source catalogue, manifest and builders of a project in memory and answers
+        build, plan and verify requests over a Unix socket, so repeated calls skip Python
+        startup, the settings, the manifest parse and the source scan.
+
+        Requests and responses are one line of JSON each. A request names the settings file
+        and engines it was made with, the daemon answers mismatch when they differ from its
+        own so the client runs the command itself. Requests are served one at a time, and the
+        catalogue is brought up to date with the file changes seen since the last request
+        before each one.
+
+        :param db_engines: Dictionary of engine name to database engine
+        :type db_engines: [dict]
+        :param migrator: Migrate instance
+        :type migrator: [Migrate]
+        :param settings: Settings module
+        :type settings: [module]
+        :param settings_file: Path of the settings file, matched against the settings of each request
+        :type settings_file: [string]
+        :param source_files: Flat source catalogue from Migrate.flatten_files_list
+        :type source_files: [list]
+        :param socket_path: Path of the Unix socket to listen on
+        :type socket_path: [string]
+        :param interval: Seconds between catalogue refreshes while idle
+        :type interval: [float]
+        :param client_timeout: Seconds a client has to send its request and read the response
+        :type client_timeout: [float]
+        """
+        super().__init__(db_engine=next(iter(db_engines.values())), migrator=migrator, settings=settings,
+                         source_files=source_files, interval=interval)
+        self.db_engines = db_engines
+        self.settings_file = str(Path(settings_file).resolve())
+        self.socket_path = str(socket_path)
+        self.client_timeout = client_timeout
+        self.started = time.monotonic()
+        self.running = False
+        self.watch = None
+
+    def refresh(self):
+        """
+        Applies the source, manifest and archive changes seen since the last refresh.
+        """
+        if self.watch is None:
+            return
+        changed = {str(Path(x).resolve()) for x in self.watch.read(0)}
+        if str(self.builder.pack.index_file.resolve()) in changed:
+            # Archived by another process, the cached index no longer lists the pack.
+            self.builder.pack._index = None
+        for path in sorted(x for x in changed if self.relevant(x)):
+            if path == self.manifest_file:
+                self.manifest = self.builder.read_manifest()
+            elif path.startswith(self.sql_src + os.sep):
+                self.refresh_source(path)
+
+    def handle(self, request):
+        """
+        Answers one request.
+
+        :param request: Dictionary with command, settings, engines and the options of the command
+        :type request: [dict]
+        :return: Dictionary with status ok, failed, error or mismatch, the output and the log records
+        :rtype: [dict]
+        """
+        if request.get('settings') != self.settings_file or sorted(request.get('engines') or []) != sorted(self.db_engines):
+            return {'status': 'mismatch', 'output': None, 'logs': []}
+
+        # Deferred, the command line module imports this one.
+        from odyssey_db.odyssey_db import run_build, run_verify
+
+        log = RequestLog()
+        logging.getLogger().addHandler(log)
+        response = {'status': 'ok', 'output': None}
+        try:
+            self.refresh()
+            command = request.get('command')
+            if command == 'ping':
+                response['output'] = {'pid': os.getpid(), 'uptime': round(time.monotonic() - self.started, 3),
+                                      'sources': len(self.catalogue)}
+            elif command == 'build':
+                run_build(db_engines=self.db_engines, settings=self.settings, source_files=list(self.catalogue.values()))
+            elif command == 'plan':
+                planner = Planner(db_engine=self.db_engine, builder=self.builder, source_files=self.source_index())
+                if request.get('plan') == 'build':
+                    response['output'] = planner.plan_build(target=request.get('target', 'all'))
+                else:
+                    response['output'] = planner.plan_migrate(direction=request.get('direction', 'up'),
+                                                              target=request.get('target', 'max'), manifest=self.manifest)
+            elif command == 'verify':
+                response['output'] = run_verify(build=self.builder, manifest=self.manifest)
+                if response['output']['pending']:
+                    response['status'] = 'failed'
+            elif command == 'stop':
+                logger.info("Daemon stopping.")
+                self.running = False
+            else:
+                logger.error(f"Unknown daemon command: {command}")
+                response['status'] = 'error'
+        except SystemExit:
+            response['status'] = 'failed'
+        except Exception as e:
+            logger.exception(f"Daemon request {request.get('command')} failed: {e}")
+            response['status'] = 'error'
+        finally:
+            logging.getLogger().removeHandler(log)
+        response['logs'] = log.records
+        return response
+
+    def serve(self):
+        """
+        Listens on the socket until a stop request or an interrupt. A socket left behind
+        by a daemon that is no longer running is replaced.
+        """
+        path = Path(self.socket_path)
+        if path.exists():
+            if request_daemon(self.socket_path, {'command': 'ping'}) is not None:
+                logger.error(f"A daemon is already listening on {self.socket_path}.")
+                exit(-1)
+            path.unlink()
+
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # Created owner only, a chmod after bind leaves a window with the default mode.
+        umask = os.umask(0o177)
+        try:
+            server.bind(self.socket_path)
+        finally:
+            os.umask(umask)
+        server.listen()
+        server.settimeout(self.interval)
+        self.watch = self.open_watch()
+        self.running = True
+        logger.info(f"Daemon listening on {self.socket_path}")
+        try:
+            while self.running:
+                try:
+                    conn, _ = server.accept()
+                except socket.timeout:
+                    self.refresh()
+                    continue
+                # Requests are served one at a time, a client that never finishes its request must not hold up the others.
+                conn.settimeout(self.client_timeout)
+                with conn, conn.makefile('rwb') as stream:
+                    try:
+                        line = stream.readline()
+                    except OSError as e:
+                        logger.warning(f"Dropped a client that sent no request within {self.client_timeout}s: {e}")
+                        continue
+                    try:
+                        request = json.loads(line)
+                    except ValueError:
+                        response = {'status': 'error', 'output': None, 'logs': [[logging.ERROR, __name__, 'daemon', "Malformed request."]]}
+                    else:
+                        started = time.monotonic()
+                        response = self.handle(request)
+                        logger.debug(f"Answered {request.get('command')} in {(time.monotonic() - started) * 1000:.1f}ms")
+                    try:
+                        stream.write(json.dumps(response, default=str).encode('UTF-8') + b'\n')
+                        stream.flush()
+                    except OSError as e:
+                        logger.warning(f"Client went away before the response was sent: {e}")
+        except KeyboardInterrupt:
+            logger.info("Daemon interrupted.")
+        finally:
+            self.watch.close()
+            self.watch = None
+            server.close()
+            if path.exists():
+                path.unlink()
+
+
+def request_daemon(socket_path, request):
+    """
+    Sends one request to a running daemon.
+
+    :param socket_path: Path of the daemon socket
+    :type socket_path: [string]
+    :param request: Request dictionary, see Daemon.handle
+    :type request: [dict]
+    :return: Response dictionary, None when no daemon is listening
+    :rtype: [dict]
+    """
+    if not Path(socket_path).exists():
+        return None
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(str(socket_path))
+    except OSError:
+        client.close()
+        return None
+    with client, client.makefile('rwb') as stream:
+        stream.write(json.dumps(request).encode('UTF-8') + b'\n')
+        stream.flush()
+        line = stream.readline()
+    return json.loads(line) if line else None
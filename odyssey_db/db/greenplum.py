@@ -0,0 +1,39 @@
+import re
+import logging
+from odyssey_db.db.postgres import Engine as PostgresEngine
+
+logger = logging.getLogger(__name__)
+
+# Statements Greenplum runs without CONCURRENTLY.
+CONCURRENTLY = re.compile(
+    r'^(\s*(?:CREATE\s+(?:UNIQUE\s+)?INDEX|DROP\s+INDEX|REFRESH\s+MATERIALIZED\s+VIEW))\s+CONCURRENTLY\b',
+    re.IGNORECASE)
+
+
+class Engine(PostgresEngine):
+
+    NAME = 'greenplum'
+    REWRITE_BLOCKS = True
+
+    def __init__(self, settings=None):
+        super().__init__(settings=settings)
+
+        # Greenplum has no concurrent index builds, so blocks always run in the build transaction.
+        self.ONLINE_DDL = False
+
+    def rewrite_block(self, block):
+        """
+        Removes CONCURRENTLY from index and materialized view statements, which Greenplum
+        does not support. Blocks without such statements are returned unchanged.
+
+        :param block: Block from Builder.read_blocks
+        :type block: [Block]
+        :return: Block to write
+        :rtype: [Block]
+        """
+        statements = self.split_statements(block.sql)
+        rewritten = [CONCURRENTLY.sub(r'\1', self.strip_comments(x).strip(), count=1) for x in statements]
+        if all(x == self.strip_comments(y).strip() for (x, y) in zip(rewritten, statements)):
+            return block
+        logger.debug(f"Removed CONCURRENTLY from {block.name}|{block.type} for greenplum.")
+        return block._replace(sql=';\n'.join(rewritten) + ';')
@@ -1,15 +1,163 @@
 import re
+import time
+import random
 import psycopg2
+from psycopg2 import errors
+from psycopg2 import sql
+import zlib
 import logging
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from types import SimpleNamespace
 import json
+import os
+import socket
 
 logger = logging.getLogger(__name__)
 logger.debug("Loading postgres database engine.")
 
+# Dollar quote tag, semicolons inside a dollar quoted body do not end a statement.
+DOLLAR_QUOTE = re.compile(r"\$([A-Za-z_]\w*)?\$")
+
+# Table recording the builds applied to a database.
+LEDGER_TABLE = 'odyssey_ledger'
+
+# Table recording the progress of chunked dml blocks of builds not yet in the ledger.
+CHECKPOINT_TABLE = 'odyssey_checkpoint'
+
+# Table recording the committed transactional units of builds not yet in the ledger.
+GROUP_TABLE = 'odyssey_group'
+
+# Table where the runner holding the migration lock publishes its result for the runners waiting on it.
+RESULT_TABLE = 'odyssey_result'
+
+# Table recording how long each applied block took, with the size of the relation it touched.
+TIMING_TABLE = 'odyssey_timing'
+
+# Most recent timings read to estimate pending blocks.
+TIMING_HISTORY = 10000
+
+# Relation a statement works on, used to look up its size in pg_class.
+BLOCK_RELATION = re.compile(
+    r'^(?:CREATE\s+(?:UNIQUE\s+)?INDEX\s+(?:CONCURRENTLY\s+)?(?:IF\s+NOT\s+EXISTS\s+)?(?:\S+\s+)?ON\s+(?:ONLY\s+)?'
+    r'|ALTER\s+TABLE\s+(?:IF\s+EXISTS\s+)?(?:ONLY\s+)?|UPDATE\s+(?:ONLY\s+)?|DELETE\s+FROM\s+(?:ONLY\s+)?|INSERT\s+INTO\s+'
+    r'|CLUSTER\s+|REFRESH\s+MATERIALIZED\s+VIEW\s+(?:CONCURRENTLY\s+)?)(?P<relation>[\w."]+)',
+    re.IGNORECASE)
+RELATION_SIZES_QUERY = (
+    "SELECT n.nspname || '.' || c.relname, c.relpages, c.reltuples FROM pg_class c "
+    "JOIN pg_namespace n ON n.oid = c.relnamespace WHERE c.relkind IN ('r', 'p', 'm', 'i')")
+
+# Block types rewritten to lock friendly statements when ONLINE_DDL is enabled.
+ONLINE_TYPES = ('index', 'constraint')
+CREATE_INDEX = re.compile(r'^(CREATE\s+(?:UNIQUE\s+)?INDEX)\s+(?!CONCURRENTLY\b)', re.IGNORECASE)
+DROP_INDEX = re.compile(r'^(DROP\s+INDEX)\s+(?!CONCURRENTLY\b)', re.IGNORECASE)
+ADD_CONSTRAINT = re.compile(
+    r'^ALTER\s+TABLE\s+(?:ONLY\s+)?(?P<table>\S+)\s+ADD\s+CONSTRAINT\s+(?P<name>\S+)\s+(?:FOREIGN\s+KEY|CHECK)\b',
+    re.IGNORECASE)
+NOT_VALID = re.compile(r'\bNOT\s+VALID\s*$', re.IGNORECASE)
+CONCURRENT_INDEX = re.compile(
+    r'^CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+(?:IF\s+NOT\s+EXISTS\s+)?(?:(?!ON\s)(?P<name>[\w."]+)\s+)?ON\s+(?:ONLY\s+)?(?P<table>[\w."]+)',
+    re.IGNORECASE)
+
+# Lock timeout and retry policy used for block types missing from MIGRATION_POLICY.
+DEFAULT_POLICY = {
+    'lock_timeout': '5s',
+    'retries': 5,
+    'backoff': 0.5,
+    'max_backoff': 30,
+    'reorder': False,
+    'drift': None,
+    'on_error': 'fail',
+}
+
+# Drift handling: guard rewrites, catalog kinds per manifest type and the bulk catalog queries.
+DROP_GUARD = re.compile(
+    r'^(DROP\s+(?:MATERIALIZED\s+VIEW|FOREIGN\s+TABLE|TABLE|VIEW|INDEX(?:\s+CONCURRENTLY)?|SEQUENCE|SCHEMA|FUNCTION|PROCEDURE|TYPE|DOMAIN))\s+(?!IF\s+EXISTS\b)',
+    re.IGNORECASE)
+DROP_CONSTRAINT_GUARD = re.compile(r'(\bDROP\s+CONSTRAINT)\s+(?!IF\s+EXISTS\b)', re.IGNORECASE)
+CREATE_GUARD = re.compile(
+    r'^(CREATE\s+(?:UNLOGGED\s+)?(?:TABLE|SCHEMA|SEQUENCE|(?:UNIQUE\s+)?INDEX(?:\s+CONCURRENTLY)?))\s+(?!IF\s+NOT\s+EXISTS\b)',
+    re.IGNORECASE)
+CATALOG_KINDS = {
+    'table': 'relation', 'external table': 'relation', 'foreign table': 'relation', 'view': 'relation',
+    'materialized view': 'relation', 'sequence': 'relation', 'index': 'relation',
+    'function': 'function', 'procedure': 'function', 'schema': 'schema', 'type': 'type', 'domain': 'type',
+    'constraint': 'constraint',
+}
+CATALOG_QUERIES = {
+    'schema': "SELECT nspname FROM pg_namespace",
+    'relation': "SELECT n.nspname || '.' || c.relname FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+                "WHERE c.relkind IN ('r', 'p', 'v', 'm', 'S', 'i', 'I', 'f')",
+    'function': "SELECT DISTINCT n.nspname || '.' || p.proname FROM pg_proc p JOIN pg_namespace n ON n.oid = p.pronamespace",
+    'type': "SELECT n.nspname || '.' || t.typname FROM pg_type t JOIN pg_namespace n ON n.oid = t.typnamespace "
+            "WHERE t.typtype IN ('c', 'd', 'e', 'r') AND (t.typrelid = 0 OR EXISTS "
+            "(SELECT 1 FROM pg_class c WHERE c.oid = t.typrelid AND c.relkind = 'c'))",
+    'constraint': "SELECT n.nspname || '.' || c.conname FROM pg_constraint c JOIN pg_namespace n ON n.oid = c.connamespace",
+}
+
+
+class DriftError(Exception):
+    """
+    Raised when a block conflicts with the database catalog and its drift policy is fail.
+    """
+
+
+class Catalog:
+
+    def __init__(self, objects=None):
+        """
+        In memory index of the objects in a database, as sets of lower case qualified names per catalog kind.
+
+        :param objects: Dictionary of catalog kind to iterable of names
+        :type objects: [dict]
+        """
+        self.objects = {kind: set(x.lower() for x in names) for (kind, names) in (objects or {}).items()}
+
+    def key(self, objtype, objname):
+        kind = CATALOG_KINDS.get(objtype.lower())
+        name = objname.lower()
+        if kind not in (None, 'schema') and '.' not in name:
+            name = f"public.{name}"
+        return kind, name
+
+    def exists(self, objtype, objname):
+        """
+        :return: True or False, or None when the type is not tracked in the catalog
+        :rtype: [bool]
+        """
+        kind, name = self.key(objtype, objname)
+        if kind is None:
+            return None
+        return name in self.objects.get(kind, set())
+
+    def record(self, objtype, objname, action):
+        """
+        Keeps the index current after a block creates or drops an object.
+        """
+        kind, name = self.key(objtype, objname)
+        if kind is None:
+            return
+        if action == 'drop':
+            self.objects.setdefault(kind, set()).discard(name)
+        elif action in ('create', 'rollback'):
+            self.objects.setdefault(kind, set()).add(name)
+
 class Engine:
 
-    def __init__(self):
+    # Engine name, as given to -e.
+    NAME = 'postgres'
+
+    # Engines that change blocks for their dialect override rewrite_block and set this.
+    REWRITE_BLOCKS = False
+
+    def __init__(self, settings=None):
+
+        # Rewrite index and constraint blocks to run online, outside the build transaction.
+        self.ONLINE_DDL = getattr(settings, 'ONLINE_DDL', False)
+
+        # Lock timeout and retry policy per manifest entry type.
+        self.MIGRATION_POLICY = getattr(settings, 'MIGRATION_POLICY', {})
 
         # Dictionary of regex used to parse sql files
         self.regex_dict = {
@@ -22,3 +170,1083 @@ class Engine:
         # Compile top level regex
         logger.debug("Regex string for object name: {}".format(self.regex_strings.object))
         self.sql_object_name = re.compile(self.regex_strings.object, re.MULTILINE|re.IGNORECASE)
+
+    def rewrite_block(self, block):
+        """
+        Rewrites a block for this engine while a build is written. Postgres migrations
+        are written as generated.
+
+        :param block: Block from Builder.read_blocks
+        :type block: [Block]
+        :return: Block to write
+        :rtype: [Block]
+        """
+        return block
+
+    def skip_span(self, sql, i):
+        """
+        Finds the end of the quoted identifier or string, dollar quoted body or comment
+        starting at a position.
+
+        :param sql: SQL source
+        :type sql: [string]
+        :param i: Position in the sql
+        :type i: [int]
+        :return: Tuple of the position after the span and whether it is a comment, None when no span starts there
+        :rtype: [tuple]
+        """
+        length = len(sql)
+        char = sql[i]
+        if char == "'" or char == '"':
+            end = sql.find(char, i + 1)
+            while end != -1 and sql[end + 1:end + 2] == char:
+                end = sql.find(char, end + 2)
+            return (length if end == -1 else end + 1), False
+        if sql.startswith('--', i):
+            # The newline ending the comment is not part of it.
+            end = sql.find('\n', i)
+            return (length if end == -1 else end), True
+        if sql.startswith('/*', i):
+            end = sql.find('*/', i + 2)
+            return (length if end == -1 else end + 2), True
+        if char == '$' and DOLLAR_QUOTE.match(sql, i):
+            tag = DOLLAR_QUOTE.match(sql, i).group(0)
+            end = sql.find(tag, i + len(tag))
+            return (length if end == -1 else end + len(tag)), False
+        return None
+
+    def split_statements(self, sql):
+        """
+        Splits a block of sql into statements on semicolons, ignoring semicolons
+        inside quotes, dollar quoted bodies and comments.
+
+        :param sql: SQL source
+        :type sql: [string]
+        :return: List of statements without their terminating semicolon
+        :rtype: [list]
+        """
+        statements = []
+        start = 0
+        i = 0
+        while i < len(sql):
+            span = self.skip_span(sql, i)
+            if span:
+                i = span[0]
+            elif sql[i] == ';':
+                statements.append(sql[start:i])
+                i += 1
+                start = i
+            else:
+                i += 1
+        statements.append(sql[start:])
+        return [x.strip() for x in statements if self.strip_comments(x).strip()]
+
+    def strip_comments(self, sql):
+        """
+        Removes line and block comments from a statement, leaving quoted strings and
+        dollar quoted bodies as they are.
+
+        :param sql: SQL statement
+        :type sql: [string]
+        :return: SQL statement without comments
+        :rtype: [string]
+        """
+        parts = []
+        start = 0
+        i = 0
+        while i < len(sql):
+            span = self.skip_span(sql, i)
+            if span and span[1]:
+                parts.append(sql[start:i])
+                i = start = span[0]
+            elif span:
+                i = span[0]
+            else:
+                i += 1
+        parts.append(sql[start:])
+        return ''.join(parts)
+
+    def online_statements(self, block):
+        """
+        Rewrites an index or constraint block into statements that avoid blocking writes:
+        indexes are created and dropped CONCURRENTLY, foreign key and check constraints
+        are added NOT VALID and validated by a separate statement.
+
+        :param block: Block from Builder.read_blocks
+        :type block: [Block]
+        :return: List of statements to run outside a transaction, or None if the block runs in the build transaction
+        :rtype: [list]
+        """
+        if not self.ONLINE_DDL or block.type_key not in ONLINE_TYPES:
+            return None
+
+        statements = []
+        for statement in self.split_statements(block.sql):
+            statement = self.strip_comments(statement).strip()
+            constraint = ADD_CONSTRAINT.match(statement)
+            if CREATE_INDEX.match(statement):
+                statements.append(CREATE_INDEX.sub(r'\1 CONCURRENTLY ', statement, count=1))
+            elif DROP_INDEX.match(statement):
+                statements.append(DROP_INDEX.sub(r'\1 CONCURRENTLY ', statement, count=1))
+            elif constraint and not NOT_VALID.search(statement):
+                statements.append(f"{statement} NOT VALID")
+                statements.append(f"ALTER TABLE {constraint.group('table')} VALIDATE CONSTRAINT {constraint.group('name')}")
+            else:
+                statements.append(statement)
+        return statements
+
+    def block_relation(self, block):
+        """
+        Relation a block works on, from the first statement that names one. Table and
+        materialized view blocks fall back to their own name.
+
+        :param block: Block from Builder.read_blocks
+        :type block: [Block]
+        :return: Relation name as written in the sql, None when unknown
+        :rtype: [string]
+        """
+        for statement in self.split_statements(block.sql):
+            match = BLOCK_RELATION.match(self.strip_comments(statement).strip())
+            if match:
+                return match.group('relation')
+        if block.type_key in ('table', 'materialized view'):
+            return block.name
+        return None
+
+    def relation_sizes(self, conn):
+        """
+        Reads the planner statistics of every table, materialized view and index.
+
+        :param conn: psycopg2 connection
+        :type conn: [connection]
+        :return: Dictionary of schema.name to (relpages, reltuples)
+        :rtype: [dict]
+        """
+        with conn.cursor() as cur:
+            cur.execute(RELATION_SIZES_QUERY)
+            sizes = {x[0]: (x[1], x[2]) for x in cur.fetchall()}
+        conn.commit()
+        return sizes
+
+    def timing_history(self, conn, limit=TIMING_HISTORY):
+        """
+        Reads the most recent block timings of a database.
+
+        :param conn: psycopg2 connection
+        :type conn: [connection]
+        :param limit: Number of timings to read
+        :type limit: [int]
+        :return: List of dictionaries with direction, name, type, relation, seconds, relpages and reltuples
+        :rtype: [list]
+        """
+        columns = ('direction', 'name', 'type', 'relation', 'seconds', 'relpages', 'reltuples')
+        with conn.cursor() as cur:
+            cur.execute("SELECT to_regclass(%s) IS NOT NULL", (TIMING_TABLE,))
+            if not cur.fetchone()[0]:
+                conn.commit()
+                return []
+            cur.execute(f"SELECT {', '.join(columns)} FROM {TIMING_TABLE} ORDER BY recorded_at DESC LIMIT %s", (limit,))
+            history = [dict(zip(columns, x)) for x in cur.fetchall()]
+        conn.commit()
+        return history
+
+    def relation_key(self, relation):
+        """
+        Catalog name of a relation as written in sql: unquoted identifiers are folded
+        to lower case and unqualified names are taken to be in public.
+        """
+        parts = [x[1:-1] if x.startswith('"') else x.lower() for x in relation.split('.')]
+        return '.'.join((['public'] + parts)[-2:])
+
+    def block_sizes(self, cur, relations):
+        """
+        Reads the size of the relations of a build before it runs.
+
+        :param cur: psycopg2 cursor
+        :type cur: [cursor]
+        :param relations: Relation keys from relation_key
+        :type relations: [list]
+        :return: Dictionary of relation key to (relpages, reltuples)
+        :rtype: [dict]
+        """
+        if not relations:
+            return {}
+        cur.execute(RELATION_SIZES_QUERY + " AND n.nspname || '.' || c.relname = ANY(%s)", (sorted(relations),))
+        return {x[0]: (x[1], x[2]) for x in cur.fetchall()}
+
+    def record_timings(self, cur, build_number, direction, timings):
+        """
+        Records the block timings of a build in the build transaction.
+
+        :param cur: psycopg2 cursor
+        :type cur: [cursor]
+        :param build_number: Build number
+        :type build_number: [string]
+        :param direction: up or down
+        :type direction: [string]
+        :param timings: List of (position, block, relation key, seconds, (relpages, reltuples)) tuples
+        :type timings: [list]
+        """
+        if not timings:
+            return
+        cur.execute(f"INSERT INTO {TIMING_TABLE} (build, direction, position, name, type, relation, seconds, relpages, reltuples) "
+                    "SELECT %s, %s, t.* FROM unnest(%s::int[], %s::text[], %s::text[], %s::text[], %s::float8[], %s::bigint[], %s::float8[]) "
+                    "AS t(position, name, type, relation, seconds, relpages, reltuples)",
+                    (build_number, direction, [x[0] for x in timings], [x[1].name for x in timings],
+                     [x[1].type for x in timings], [x[2] for x in timings], [x[3] for x in timings],
+                     [x[4][0] for x in timings], [x[4][1] for x in timings]))
+
+    def snapshot_catalog(self, conn):
+        """
+        Reads the schemas, relations, functions, types and constraints of a database in one
+        query per catalog kind.
+
+        :param conn: psycopg2 connection
+        :type conn: [connection]
+        :return: Catalog index
+        :rtype: [Catalog]
+        """
+        objects = {}
+        with conn.cursor() as cur:
+            for kind, query in CATALOG_QUERIES.items():
+                cur.execute(query)
+                objects[kind] = [x[0] for x in cur.fetchall()]
+        conn.commit()
+        logger.debug(f"Catalog snapshot: { {k: len(v) for (k, v) in objects.items()} }")
+        return Catalog(objects)
+
+    def drift_enabled(self):
+        return any(x.get('drift') for x in self.MIGRATION_POLICY.values())
+
+    def block_action(self, block):
+        """
+        Action of a block, from its manifest entry or else from the first statement.
+
+        :param block: Block from Builder.read_blocks
+        :type block: [Block]
+        :return: create, drop or execute
+        :rtype: [string]
+        """
+        if block.entry is not None:
+            return block.entry.action_key
+        statements = self.split_statements(block.sql)
+        first = self.strip_comments(statements[0]).strip().upper() if statements else ''
+        if first.startswith('DROP') or re.match(r'ALTER\s+TABLE\s+.*\bDROP\s+CONSTRAINT\b', first):
+            return 'drop'
+        if first.startswith('CREATE') or re.match(r'ALTER\s+TABLE\s+.*\bADD\s+CONSTRAINT\b', first):
+            return 'create'
+        return 'execute'
+
+    def drift_decision(self, block, catalog, policy=None):
+        """
+        Decides what to do with a block given the catalog. Drops of missing objects and
+        creates of existing objects are drift, handled by the drift policy of the block type:
+        skip leaves the block out, guard adds IF EXISTS / IF NOT EXISTS and fail stops the build.
+        CREATE OR REPLACE blocks are never drift.
+
+        :param block: Block from Builder.read_blocks
+        :type block: [Block]
+        :param catalog: Catalog index
+        :type catalog: [Catalog]
+        :param policy: Policy from block_policy
+        :type policy: [dict]
+        :return: run, skip, guard or fail
+        :rtype: [string]
+        """
+        policy = policy or self.block_policy(block)
+        action = self.block_action(block)
+        exists = catalog.exists(block.type, block.name)
+        if not policy.get('drift') or exists is None:
+            return 'run'
+        if action == 'drop' and not exists:
+            return policy['drift']
+        if action == 'create' and exists and not re.search(r'^\s*CREATE\s+OR\s+REPLACE\b', self.strip_comments(block.sql), re.IGNORECASE):
+            return policy['drift']
+        return 'run'
+
+    def guard_block(self, block):
+        """
+        Rewrites the statements of a block with IF EXISTS / IF NOT EXISTS guards.
+        """
+        statements = []
+        for statement in self.split_statements(block.sql):
+            statement = self.strip_comments(statement).strip()
+            statement = DROP_GUARD.sub(r'\1 IF EXISTS ', statement, count=1)
+            statement = DROP_CONSTRAINT_GUARD.sub(r'\1 IF EXISTS ', statement, count=1)
+            statement = CREATE_GUARD.sub(r'\1 IF NOT EXISTS ', statement, count=1)
+            statements.append(statement)
+        return block._replace(sql=';\n'.join(statements) + ';')
+
+    def database_list(self, database):
+        """
+        Normalises the DATABASE setting to a list of connection dictionaries.
+
+        :param database: A single connection dictionary or a list of them
+        :type database: [dict|list]
+        :return: List of connection dictionaries
+        :rtype: [list]
+        """
+        if isinstance(database, dict):
+            return [database]
+        return list(database)
+
+    def connect(self, database):
+        """
+        Opens a connection to a database described by a DATABASE dictionary.
+
+        :param database: Connection dictionary with NAME, USER, PASSWORD, HOST and PORT
+        :type database: [dict]
+        :return: psycopg2 connection
+        :rtype: [connection]
+        """
+        return psycopg2.connect(
+            dbname=database.get('NAME'),
+            user=database.get('USER'),
+            password=database.get('PASSWORD'),
+            host=database.get('HOST'),
+            port=database.get('PORT'),
+        )
+
+    def ensure_ledger(self, conn):
+        with conn.cursor() as cur:
+            cur.execute(f"CREATE TABLE IF NOT EXISTS {LEDGER_TABLE} (build TEXT PRIMARY KEY, applied_at TIMESTAMPTZ NOT NULL DEFAULT now())")
+            cur.execute(f"CREATE TABLE IF NOT EXISTS {CHECKPOINT_TABLE} (build TEXT NOT NULL, direction TEXT NOT NULL, block INT NOT NULL, last_key TEXT, rows BIGINT NOT NULL, updated_at TIMESTAMPTZ NOT NULL DEFAULT now(), PRIMARY KEY (build, direction, block))")
+            cur.execute(f"CREATE TABLE IF NOT EXISTS {GROUP_TABLE} (build TEXT NOT NULL, direction TEXT NOT NULL, unit INT NOT NULL, name TEXT, completed_at TIMESTAMPTZ NOT NULL DEFAULT now(), PRIMARY KEY (build, direction, unit))")
+            cur.execute(f"CREATE TABLE IF NOT EXISTS {RESULT_TABLE} (run_key TEXT PRIMARY KEY, status TEXT NOT NULL, applied TEXT NOT NULL, skipped TEXT NOT NULL DEFAULT '[]', error TEXT, failed_build TEXT, runner TEXT NOT NULL, finished_at TIMESTAMPTZ NOT NULL DEFAULT clock_timestamp())")
+            cur.execute(f"CREATE TABLE IF NOT EXISTS {TIMING_TABLE} (build TEXT NOT NULL, direction TEXT NOT NULL, position INT NOT NULL, name TEXT NOT NULL, type TEXT NOT NULL, relation TEXT, seconds DOUBLE PRECISION NOT NULL, relpages BIGINT, reltuples DOUBLE PRECISION, recorded_at TIMESTAMPTZ NOT NULL DEFAULT now())")
+        conn.commit()
+
+    def ledger_exists(self, conn):
+        with conn.cursor() as cur:
+            cur.execute("SELECT to_regclass(%s) IS NOT NULL", (LEDGER_TABLE,))
+            exists = cur.fetchone()[0]
+        conn.commit()
+        return exists
+
+    def applied_builds(self, conn):
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT build FROM {LEDGER_TABLE} ORDER BY build")
+            return [x[0] for x in cur.fetchall()]
+
+    def migration_lock_key(self, database, chain):
+        return zlib.crc32(f"{database.get('NAME')}|{chain}".encode('UTF-8'))
+
+    def migration_run_key(self, chain, direction, builds, steps):
+        """
+        Key of a migrate invocation, runners with the same key would do the same work.
+        """
+        return f"{chain}|{direction}|{','.join(x[0] for x in builds)}|{steps}"
+
+    def acquire_migration_lock(self, conn, key, wait=True):
+        """
+        Takes the session level migration advisory lock.
+
+        :param conn: psycopg2 connection
+        :type conn: [connection]
+        :param key: Lock key from migration_lock_key
+        :type key: [int]
+        :param wait: Block until the lock is free, otherwise return at once
+        :type wait: [bool]
+        :return: True when the lock was taken
+        :rtype: [bool]
+        """
+        with conn.cursor() as cur:
+            if wait:
+                cur.execute("SELECT pg_advisory_lock(%s)", (key,))
+                locked = True
+            else:
+                cur.execute("SELECT pg_try_advisory_lock(%s)", (key,))
+                locked = cur.fetchone()[0]
+        conn.commit()
+        return locked
+
+    def release_migration_lock(self, conn, key):
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (key,))
+        conn.commit()
+
+    def server_time(self, conn):
+        with conn.cursor() as cur:
+            cur.execute("SELECT clock_timestamp()")
+            now = cur.fetchone()[0]
+        conn.commit()
+        return now
+
+    def published_result(self, conn, run_key, since):
+        """
+        Reads the result another runner published for the same migration while this one waited.
+
+        :param run_key: Key from migration_run_key
+        :type run_key: [string]
+        :param since: Server time the wait started, older results are ignored
+        :type since: [datetime]
+        :return: Published result or None
+        :rtype: [dict]
+        """
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT status, applied, skipped, error, failed_build, runner FROM {RESULT_TABLE} WHERE run_key = %s AND finished_at >= %s",
+                        (run_key, since))
+            row = cur.fetchone()
+        conn.commit()
+        if row is None:
+            return None
+        published = {'status': row[0], 'applied': json.loads(row[1]), 'skipped': json.loads(row[2]), 'error': row[3],
+                     'published_by': row[5]}
+        if row[4] is not None:
+            published['failed_build'] = row[4]
+        return published
+
+    def publish_result(self, conn, run_key, result):
+        with conn.cursor() as cur:
+            cur.execute(f"INSERT INTO {RESULT_TABLE} (run_key, status, applied, skipped, error, failed_build, runner) VALUES (%s, %s, %s, %s, %s, %s, %s) "
+                        "ON CONFLICT (run_key) DO UPDATE SET status = EXCLUDED.status, applied = EXCLUDED.applied, skipped = EXCLUDED.skipped, "
+                        "error = EXCLUDED.error, failed_build = EXCLUDED.failed_build, runner = EXCLUDED.runner, finished_at = clock_timestamp()",
+                        (run_key, result['status'], json.dumps(result['applied']), json.dumps(result['skipped']), result['error'],
+                         result.get('failed_build'), f"{socket.gethostname()}:{os.getpid()}"))
+        conn.commit()
+
+    def independent_blocks(self, block, other):
+        """
+        Checks that a waiting block may run after another. Only index blocks on different
+        relations qualify, any other block may need what the waiting block creates, such as
+        the unique index of a foreign key or the column of a view.
+
+        :param block: Block waiting for its locks
+        :type block: [Block]
+        :param other: Following block
+        :type other: [Block]
+        :rtype: [bool]
+        """
+        if block.type_key != 'index' or other.type_key != 'index':
+            return False
+        relation, other_relation = self.block_relation(block), self.block_relation(other)
+        return bool(relation and other_relation) and self.relation_key(relation) != self.relation_key(other_relation)
+
+    def block_policy(self, block):
+        """
+        Resolves the lock timeout and retry policy of a block from its type.
+
+        :param block: Block from Builder.read_blocks
+        :type block: [Block]
+        :return: Policy dictionary
+        :rtype: [dict]
+        """
+        policy = dict(DEFAULT_POLICY)
+        policy.update(self.MIGRATION_POLICY.get('default', {}))
+        policy.update(self.MIGRATION_POLICY.get(block.type_key, {}))
+        return policy
+
+    def backoff_delay(self, policy, attempt):
+        """
+        Exponential backoff with jitter, between half and all of backoff * 2 ** attempt
+        capped at max_backoff seconds.
+        """
+        delay = min(policy['max_backoff'], policy['backoff'] * 2 ** attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def execute_block(self, cur, block, policy):
+        """
+        Runs a block inside a savepoint with the lock timeout of its policy, so a lock
+        timeout or error only rolls back this block and leaves the unit transaction usable.
+
+        :param cur: psycopg2 cursor
+        :type cur: [cursor]
+        :param block: Block from Builder.read_blocks
+        :type block: [Block]
+        :param policy: Policy from block_policy
+        :type policy: [dict]
+        """
+        cur.execute("SAVEPOINT odyssey_block")
+        try:
+            cur.execute("SET LOCAL lock_timeout = %s", (policy['lock_timeout'],))
+            cur.execute(block.sql)
+        except psycopg2.Error:
+            cur.execute("ROLLBACK TO SAVEPOINT odyssey_block")
+            raise
+        cur.execute("RELEASE SAVEPOINT odyssey_block")
+
+    def build_units(self, blocks):
+        """
+        Splits the blocks of a build into transactional units: consecutive blocks whose
+        manifest entries name the same group, blocks without a group counting as one group.
+        Chunked and online blocks commit outside the transaction, so each is a unit of its
+        own and the blocks before it are committed and recorded as a unit first. A build
+        that names no groups and has no such blocks is a single unit.
+
+        :param blocks: List of blocks from Builder.read_blocks
+        :type blocks: [list]
+        :return: List of (group name, block positions) tuples in order
+        :rtype: [list]
+        """
+        units = []
+        joinable = False
+        for position, block in enumerate(blocks):
+            group = block.entry.get('group') if block.entry is not None else None
+            outside = self.chunked_block(block) or self.online_statements(block) is not None
+            if joinable and not outside and units[-1][0] == group:
+                units[-1][1].append(position)
+            else:
+                units.append((group, [position]))
+            joinable = not outside
+        return units or [(None, [])]
+
+    def chunked_block(self, block):
+        return block.type_key == 'dml' and block.entry is not None and bool(block.entry.get('chunk_size'))
+
+    def completed_units(self, cur, build_number, direction):
+        cur.execute(f"SELECT unit, name FROM {GROUP_TABLE} WHERE build = %s AND direction = %s", (build_number, direction))
+        return {x[0]: x[1] for x in cur.fetchall()}
+
+    def apply_build(self, conn, build_number, direction, blocks, catalog=None, ledger_builds=None):
+        """
+        Applies the blocks of one build and records it in the ledger. The blocks run in
+        the transactional units of build_units, each committed on its own and recorded in
+        the group table, so a rerun of a build that failed resumes from the first unit that
+        did not commit. The last unit commits with the ledger.
+
+        Every block runs in a savepoint. A block that hits its lock timeout is retried with
+        exponential backoff. When its policy allows reordering, an index block is moved
+        behind the following index blocks of its unit on other relations, so they run while
+        it waits. Nothing else can depend on them. A block that fails otherwise is rolled back to its savepoint and, per the
+        on_error of its manifest entry or policy, retried, skipped or fails the build.
+
+        The time each block took and the size of its relation before the build are
+        recorded with its unit, for Estimator to predict pending builds from.
+
+        :param conn: psycopg2 connection
+        :type conn: [connection]
+        :param build_number: Build number
+        :type build_number: [string]
+        :param direction: up or down
+        :type direction: [string]
+        :param blocks: List of blocks from Builder.read_blocks
+        :type blocks: [list]
+        :param catalog: Catalog index used to apply the drift policies, None to run every block as is
+        :type catalog: [Catalog]
+        :param ledger_builds: Builds to record in the ledger, defaults to build_number
+        :type ledger_builds: [list]
+        :return: Blocks skipped by their on_error policy, as name|type
+        :rtype: [list]
+        """
+        relations = {}
+        for position, block in enumerate(blocks):
+            relation = self.block_relation(block)
+            relations[position] = self.relation_key(relation) if relation else None
+        units = self.build_units(blocks)
+        skipped = []
+        with conn.cursor() as cur:
+            completed = self.completed_units(cur, build_number, direction) if len(units) > 1 else {}
+            sizes = self.block_sizes(cur, {x for x in relations.values() if x})
+            for unit, (group, positions) in enumerate(units):
+                if unit in completed and completed[unit] == group:
+                    logger.info(f"Group {group or unit} of build {build_number} {direction} was committed by an earlier run, resuming after it.")
+                    continue
+                timings = self.apply_blocks(conn, cur, build_number=build_number, direction=direction,
+                                            blocks=[(x, blocks[x]) for x in positions], catalog=catalog,
+                                            relations=relations, sizes=sizes, skipped=skipped)
+                self.record_timings(cur, build_number=build_number, direction=direction, timings=timings)
+                if unit < len(units) - 1:
+                    cur.execute(f"INSERT INTO {GROUP_TABLE} (build, direction, unit, name) VALUES (%s, %s, %s, %s)",
+                                (build_number, direction, unit, group))
+                    conn.commit()
+                    logger.info(f"Committed group {group or unit} of build {build_number} {direction}.")
+            if direction == "up":
+                for ledger_build in ledger_builds or [build_number]:
+                    cur.execute(f"INSERT INTO {LEDGER_TABLE} (build) VALUES (%s)", (ledger_build,))
+            else:
+                cur.execute(f"DELETE FROM {LEDGER_TABLE} WHERE build = %s", (build_number,))
+            cur.execute(f"DELETE FROM {CHECKPOINT_TABLE} WHERE build = %s AND direction = %s", (build_number, direction))
+            if len(units) > 1:
+                cur.execute(f"DELETE FROM {GROUP_TABLE} WHERE build = %s AND direction = %s", (build_number, direction))
+        conn.commit()
+        return skipped
+
+    def apply_blocks(self, conn, cur, build_number, direction, blocks, catalog, relations, sizes, skipped):
+        """
+        Runs the blocks of one transactional unit, see apply_build.
+
+        :param blocks: List of (position, block) tuples
+        :type blocks: [list]
+        :param relations: Dictionary of block position to relation key
+        :type relations: [dict]
+        :param sizes: Relation sizes from block_sizes
+        :type sizes: [dict]
+        :param skipped: List the blocks skipped by their on_error policy are appended to
+        :type skipped: [list]
+        :return: Block timings for record_timings
+        :rtype: [list]
+        """
+        queue = deque((position, block, 0, 0) for (position, block) in blocks)
+        timings = []
+        while queue:
+            position, block, attempt, ready_at = queue.popleft()
+            policy = self.block_policy(block)
+            wait = ready_at - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            if catalog is not None:
+                decision = self.drift_decision(block, catalog, policy)
+                if decision == 'skip':
+                    logger.info(f"Skipping block {block.name}|{block.type} of build {build_number}, the database already matches it.")
+                    continue
+                if decision == 'fail':
+                    raise DriftError(f"Block {block.name}|{block.type} of build {build_number} does not match the database catalog.")
+                if decision == 'guard':
+                    block = self.guard_block(block)
+            logger.debug(f"Applying {build_number} {direction} block: {block.name}|{block.type}")
+            online = self.online_statements(block)
+            chunked = self.chunked_block(block)
+            started = time.monotonic()
+            try:
+                if chunked:
+                    self.execute_chunked(conn, build_number=build_number, direction=direction,
+                                         position=position, block=block)
+                elif online is None:
+                    self.execute_block(cur, block=block, policy=policy)
+                else:
+                    self.execute_online(conn, build_number=build_number, block=block, statements=online)
+            except errors.LockNotAvailable:
+                # Online and chunked blocks retry their statements themselves.
+                if online is not None or chunked:
+                    raise
+                if attempt >= policy['retries']:
+                    logger.error(f"Block {block.name}|{block.type} of build {build_number} did not get its locks after {attempt + 1} attempts.")
+                    raise
+                delay = self.backoff_delay(policy, attempt)
+                logger.warning(f"Lock timeout on block {block.name}|{block.type} of build {build_number}, retrying in {delay:.2f}s.")
+                retry = (position, block, attempt + 1, time.monotonic() + delay)
+                if policy['reorder']:
+                    index = 0
+                    while index < len(queue) and self.independent_blocks(block, queue[index][1]):
+                        index += 1
+                    queue.insert(index, retry)
+                else:
+                    queue.appendleft(retry)
+                continue
+            except psycopg2.Error as e:
+                # Online and chunked blocks commit outside the unit, there is no savepoint to return to.
+                on_error = block.entry.get('on_error', policy['on_error']) if block.entry is not None else policy['on_error']
+                if online is not None or chunked or on_error not in ('retry', 'skip'):
+                    raise
+                if on_error == 'skip':
+                    logger.warning(f"Skipping block {block.name}|{block.type} of build {build_number} after it failed: {e}")
+                    skipped.append(f"{block.name}|{block.type}")
+                    continue
+                if attempt >= policy['retries']:
+                    logger.error(f"Block {block.name}|{block.type} of build {build_number} failed after {attempt + 1} attempts.")
+                    raise
+                delay = self.backoff_delay(policy, attempt)
+                logger.warning(f"Block {block.name}|{block.type} of build {build_number} failed, retrying in {delay:.2f}s: {e}")
+                queue.appendleft((position, block, attempt + 1, time.monotonic() + delay))
+                continue
+            timings.append((position, block, relations[position], time.monotonic() - started,
+                            sizes.get(relations[position], (None, None))))
+            if catalog is not None:
+                catalog.record(block.type, block.name, self.block_action(block))
+        return timings
+
+    def execute_chunked(self, conn, build_number, direction, position, block):
+        """
+        Runs a keyset paginated dml template in batches, each in its own transaction.
+        The template receives the parameters %(last_key)s, None for the first batch, and
+        %(chunk_size)s, and must return the key of every row it touched as its first column,
+        for example:
+
+            WITH batch AS (SELECT id FROM t WHERE %(last_key)s IS NULL OR id > %(last_key)s ORDER BY id LIMIT %(chunk_size)s)
+            UPDATE t SET x = 1 FROM batch WHERE t.id = batch.id RETURNING t.id;
+
+        The largest returned key is checkpointed with the batch, so an interrupted block
+        resumes after the last committed batch. The block ends when a batch returns no rows.
+
+        :param conn: psycopg2 connection
+        :type conn: [connection]
+        :param build_number: Build number
+        :type build_number: [string]
+        :param direction: up or down
+        :type direction: [string]
+        :param position: Position of the block in the migration
+        :type position: [int]
+        :param block: Block from Builder.read_blocks with its manifest entry
+        :type block: [Block]
+        """
+        policy = self.block_policy(block)
+        chunk_size = int(block.entry.get('chunk_size'))
+        statement = block.sql.strip().rstrip(';')
+        conn.commit()
+
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT last_key, rows FROM {CHECKPOINT_TABLE} WHERE build = %s AND direction = %s AND block = %s",
+                        (build_number, direction, position))
+            checkpoint = cur.fetchone()
+            conn.commit()
+            last_key, total = (json.loads(checkpoint[0]), checkpoint[1]) if checkpoint else (None, 0)
+            if checkpoint:
+                logger.info(f"Resuming {block.name} of build {build_number} after key {last_key}, {total} rows done.")
+
+            started = time.monotonic()
+            done_here = 0
+            batch = 0
+            attempt = 0
+            while True:
+                batch_started = time.monotonic()
+                try:
+                    cur.execute("SET LOCAL lock_timeout = %s", (policy['lock_timeout'],))
+                    cur.execute(statement, {'last_key': last_key, 'chunk_size': chunk_size})
+                    keys = [x[0] for x in cur.fetchall()]
+                except errors.LockNotAvailable:
+                    conn.rollback()
+                    if attempt >= policy['retries']:
+                        raise
+                    delay = self.backoff_delay(policy, attempt)
+                    logger.warning(f"Lock timeout on batch {batch + 1} of {block.name}, retrying in {delay:.2f}s.")
+                    time.sleep(delay)
+                    attempt += 1
+                    continue
+                attempt = 0
+                if not keys:
+                    conn.commit()
+                    break
+                batch += 1
+                last_key = max(keys)
+                total += len(keys)
+                done_here += len(keys)
+                cur.execute(f"INSERT INTO {CHECKPOINT_TABLE} (build, direction, block, last_key, rows) VALUES (%s, %s, %s, %s, %s) "
+                            "ON CONFLICT (build, direction, block) DO UPDATE SET last_key = EXCLUDED.last_key, rows = EXCLUDED.rows, updated_at = now()",
+                            (build_number, direction, position, json.dumps(last_key, default=str), total))
+                conn.commit()
+                elapsed = time.monotonic() - started
+                logger.info(f"{block.name} batch {batch}: {len(keys)} rows in {time.monotonic() - batch_started:.2f}s, "
+                            f"{total} rows total, {done_here / elapsed if elapsed else 0:.0f} rows/s.")
+        logger.info(f"Finished {block.name} of build {build_number}: {total} rows.")
+
+    def concurrent_index_name(self, match):
+        """
+        Qualified name of a concurrent index, an unqualified index is created in the schema of its table.
+        """
+        name, table = match.group('name'), match.group('table')
+        if '.' not in name and '.' in table:
+            return f"{table.rsplit('.', 1)[0]}.{name}"
+        return name
+
+    def invalid_index(self, cur, name):
+        """
+        Whether an index exists and is marked invalid, as a failed CREATE INDEX CONCURRENTLY leaves it.
+
+        :param cur: psycopg2 cursor
+        :type cur: [cursor]
+        :param name: Index name as written in the sql
+        :type name: [string]
+        :return: True when the index is invalid
+        :rtype: [bool]
+        """
+        cur.execute("SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)", (name,))
+        row = cur.fetchone()
+        return bool(row and row[0])
+
+    def unvalidated_constraint(self, cur, table, name):
+        """
+        Whether a constraint exists on a table and is NOT VALID, as a failed VALIDATE CONSTRAINT leaves it.
+
+        :param cur: psycopg2 cursor
+        :type cur: [cursor]
+        :param table: Table name as written in the sql
+        :type table: [string]
+        :param name: Constraint name as written in the sql
+        :type name: [string]
+        :return: True when the constraint is not validated
+        :rtype: [bool]
+        """
+        name = name[1:-1] if name.startswith('"') else name.lower()
+        cur.execute("SELECT NOT convalidated FROM pg_constraint WHERE conrelid = to_regclass(%s) AND conname = %s", (table, name))
+        row = cur.fetchone()
+        return bool(row and row[0])
+
+    def execute_online(self, conn, build_number, block, statements):
+        """
+        Commits the build transaction so far and runs the statements of an online block
+        one at a time in autocommit mode. Statements that hit the lock timeout are retried
+        on their own with the block policy.
+
+        A CREATE INDEX CONCURRENTLY that fails for any reason leaves an invalid index
+        behind, so an invalid index of its name is dropped concurrently before every
+        attempt, including the first attempt of a rerun. A valid index, such as one a
+        guarded IF NOT EXISTS statement found, is kept. An unnamed concurrent index cannot
+        be found to drop and is not retried. A constraint a failed VALIDATE CONSTRAINT left
+        NOT VALID is not added again, the statement validating it follows.
+
+        :param conn: psycopg2 connection
+        :type conn: [connection]
+        :param build_number: Build number
+        :type build_number: [string]
+        :param block: Block from Builder.read_blocks
+        :type block: [Block]
+        :param statements: Statements from online_statements
+        :type statements: [list]
+        """
+        logger.info(f"Running {block.type} block {block.name} of build {build_number} outside the transaction.")
+        policy = self.block_policy(block)
+        conn.commit()
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SET lock_timeout = %s", (policy['lock_timeout'],))
+                for statement in statements:
+                    logger.debug(f"Online statement: {statement}")
+                    concurrent = CONCURRENT_INDEX.match(statement)
+                    index = self.concurrent_index_name(concurrent) if concurrent and concurrent.group('name') else None
+                    constraint = ADD_CONSTRAINT.match(statement) if NOT_VALID.search(statement) else None
+                    attempt = 0
+                    while True:
+                        try:
+                            if index and self.invalid_index(cur, index):
+                                logger.warning(f"Dropping invalid index {index} left by an earlier attempt.")
+                                cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index}")
+                            if constraint and self.unvalidated_constraint(cur, constraint.group('table'), constraint.group('name')):
+                                logger.info(f"Constraint {constraint.group('name')} was added NOT VALID by an earlier attempt.")
+                                break
+                            cur.execute(statement)
+                            break
+                        except errors.LockNotAvailable:
+                            if concurrent and not concurrent.group('name'):
+                                logger.error(f"Unnamed concurrent index of {block.name} timed out and cannot be retried, "
+                                             f"drop any invalid index left on {concurrent.group('table')}.")
+                                raise
+                            if attempt >= policy['retries']:
+                                raise
+                            delay = self.backoff_delay(policy, attempt)
+                            logger.warning(f"Lock timeout on {statement}, retrying in {delay:.2f}s.")
+                            time.sleep(delay)
+                            attempt += 1
+                cur.execute("RESET lock_timeout")
+        finally:
+            conn.autocommit = False
+
+    def migrate_database(self, database, builds, direction="up", steps=None, baseline=None, chain=None, lock="block"):
+        """
+        Migrates one database, applying the builds its ledger says are outstanding.
+        Failures are caught and reported so one database cannot stop the others.
+
+        With a chain, runners on several nodes coordinate through a session advisory lock
+        keyed by database and chain. The runner holding the lock migrates and publishes
+        its result, runners that waited for it take that result instead of migrating again.
+
+        :param database: Connection dictionary
+        :type database: [dict]
+        :param builds: List of (build number, blocks) tuples in the order to apply them
+        :type builds: [list]
+        :param direction: up or down
+        :type direction: [string]
+        :param steps: Maximum number of builds to apply, all when None
+        :type steps: [int]
+        :param baseline: Tuple of baseline build number, squashed build numbers and blocks, applied instead of the squashed builds when the ledger is empty
+        :type baseline: [tuple]
+        :param chain: Migration chain hash from Builder.chain_hash, no coordination when None
+        :type chain: [string]
+        :param lock: block to wait for the migration lock, exit to return at once with status locked
+        :type lock: [string]
+        :return: Result dictionary for the database
+        :rtype: [dict]
+        """
+        result = {'database': database.get('NAME'), 'host': database.get('HOST'),
+                  'status': 'success', 'applied': [], 'skipped': [], 'error': None}
+        conn = None
+        build_number = None
+        lock_key = None
+        run_key = self.migration_run_key(chain, direction, builds, steps) if chain else None
+        try:
+            conn = self.connect(database)
+            if chain:
+                waited_from = self.server_time(conn)
+                if not self.acquire_migration_lock(conn, self.migration_lock_key(database, chain), wait=lock != "exit"):
+                    logger.warning(f"Another runner is migrating {result['database']}, exiting.")
+                    result.update({'status': 'locked', 'error': "Another runner holds the migration lock."})
+                    return result
+                lock_key = self.migration_lock_key(database, chain)
+            # Created under the lock, runners creating the tables at once fail on the pg_type names.
+            self.ensure_ledger(conn)
+            if chain:
+                published = self.published_result(conn, run_key, since=waited_from)
+                if published is not None:
+                    logger.info(f"{result['database']} was migrated by {published['published_by']} while waiting: {published['status']}")
+                    result.update(published)
+                    return result
+            applied = set(self.applied_builds(conn))
+            if baseline and not applied and direction == "up":
+                build_number, squashed, blocks = baseline
+                logger.info(f"Migrating {result['database']} from baseline {build_number}")
+                skipped = self.apply_build(conn, build_number=build_number, direction=direction, blocks=blocks,
+                                           ledger_builds=squashed)
+                result['skipped'].extend(f"{build_number}:{x}" for x in skipped)
+                result['applied'].append(f"{build_number}_baseline")
+                applied = set(squashed)
+            outstanding = [x for x in builds if (x[0] in applied) == (direction == "down")]
+            catalog = self.snapshot_catalog(conn) if outstanding and self.drift_enabled() else None
+            for build_number, blocks in outstanding[:steps]:
+                logger.info(f"Migrating {result['database']} {direction}: {build_number}")
+                skipped = self.apply_build(conn, build_number=build_number, direction=direction, blocks=blocks, catalog=catalog)
+                result['skipped'].extend(f"{build_number}:{x}" for x in skipped)
+                result['applied'].append(build_number)
+        except Exception as e:
+            logger.error(f"Migration of {result['database']} failed at build {build_number}: {e}")
+            if conn is not None and not conn.closed:
+                conn.rollback()
+            result.update({'status': 'failed', 'failed_build': build_number, 'error': str(e)})
+        finally:
+            if conn is not None and lock_key is not None and not conn.closed and 'published_by' not in result:
+                try:
+                    self.publish_result(conn, run_key, result)
+                    self.release_migration_lock(conn, lock_key)
+                except psycopg2.Error as e:
+                    logger.error(f"Could not publish the migration result of {result['database']}: {e}")
+            if conn is not None:
+                conn.close()
+        return result
+
+    def admin_connection(self, database):
+        """
+        Opens an autocommit connection to the maintenance database of a server, for
+        statements such as CREATE DATABASE that cannot run in a transaction.
+
+        :param database: Connection dictionary of any database on the server
+        :type database: [dict]
+        :return: psycopg2 connection
+        :rtype: [connection]
+        """
+        conn = self.connect(dict(database, NAME=database.get('MAINTENANCE_NAME', 'postgres')))
+        conn.autocommit = True
+        return conn
+
+    def database_exists(self, conn, name):
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1 FROM pg_database WHERE datname = %s", (name,))
+            return cur.fetchone() is not None
+
+    def create_database(self, conn, name, template='template0'):
+        with conn.cursor() as cur:
+            cur.execute(sql.SQL("CREATE DATABASE {} TEMPLATE {}").format(sql.Identifier(name), sql.Identifier(template)))
+
+    def drop_database(self, conn, name):
+        with conn.cursor() as cur:
+            cur.execute(sql.SQL("DROP DATABASE IF EXISTS {}").format(sql.Identifier(name)))
+
+    def provision_template(self, database, name, builds, baseline=None, load=None):
+        """
+        Creates a migrated template database unless it already exists. The name should carry
+        the hash of the migration chain, so a template is reused until the chain changes.
+        Provisioning is serialised with an advisory lock so concurrent test sessions build
+        the template once.
+
+        :param database: Connection dictionary of the server
+        :type database: [dict]
+        :param name: Template database name
+        :type name: [string]
+        :param builds: List of (build number, blocks) tuples in the order to apply them
+        :type builds: [list]
+        :param baseline: Baseline for new databases, see migrate_database
+        :type baseline: [tuple]
+        :param load: Callable receiving a connection to the migrated template, to preload fixtures
+        :type load: [function]
+        :return: Template database name
+        :rtype: [string]
+        """
+        admin = self.admin_connection(database)
+        try:
+            with admin.cursor() as cur:
+                cur.execute("SELECT pg_advisory_lock(%s)", (zlib.crc32(name.encode('UTF-8')),))
+            if self.database_exists(admin, name):
+                logger.info(f"Reusing template database {name}")
+                return name
+
+            building = f"{name}_building"
+            self.drop_database(admin, building)
+            self.create_database(admin, building)
+            template = dict(database, NAME=building)
+            result = self.migrate_database(template, builds=builds, baseline=baseline)
+            if result['status'] != 'success':
+                self.drop_database(admin, building)
+                raise RuntimeError(f"Migrating template database {name} failed: {result['error']}")
+            if load is not None:
+                conn = self.connect(template)
+                try:
+                    load(conn)
+                finally:
+                    conn.close()
+
+            with admin.cursor() as cur:
+                cur.execute(sql.SQL("ALTER DATABASE {} RENAME TO {}").format(sql.Identifier(building), sql.Identifier(name)))
+                cur.execute(sql.SQL("ALTER DATABASE {} WITH IS_TEMPLATE true ALLOW_CONNECTIONS false").format(sql.Identifier(name)))
+            logger.info(f"Created template database {name}")
+            return name
+        finally:
+            admin.close()
+
+    def clone_database(self, database, template, name):
+        """
+        Creates a database as a copy of a template database.
+
+        :param database: Connection dictionary of the server
+        :type database: [dict]
+        :param template: Template database name
+        :type template: [string]
+        :param name: New database name
+        :type name: [string]
+        :return: Connection dictionary of the new database
+        :rtype: [dict]
+        """
+        admin = self.admin_connection(database)
+        try:
+            self.create_database(admin, name, template=template)
+        finally:
+            admin.close()
+        return dict(database, NAME=name)
+
+    def remove_database(self, database, name):
+        admin = self.admin_connection(database)
+        try:
+            self.drop_database(admin, name)
+        finally:
+            admin.close()
+
+    async def migrate_many(self, databases, builds, direction="up", steps=None, concurrency=4, baseline=None, chain=None, lock="block"):
+        """
+        Migrates several databases concurrently. Each database runs on its own
+        connection in a worker thread, at most concurrency at a time.
+
+        :param databases: List of connection dictionaries
+        :type databases: [list]
+        :param builds: List of (build number, blocks) tuples in the order to apply them
+        :type builds: [list]
+        :param direction: up or down
+        :type direction: [string]
+        :param steps: Maximum number of builds to apply per database, all when None
+        :type steps: [int]
+        :param concurrency: Maximum number of databases migrated at once
+        :type concurrency: [int]
+        :param baseline: Baseline for new databases, see migrate_database
+        :type baseline: [tuple]
+        :param chain: Migration chain hash for cross node coordination, see migrate_database
+        :type chain: [string]
+        :param lock: Migration lock wait mode, block or exit
+        :type lock: [string]
+        :return: Consolidated report of every database
+        :rtype: [dict]
+        """
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            async def shard(database):
+                async with semaphore:
+                    return await loop.run_in_executor(
+                        pool, self.migrate_database, database, builds, direction, steps, baseline, chain, lock)
+
+            results = await asyncio.gather(*[shard(x) for x in databases])
+
+        return {
+            'direction': direction,
+            'databases': len(results),
+            'succeeded': len([x for x in results if x['status'] == 'success']),
+            'failed': len([x for x in results if x['status'] not in ('success', 'locked')]),
+            'locked': len([x for x in results if x['status'] == 'locked']),
+            'results': results,
+        }
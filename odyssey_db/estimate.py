@@ -0,0 +1,129 @@
+import logging
+import math
+import statistics
+
+logger = logging.getLogger(__name__)
+
+# Two sided normal quantile of the prediction bounds, about 95%.
+CONFIDENCE_Z = 1.96
+
+# Throughput assumed for a relation when no block of the type has run before, in pages per second.
+DEFAULT_PAGES_PER_SECOND = 10000
+
+# Time assumed for a statement when nothing is known about the block.
+DEFAULT_STATEMENT_SECONDS = 0.05
+
+# Bounds are this factor below and above the estimate when it rests on a single sample or a default.
+SPREAD_FACTOR = 2
+DEFAULT_SPREAD_FACTOR = 4
+
+
+class Estimator:
+
+    def __init__(self, db_engine, history, sizes):
+        """
+        Predicts how long pending blocks take from the recorded timings of a database.
+
+        A block is estimated from, in order of preference, the earlier runs of the same
+        object scaled to the current size of its relation, the seconds per page (per row
+        for dml) of blocks of the same type, the seconds of blocks of the same type, and
+        finally the size of its relation or its statement count at a default throughput.
+        Timings only count for blocks of the same direction, the down block of an object
+        rarely costs what its up block does.
+
+        :param db_engine: Database engine used to find the relation of a block
+        :type db_engine: [Engine]
+        :param history: Timings from Engine.timing_history
+        :type history: [list]
+        :param sizes: Relation sizes from Engine.relation_sizes
+        :type sizes: [dict]
+        """
+        self.db_engine = db_engine
+        self.sizes = sizes
+        self.by_object = {}
+        self.by_type = {}
+        for item in history:
+            self.by_object.setdefault((item['direction'], item['name'].lower(), item['type'].lower()), []).append(item)
+            self.by_type.setdefault((item['direction'], item['type'].lower()), []).append(item)
+
+    def size_of(self, objtype, relpages, reltuples):
+        """
+        Size a block scales with: rows for dml, pages for everything else.
+        """
+        size = reltuples if objtype.lower() == 'dml' else relpages
+        return size if size is not None and size > 0 else None
+
+    def interval(self, values):
+        """
+        Mean of the samples with a normal prediction interval for one more run.
+
+        :param values: Sample durations in seconds
+        :type values: [list]
+        :return: Tuple of estimate, low and high
+        :rtype: [tuple]
+        """
+        mean = statistics.mean(values)
+        if len(values) == 1:
+            return mean, mean / SPREAD_FACTOR, mean * SPREAD_FACTOR
+        half = CONFIDENCE_Z * statistics.stdev(values) * math.sqrt(1 + 1 / len(values))
+        return mean, max(0.0, mean - half), mean + half
+
+    def estimate_block(self, block, direction="up", statements=None):
+        """
+        Estimates the wall time of one block.
+
+        :param block: Block from Builder.read_blocks
+        :type block: [Block]
+        :param direction: up or down, the direction of the migration the block runs in
+        :type direction: [string]
+        :param statements: Statement count of the block, counted when not given
+        :type statements: [int]
+        :return: Dictionary with seconds, low, high, the basis of the estimate and its sample count
+        :rtype: [dict]
+        """
+        relation = self.db_engine.block_relation(block)
+        current = None
+        if relation:
+            current = self.size_of(block.type, *self.sizes.get(self.db_engine.relation_key(relation), (None, None)))
+
+        same = self.by_object.get((direction, block.name.lower(), block.type_key), [])
+        of_type = self.by_type.get((direction, block.type_key), [])
+        scaled = [x['seconds'] * current / self.size_of(block.type, x['relpages'], x['reltuples'])
+                  for x in same if current and self.size_of(block.type, x['relpages'], x['reltuples'])]
+        rates = [x['seconds'] / self.size_of(block.type, x['relpages'], x['reltuples'])
+                 for x in of_type
+                 if self.size_of(block.type, x['relpages'], x['reltuples'])]
+
+        if scaled:
+            basis, samples, (seconds, low, high) = 'history', len(scaled), self.interval(scaled)
+        elif same:
+            basis, samples, (seconds, low, high) = 'history', len(same), self.interval([x['seconds'] for x in same])
+        elif current and rates:
+            basis, samples = 'rate', len(rates)
+            seconds, low, high = (x * current for x in self.interval(rates))
+        elif of_type:
+            basis, samples = 'type', len(of_type)
+            seconds, low, high = self.interval([x['seconds'] for x in of_type])
+        else:
+            basis, samples = 'default', 0
+            if current and block.type_key != 'dml':
+                seconds = current / DEFAULT_PAGES_PER_SECOND
+            else:
+                if statements is None:
+                    statements = len(self.db_engine.split_statements(block.sql))
+                seconds = statements * DEFAULT_STATEMENT_SECONDS
+            low, high = seconds / DEFAULT_SPREAD_FACTOR, seconds * DEFAULT_SPREAD_FACTOR
+        return {'seconds': round(seconds, 3), 'low': round(low, 3), 'high': round(high, 3),
+                'basis': basis, 'samples': samples}
+
+    def combine(self, estimates):
+        """
+        Adds up block or build estimates. The bounds are added as well, which assumes the
+        errors of the blocks run the same way and keeps them on the safe side.
+
+        :param estimates: Dictionaries from estimate_block or combine
+        :type estimates: [list]
+        :return: Dictionary with seconds, low and high
+        :rtype: [dict]
+        """
+        return {x: round(sum(y[x] for y in estimates), 3) for x in ('seconds', 'low', 'high')}
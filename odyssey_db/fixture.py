@@ -1,7 +1,237 @@
+import base64
+import json
 import logging
+from pathlib import Path
+from psycopg2 import sql
+from psycopg2.extras import execute_values, Json, RealDictCursor
 
 logger = logging.getLogger(__name__)
 
+# Every foreign key as child table, parent table and the paired column lists.
+FOREIGN_KEYS_QUERY = """
+SELECT cn.nspname || '.' || cr.relname, pn.nspname || '.' || pr.relname,
+       array_agg(ca.attname::text ORDER BY k.ord), array_agg(pa.attname::text ORDER BY k.ord)
+FROM pg_constraint c
+JOIN pg_class cr ON cr.oid = c.conrelid
+JOIN pg_namespace cn ON cn.oid = cr.relnamespace
+JOIN pg_class pr ON pr.oid = c.confrelid
+JOIN pg_namespace pn ON pn.oid = pr.relnamespace
+CROSS JOIN LATERAL unnest(c.conkey, c.confkey) WITH ORDINALITY AS k(child, parent, ord)
+JOIN pg_attribute ca ON ca.attrelid = c.conrelid AND ca.attnum = k.child
+JOIN pg_attribute pa ON pa.attrelid = c.confrelid AND pa.attnum = k.parent
+WHERE c.contype = 'f'
+GROUP BY c.oid, cn.nspname, cr.relname, pn.nspname, pr.relname
+"""
+
+# Temp tables holding the ctid key set of each subset table.
+SUBSET_TABLE = 'odyssey_subset_{}'
+
+# Key of the json object a bytea value is written as, holding the base64 of its bytes.
+BYTES_KEY = '$bytes'
+
+# Key of the json object a json or jsonb value is written as, so it loads as json and
+# not as a row, record or array. Type oids of json and jsonb.
+JSON_KEY = '$json'
+JSON_TYPES = (114, 3802)
+
+
+def encode_value(value):
+    """
+    Writes values json has no type for: bytea as a BYTES_KEY object, anything else as its text.
+    """
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {BYTES_KEY: base64.b64encode(bytes(value)).decode('ascii')}
+    return str(value)
+
+
+def decode_value(obj):
+    """
+    Reads the BYTES_KEY objects written by encode_value back as bytes and the JSON_KEY
+    objects written by stream_rows as json.
+    """
+    if len(obj) == 1 and BYTES_KEY in obj:
+        return base64.b64decode(obj[BYTES_KEY])
+    if len(obj) == 1 and JSON_KEY in obj:
+        return Json(obj[JSON_KEY])
+    return obj
+
 class Fixture:
     def __init__(self):
-        pass
\ No newline at end of file
+        pass
+
+    def read_fixture(self, file):
+        """
+        Reads a json fixture file.
+
+        :param file: Path to a fixture file holding {"table": "schema.table", "rows": [{column: value}, ...]}
+        :type file: [string]
+        :return: Tuple of table name and rows
+        :rtype: [tuple]
+        """
+        with open(file) as f:
+            fixture = json.load(f, object_hook=decode_value)
+        return fixture['table'], fixture['rows']
+
+    def load(self, conn, files):
+        """
+        Loads fixture files into a database in the order given, in one transaction.
+        Deferrable constraints are deferred to the commit, so files of tables in a
+        foreign key cycle load in any order.
+
+        :param conn: psycopg2 connection
+        :type conn: [connection]
+        :param files: Paths to fixture files
+        :type files: [list]
+        :return: Number of rows loaded
+        :rtype: [int]
+        """
+        total = 0
+        with conn.cursor() as cur:
+            cur.execute("SET CONSTRAINTS ALL DEFERRED")
+            for file in files:
+                table, rows = self.read_fixture(file)
+                if not rows:
+                    continue
+                columns = list(rows[0])
+                statement = sql.SQL("INSERT INTO {} ({}) VALUES %s").format(
+                    sql.Identifier(*table.split('.')), sql.SQL(', ').join(map(sql.Identifier, columns)))
+                execute_values(cur, statement.as_string(cur), [tuple(x[c] for c in columns) for x in rows])
+                logger.info(f"Loaded {len(rows)} rows into {table} from {Path(file).name}")
+                total += len(rows)
+        conn.commit()
+        return total
+
+    def foreign_keys(self, cur):
+        """
+        Reads the foreign keys of the database.
+
+        :param cur: psycopg2 cursor
+        :type cur: [cursor]
+        :return: Dictionary of child table to a list of (parent table, child columns, parent columns)
+        :rtype: [dict]
+        """
+        cur.execute(FOREIGN_KEYS_QUERY)
+        keys = {}
+        for child, parent, child_columns, parent_columns in cur.fetchall():
+            keys.setdefault(child, []).append((parent, child_columns, parent_columns))
+        return keys
+
+    def load_order(self, tables, foreign_keys):
+        """
+        Orders tables so every table comes after the tables it references. Tables in a
+        reference cycle are appended in name order.
+
+        :param tables: Table names
+        :type tables: [list]
+        :param foreign_keys: Foreign keys from foreign_keys
+        :type foreign_keys: [dict]
+        :return: Table names in load order
+        :rtype: [list]
+        """
+        depends = {x: {y[0] for y in foreign_keys.get(x, []) if y[0] in tables and y[0] != x} for x in tables}
+        order = []
+        while len(order) < len(tables):
+            ready = sorted(x for x in depends if x not in order and depends[x] <= set(order))
+            if not ready:
+                cycle = sorted(x for x in depends if x not in order)
+                logger.warning(f"Foreign key cycle between {cycle}, their foreign keys must be DEFERRABLE to load them.")
+                order.extend(cycle)
+                break
+            order.extend(ready)
+        return order
+
+    def dump_subset(self, conn, seeds, folder, batch_size=10000):
+        """
+        Dumps a referentially consistent subset of a database to fixture files. Each seed
+        clause selects the root rows of a table, then every row they reference through
+        foreign keys is added until no new rows are found. Key sets are kept as ctids in temp
+        tables and extended one generation at a time with set based joins, and the rows are
+        streamed to the fixture files through server side cursors. Everything is read in one
+        repeatable read snapshot.
+
+        :param conn: psycopg2 connection
+        :type conn: [connection]
+        :param seeds: Dictionary of schema.table to a clause appended to SELECT ... FROM table AS t
+        :type seeds: [dict]
+        :param folder: Folder to write the fixture files to
+        :type folder: [string]
+        :param batch_size: Rows fetched per round trip while streaming
+        :type batch_size: [int]
+        :return: Fixture files in load order
+        :rtype: [list]
+        """
+        conn.rollback()
+        key_tables = {}
+        with conn.cursor() as cur:
+            cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+            foreign_keys = self.foreign_keys(cur)
+
+            def key_table(table):
+                if table not in key_tables:
+                    key_tables[table] = SUBSET_TABLE.format(len(key_tables))
+                    cur.execute(sql.SQL("CREATE TEMP TABLE {} (row_id TID PRIMARY KEY, generation INT NOT NULL) ON COMMIT DROP").format(
+                        sql.Identifier(key_tables[table])))
+                return sql.Identifier(key_tables[table])
+
+            frontier = set()
+            for table, clause in seeds.items():
+                cur.execute(sql.SQL("INSERT INTO {} SELECT t.ctid, 0 FROM {} AS t {} ON CONFLICT DO NOTHING").format(
+                    key_table(table), sql.Identifier(*table.split('.')), sql.SQL(clause)))
+                logger.info(f"Seeded {cur.rowcount} rows of {table}")
+                frontier.add(table)
+
+            generation = 0
+            while frontier:
+                found = set()
+                for child in sorted(frontier):
+                    for parent, child_columns, parent_columns in foreign_keys.get(child, []):
+                        join = sql.SQL(' AND ').join(
+                            sql.SQL("p.{} = c.{}").format(sql.Identifier(x), sql.Identifier(y))
+                            for (x, y) in zip(parent_columns, child_columns))
+                        cur.execute(sql.SQL(
+                            "INSERT INTO {} SELECT DISTINCT p.ctid, %s FROM {} AS p JOIN {} AS c ON {} "
+                            "JOIN {} AS k ON k.row_id = c.ctid AND k.generation = %s ON CONFLICT DO NOTHING").format(
+                                key_table(parent), sql.Identifier(*parent.split('.')), sql.Identifier(*child.split('.')),
+                                join, key_table(child)), (generation + 1, generation))
+                        added = cur.rowcount
+                        if added > 0:
+                            logger.debug(f"{child} references {added} new rows of {parent}")
+                            found.add(parent)
+                frontier = found
+                generation += 1
+
+        files = []
+        Path(folder).mkdir(parents=True, exist_ok=True)
+        for position, table in enumerate(self.load_order(list(key_tables), foreign_keys), 1):
+            file = Path(folder, f"{position:04}_{table}.json")
+            rows = self.stream_rows(conn, table, key_tables[table], file, batch_size)
+            logger.info(f"Dumped {rows} rows of {table} to {file.name}")
+            files.append(file)
+        conn.rollback()
+        return files
+
+    def stream_rows(self, conn, table, key_table, file, batch_size):
+        """
+        Writes the rows of a table selected by its key set to a fixture file, batch_size
+        rows at a time. json and jsonb values are written as JSON_KEY objects.
+
+        :return: Number of rows written
+        :rtype: [int]
+        """
+        count = 0
+        with conn.cursor(name=f"odyssey_dump_{key_table}", cursor_factory=RealDictCursor) as cur:
+            cur.itersize = batch_size
+            cur.execute(sql.SQL("SELECT t.* FROM {} AS t JOIN {} AS k ON k.row_id = t.ctid ORDER BY k.row_id").format(
+                sql.Identifier(*table.split('.')), sql.Identifier(key_table)))
+            with open(file, 'w') as f:
+                f.write('{"table": %s, "rows": [' % json.dumps(table))
+                for row in cur:
+                    if count == 0:
+                        json_columns = [x.name for x in cur.description if x.type_code in JSON_TYPES]
+                    for column in json_columns:
+                        if row[column] is not None:
+                            row[column] = {JSON_KEY: row[column]}
+                    f.write(('\n' if count == 0 else ',\n') + json.dumps(row, default=encode_value))
+                    count += 1
+                f.write('\n]}\n')
+        return count
@@ -0,0 +1,135 @@
+import json
+import logging
+import hashlib
+from bisect import bisect_left, bisect_right
+from pathlib import Path
+import toml
+from odyssey_db.models import ManifestEntry
+
+try:
+    import tomllib
+except ImportError:
+    tomllib = None
+
+logger = logging.getLogger(__name__)
+
+# Parsed manifests of this process, keyed by manifest path.
+_parsed = {}
+
+
+class Manifest(dict):
+
+    def __init__(self, data, digest=None):
+        """
+        Parsed manifest. Behaves like the dictionary of builds returned by toml, with each up
+        and down entry held as a ManifestEntry, and keeps the build numbers sorted so build
+        lookups are binary searches.
+
+        :param data: Dictionary of build number to up / down entries
+        :type data: [dict]
+        :param digest: blake2s hexdigest of the manifest file the data was parsed from
+        :type digest: [string]
+        """
+        super().__init__({build: {direction: [ManifestEntry.coerce(x) for x in entries]
+                                  for (direction, entries) in section.items()}
+                          for (build, section) in data.items()})
+        self.digest = digest
+        self.builds = sorted(data)
+
+    def as_dict(self):
+        """
+        Manifest as plain toml shaped dictionaries, as stored in the JSON cache.
+        """
+        return {build: {direction: [x.as_dict() for x in entries] for (direction, entries) in section.items()}
+                for (build, section) in self.items()}
+
+    def next_pending(self, existing):
+        """
+        Finds the first build without migration files.
+
+        :param existing: Sorted build numbers that have migration files
+        :type existing: [list]
+        :return: Build number or None when every build exists
+        :rtype: [string]
+        """
+        index = bisect_right(self.builds, existing[-1]) if existing else 0
+        built = set(existing)
+        missing = next((x for x in self.builds[:index] if x not in built), None)
+        if missing is not None:
+            return missing
+        return self.builds[index] if index < len(self.builds) else None
+
+    def builds_from(self, build_number):
+        """
+        Build numbers greater than or equal to build_number, in order.
+        """
+        return self.builds[bisect_left(self.builds, build_number):]
+
+    def builds_upto(self, build_number):
+        """
+        Build numbers less than or equal to build_number, in order.
+        """
+        return self.builds[:bisect_right(self.builds, build_number)]
+
+
+def parse_manifest(text):
+    """
+    Parses manifest toml, with tomllib when the interpreter has it. Manifests tomllib
+    rejects but the toml package accepts are still read with toml.
+
+    :param text: Manifest contents
+    :type text: [string]
+    :return: Dictionary of toml contents
+    :rtype: [dict]
+    """
+    if tomllib is not None:
+        try:
+            return tomllib.loads(text)
+        except tomllib.TOMLDecodeError as e:
+            logger.debug(f"tomllib could not parse the manifest, falling back to toml: {e}")
+    return toml.loads(text)
+
+
+def load_manifest(manifest_file, cache_file=None, store=True):
+    """
+    Loads a manifest, reusing an earlier parse while the file hash is unchanged. Parses are
+    kept for the life of the process and, when cache_file is given, stored as JSON on disk
+    for later runs.
+
+    :param manifest_file: Path of the manifest
+    :type manifest_file: [string]
+    :param cache_file: Path of the on disk cache
+    :type cache_file: [string]
+    :param store: Write a new parse to cache_file, False only reads it
+    :type store: [bool]
+    :return: Parsed manifest
+    :rtype: [Manifest]
+    """
+    key = str(Path(manifest_file).resolve())
+    contents = Path(manifest_file).read_bytes()
+    digest = hashlib.blake2s(contents).hexdigest()
+
+    cached = _parsed.get(key)
+    if cached is not None and cached.digest == digest:
+        return cached
+
+    manifest = None
+    if cache_file and Path(cache_file).is_file():
+        try:
+            stored = json.loads(Path(cache_file).read_text())
+            if stored.get('digest') == digest:
+                manifest = Manifest(stored['manifest'], digest=digest)
+                logger.debug(f"Manifest loaded from cache: {cache_file}")
+        except (ValueError, KeyError, OSError) as e:
+            logger.debug(f"Ignoring manifest cache {cache_file}: {e}")
+
+    if manifest is None:
+        manifest = Manifest(parse_manifest(contents.decode('UTF-8')), digest=digest)
+        if cache_file and store:
+            try:
+                Path(cache_file).write_text(json.dumps({'digest': digest, 'manifest': manifest.as_dict()}))
+            except (TypeError, OSError) as e:
+                logger.debug(f"Manifest cache not written: {e}")
+
+    _parsed[key] = manifest
+    return manifest
@@ -1,16 +1,20 @@
 import logging
 from pathlib import Path
 from collections import defaultdict
+from odyssey_db.models import SourceObject
 
 logger = logging.getLogger(__name__)
 
 class Migrate:
 
-    def __init__(self):
+    def __init__(self, encoding="UTF-8"):
         """
         Init method of the Migrate class.
+
+        :param encoding: Encoding of the sql source files, the SOURCE_ENCODING setting
+        :type encoding: [string]
         """
-        pass
+        self.encoding = encoding
 
     def get_sql_files(self, srcpath):
         """
@@ -28,15 +32,18 @@ class Migrate:
 
         :param file_name: [string]: File name to inspect for SQL object name
         :param str_regex: [re.compile]: Regex object to search for object name.
-        :return: [list] - Returns a list containing the full path to the file the object type and the object name found in the file.
+        :return: [list] - Returns a list of SourceObject with the full path to the file, the object type and the object name found in the file.
         """
         file_info = []
-        with open(file_name) as f:
+        with open(file_name, encoding=self.encoding) as f:
             logger.debug(f"Reading file: {file_name}")
-            content = f.read()
+            try:
+                content = f.read()
+            except UnicodeDecodeError as e:
+                logger.error(f"Source file {file_name} is not valid {self.encoding}: {e}")
+                exit(-1)
             objname = None
             if str_regex.search(content):
-                objresults = [file_name]
                 objmatch = str_regex.search(content)
                 try:
                     objname = ([ x.strip() for x in objmatch.groups() if x is not None])
@@ -44,8 +51,7 @@ class Migrate:
                 except Exception as e:
                     objname = ([ x.strip() for x in objmatch.groups() if x is not None])
                     logger.warning(e, objname)
-                objresults.extend(*objname)
-                file_info.append(objresults)
+                file_info.append(SourceObject.of(file_name, *objname[0]))
         return file_info
 
     def read_sql_files(self, srcpath, str_regex):
@@ -57,7 +63,7 @@ class Migrate:
         :type srcpath: [string]
         :param str_regex: compiled regular expression
         :type str_regex: [re.compile]
-        :return: dictionary of sql object types with file path and object name as contents
+        :return: dictionary of sql object types with a list of SourceObject as contents
         :rtype: [default dictionary]
         """
         results = defaultdict(list)
@@ -65,9 +71,23 @@ class Migrate:
         for file in files:
             result = self.get_name_from_file(file_name=file, str_regex=str_regex)
             if len(result) > 0:
-                results[result[0][1]].append({'name':result[0][2],'file':str(result[0][0])})
+                results[result[0].type].append(result[0])
         return results
 
     def flatten_files_list(self, source_list):
         flat = [ item for (k,v) in source_list.items() for item in v ]
-        return flat
\ No newline at end of file
+        return flat
+
+    def index_files_list(self, source_list):
+        """
+        Indexes the source catalogue by lower case object name for constant time lookups.
+
+        :param source_list: dictionary of sql object types from read_sql_files
+        :type source_list: [default dictionary]
+        :return: dictionary of lower case object name to source file path
+        :rtype: [dict]
+        """
+        index = {}
+        for item in self.flatten_files_list(source_list=source_list):
+            index.setdefault(item.key, item.file)
+        return index
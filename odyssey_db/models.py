@@ -0,0 +1,62 @@
+from collections import namedtuple
+
+# Manifest entry keys with their own field, any other key is kept in ManifestEntry.options.
+ENTRY_FIELDS = ('name', 'type', 'action', 'location')
+
+
+class SourceObject(namedtuple('SourceObject', ['file', 'type', 'name', 'key'])):
+    """
+    SQL object found in a source file. Positional order matches the file, type and name
+    list get_name_from_file used to return, key is the lower case name used for lookups.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def of(cls, file, type, name):
+        return cls(str(file), type, name, name.lower())
+
+
+class ManifestEntry(namedtuple('ManifestEntry', ['name', 'type', 'action', 'location', 'options',
+                                                 'key', 'type_key', 'action_key'])):
+    """
+    One up or down entry of a manifest build, with its lower case name, type and action
+    computed once.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_dict(cls, entry):
+        """
+        :param entry: Manifest entry as parsed from toml
+        :type entry: [dict]
+        :return: Manifest entry
+        :rtype: [ManifestEntry]
+        """
+        options = {k: v for (k, v) in entry.items() if k not in ENTRY_FIELDS}
+        return cls(entry['name'], entry['type'], entry['action'], entry.get('location'), options,
+                   entry['name'].lower(), entry['type'].lower(), entry['action'].lower())
+
+    @classmethod
+    def coerce(cls, entry):
+        return entry if isinstance(entry, cls) else cls.from_dict(entry)
+
+    def get(self, option, default=None):
+        return self.options.get(option, default)
+
+    def as_dict(self):
+        entry = {'name': self.name, 'type': self.type, 'action': self.action}
+        if self.location is not None:
+            entry['location'] = self.location
+        entry.update(self.options)
+        return entry
+
+
+class Block(namedtuple('Block', ['name', 'type', 'sql', 'entry', 'key', 'type_key'])):
+    """
+    ODESSEY block of a migration, with the manifest entry it was built from when known.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def of(cls, name, type, sql, entry=None):
+        return cls(name, type, sql, entry, name.lower(), type.lower())
@@ -1,4 +1,6 @@
 import argparse
+import asyncio
+import json
 import logging
 import sys
 from pathlib import Path
@@ -6,6 +8,10 @@ import importlib.util
 from odyssey_db.migrate import Migrate
 from odyssey_db.builder import Builder
 from odyssey_db.fixture import Fixture
+from odyssey_db.planner import Planner
+from odyssey_db.estimate import Estimator
+from odyssey_db.watch import Watcher
+from odyssey_db.daemon import Daemon, request_daemon
 
 #from . import migrate
 #from . import builder
@@ -28,6 +34,10 @@ def fetch_args():
         name="build", help="Build database migrations.")
     p_build.add_argument(
         '-t', '--target', help="Build migration target. Default is build all missing targets.", default="all")
+    p_build.add_argument(
+        '--dry-run', help="Print the build plan as JSON without writing migration files.", action='store_true')
+    p_build.add_argument(
+        '--watch', help="Keep running and regenerate pending builds when sources or the manifest change.", action='store_true')
 
     p_migrate = subparsers.add_parser(
         name="migrate", help="Database migration command.")
@@ -35,17 +45,45 @@ def fetch_args():
         'up|down', help="Migrate the database up or down.", nargs='?', choices=('up', 'down'))
     p_migrate.add_argument(
         '-t', '--target', help='Migrate to target version. Default is to migrate to the latest version.', default="max")
+    p_migrate.add_argument(
+        '--dry-run', help="Print the migration plan as JSON without touching the database.", action='store_true')
+    p_migrate.add_argument(
+        '--introspect', help="With --dry-run, read the ledger and catalog of the first database to plan the drift decision of each outstanding block.", action='store_true')
+    p_migrate.add_argument(
+        '--estimate', help="With --dry-run, estimate the wall time of each block and build from the timings and table sizes of the first database.", action='store_true')
+    p_migrate.add_argument(
+        '--lock', help="Wait for another node migrating the same database, or exit at once. Defaults to the MIGRATION_LOCK setting.",
+        choices=('block', 'exit'))
+
+    p_squash = subparsers.add_parser(
+        name="squash", help="Squash the up migrations up to a build into a baseline for new databases.")
+    p_squash.add_argument(
+        '--upto', help="Last build to include in the baseline.", required=True)
+
+    p_archive = subparsers.add_parser(
+        name="archive", help="Pack the migrations up to a build into the migration archive.")
+    p_archive.add_argument(
+        '--upto', help="Last build to archive.", required=True)
+
+    subparsers.add_parser(
+        name="verify", help="Check that every manifest build has its migrations and that archived migrations match their digests.")
+
+    subparsers.add_parser(
+        name="daemon", help="Keep the project loaded and answer build, plan and verify commands over the DAEMON_SOCKET Unix socket.")
 
     p_fixture = subparsers.add_parser(
         "fixture", help="Load/Extract table data to json fixture data for initial load and testing.")
     p_fixture.add_argument(
         'load|dump', help="Load or Extract table data to json for inital load and testing.", nargs='?', choices=('load', 'dump'))
+    p_fixture.add_argument(
+        '--subset', help="Dump the FIXTURE_SUBSET seed rows and the rows they reference.", action='store_true')
 
-    parser.add_argument('-e', '--engine', help="Database engine",
-                        nargs='?', choices=('postgres', 'greenplum'), required=True)
+    parser.add_argument('-e', '--engine', help="Database engine. build accepts the option more than once and writes migrations for each engine.",
+                        action='append', choices=('postgres', 'greenplum'), required=True)
     parser.add_argument('-s', '--settings',
                         help="Settings file", default="config/settings.py")
     parser.add_argument('-v', '--verbose', help="Verbose", action='store_true')
+    parser.add_argument('--no-daemon', help="Run the command here even when a daemon is listening.", action='store_true')
     return parser
 
 
@@ -59,8 +97,44 @@ def check_engine(engine):
     }[engine]
 
 
-def run_build(db_engine, migrator, settings, source_files):
-    build = Builder(settings=settings)
+def backfill_engine(build, engine_build, db_engine):
+    """
+    Writes the migrations of an engine that are missing from its folder from the migrations
+    of the resolving builder, through the engine rewrite stage.
+    """
+    for up_file in sorted(build.get_existing_files()):
+        build_number = up_file.name.replace('_up.sql', '')
+        for direction in ('up', 'down'):
+            engine_file = engine_build.migration_file_name(build_number=build_number, direction=direction)
+            if engine_build.migration_present(engine_file):
+                continue
+            contents = build.read_migration_bytes(build.migration_file_name(build_number=build_number, direction=direction))
+            spec = [build.wrap_odessey_bytes(objname=x.name, objtype=x.type, sql_cmd=x.sql.encode(build.SOURCE_ENCODING))
+                    for x in build.read_blocks(contents)]
+            logger.info(f"Writing {db_engine.NAME} {direction} migration for existing build: {build_number}")
+            engine_build.write_migration(file=engine_file, build_spec=engine_build.rewrite_migration(spec, db_engine))
+
+
+def run_build(db_engines, settings, source_files):
+    """
+    Builds the pending migrations for one or more engines. Sources, the manifest and
+    rollbacks are resolved once by the builder of the ENGINE setting, or of the first engine
+    when it is not given, then every engine writes the build through its rewrite stage.
+
+    :param db_engines: Dictionary of engine name to database engine
+    :type db_engines: [dict]
+    :param settings: Settings module
+    :type settings: [module]
+    :param source_files: Flat source catalogue from Migrate.flatten_files_list
+    :type source_files: [list]
+    """
+    primary = getattr(settings, 'ENGINE', 'postgres')
+    if primary not in db_engines:
+        primary = next(iter(db_engines))
+    builders = {name: Builder(settings=settings, engine=name) for name in db_engines}
+    build = builders[primary]
+    for engine_build in builders.values():
+        Path(engine_build.MIGRATION_FOLDER).mkdir(parents=True, exist_ok=True)
 
     manifest = build.read_manifest()
     logger.debug(manifest)
@@ -68,83 +142,309 @@ def run_build(db_engine, migrator, settings, source_files):
     existing_files = build.get_existing_files()
     logger.debug(existing_files)
 
-    existing_file_names = sorted([y.name for y in existing_files])
-    logger.debug(existing_file_names)
+    for name, db_engine in db_engines.items():
+        if name != primary:
+            backfill_engine(build=build, engine_build=builders[name], db_engine=db_engine)
 
-    next_target_migraion = next(iter(sorted(
-        [x for x in manifest if x + '_up.sql' not in existing_file_names])), None)
-    logger.info(f"Next target migration: {next_target_migraion}")
+    pending_builds = build.pending_builds(manifest=manifest, existing_files=existing_files)
 
-    broken_migration = False
-    for efile in existing_file_names:
-        if efile.replace('_up.sql', '') > next_target_migraion:
-            logger.error(f"Migration file greater than target exists: {efile}")
-            broken_migration = True
-            break
-
-    if broken_migration:
-        logger.error("Migration chain is broken. Previously generated files have likely been removed. Regenerating missing files will produce an inconsistant database migration chain. Find the last stable release to recover past migration files and build migrations from there.")
-        exit(-1)
-
-    forward_migrations = { key:value for (key, value)  in manifest.items() if key >= next_target_migraion }
+    forward_migrations = { key:manifest[key] for key in pending_builds }
     logger.debug(forward_migrations)
     fm_num = [ x for x in sorted(forward_migrations)]
+    generated = {}
     for item in fm_num:
+        files = {name: (x.migration_file_name(build_number=item, direction='up'), x.migration_file_name(build_number=item, direction='down'))
+                 for (name, x) in builders.items()}
+        if any(builders[name].migration_file_exists(full_path=x) for (name, pair) in files.items() for x in pair):
+            exit(-1)
+
         logger.info(f"Building up migrations for build: {item}")
-        up_file = build.migration_file_name(build_number=item, direction='up')
-        down_file = build.migration_file_name(build_number=item, direction='down')
-        if not build.migration_file_exists(full_path=up_file) and not build.migration_file_exists(full_path=down_file):
-            up_mig = build.build_up_migration(build_number=item, config=forward_migrations, source_file_info=source_files )
-            build.write_migration(file=up_file, build_spec=up_mig)
-
-            # Need to check for source files again after writing out a migration in case we're processing multiple builds at once.
-            new_files = migrator.read_sql_files(srcpath=settings.SQL_SRC, str_regex=db_engine.sql_object_name)
-            source_files = migrator.flatten_files_list(source_list=new_files)
-            logger.info(f"Building down migrations for build: {item}")
-            down_mig = build.build_down_migration(build_number=item, config=forward_migrations, source_file_info=source_files )
-            build.write_migration(file=down_file, build_spec=down_mig)
+        up_mig = build.build_up_migration(build_number=item, config=forward_migrations, source_file_info=source_files )
+        generated[item] = b''.join(up_mig)
+        logger.info(f"Building down migrations for build: {item}")
+        down_mig = build.build_down_migration(build_number=item, config=forward_migrations, source_file_info=source_files, pending=generated)
+
+        for name, db_engine in db_engines.items():
+            engine_build = builders[name]
+            up_file, down_file = files[name]
+            engine_build.write_migration(file=up_file, build_spec=engine_build.rewrite_migration(up_mig, db_engine))
+            engine_build.write_migration(file=down_file, build_spec=engine_build.rewrite_migration(down_mig, db_engine))
+
+def run_verify(build, manifest):
+    """
+    Checks the migration chain: every manifest build must have its migrations, and every
+    migration must be readable, archived ones matching their digest in the pack.
+
+    :param build: Builder of the migration folder
+    :type build: [Builder]
+    :param manifest: Parsed manifest
+    :type manifest: [dict]
+    :return: Dictionary with the chain hash, the build numbers with migrations and the pending builds
+    :rtype: [dict]
+    """
+    builds = build.migration_builds(direction="up")
+    for build_number in builds:
+        for direction in ('up', 'down'):
+            file = build.migration_file_name(build_number=build_number, direction=direction)
+            if not build.migration_present(file):
+                logger.error(f"Missing {direction} migration for build: {build_number}")
+                exit(-1)
+            build.read_migration_bytes(file)
+    pending = build.pending_builds(manifest=manifest, existing_files=build.get_existing_files())
+    for build_number in pending:
+        logger.error(f"Build {build_number} has no migrations, run build.")
+    return {'chain': build.chain_hash(), 'builds': builds, 'pending': pending}
+
+
+def daemon_request(arguments):
+    """
+    Request a daemon would answer for the command line, None when the command runs here.
+
+    :param arguments: Parsed command line arguments
+    :type arguments: [Namespace]
+    :return: Request dictionary for Daemon.handle
+    :rtype: [dict]
+    """
+    request = {'settings': str(Path(arguments.settings).resolve()), 'engines': list(dict.fromkeys(arguments.engine))}
+    if arguments.commands == "build" and arguments.dry_run:
+        request.update(command='plan', plan='build', target=arguments.target)
+    elif arguments.commands == "build" and not arguments.watch:
+        request.update(command='build')
+    elif arguments.commands == "migrate" and arguments.dry_run and not (arguments.introspect or arguments.estimate):
+        request.update(command='plan', plan='migrate', direction=getattr(arguments, 'up|down') or 'up', target=arguments.target)
+    elif arguments.commands == "verify":
+        request.update(command='verify')
+    else:
+        return None
+    return request
+
+
+def forward_to_daemon(settings, arguments):
+    """
+    Runs the command on a listening daemon, replaying its log records and printing its output.
+
+    :return: True when the daemon answered the command
+    :rtype: [bool]
+    """
+    request = daemon_request(arguments)
+    if request is None:
+        return False
+    response = request_daemon(getattr(settings, 'DAEMON_SOCKET', '.odyssey_db.sock'), request)
+    if response is None or response['status'] == 'mismatch':
+        return False
+    for level, name, module, message in response['logs']:
+        if logging.getLogger(name).isEnabledFor(level):
+            logging.getLogger(name).handle(logging.makeLogRecord(
+                {'name': name, 'levelno': level, 'levelname': logging.getLevelName(level), 'module': module, 'msg': message}))
+    if response['output'] is not None:
+        print(json.dumps(response['output'], indent=2, default=str))
+    if response['status'] != 'ok':
+        exit(-1)
+    return True
+
+
+def run_squash(db_engine, settings, upto):
+    build = Builder(settings=settings, engine=db_engine.NAME)
+    baseline_file = build.migration_file_name(build_number=upto, direction='baseline')
+    if build.migration_file_exists(full_path=baseline_file):
+        exit(-1)
+
+    squashed, blocks = build.squash_blocks(upto=upto, db_engine=db_engine, manifest=build.read_manifest())
+    header = f"-- ODESSEY BASELINE |{upto}|{','.join(squashed)}\n"
+    spec = [header] + [build.wrap_odessey_cmd(objname=x.name, objtype=x.type, sql_cmd=x.sql) for x in blocks]
+    if not build.write_migration(file=baseline_file, build_spec=spec):
+        exit(-1)
+    logger.info(f"Squashed {len(squashed)} build(s) into {len(blocks)} block(s): {baseline_file}")
+
+
+def run_archive(settings, upto, engine=None):
+    build = Builder(settings=settings, engine=engine)
+    archived = build.archive_migrations(upto=upto)
+    logger.info(f"Archived {len(archived)} migration file(s) into {build.pack.pack_file}")
+
+
+def run_fixture(db_engine, settings, action, subset):
+    fix = Fixture()
+    folder = getattr(settings, 'FIXTURE_FOLDER', 'fixtures')
+    if action == "dump" and not subset:
+        logger.error("Only subset dumps are supported, use fixture dump --subset.")
+        exit(-1)
+    conn = db_engine.connect(db_engine.database_list(settings.DATABASE)[0])
+    try:
+        if action == "dump":
+            files = fix.dump_subset(conn, seeds=getattr(settings, 'FIXTURE_SUBSET', {}), folder=folder,
+                                    batch_size=getattr(settings, 'FIXTURE_BATCH_SIZE', 10000))
+            logger.info(f"Wrote {len(files)} fixture file(s) to {folder}")
         else:
-            exit(-1)
+            rows = fix.load(conn, sorted(Path(folder).glob('*.json')))
+            logger.info(f"Loaded {rows} rows from {folder}")
+    finally:
+        conn.close()
+
+
+def read_builds(build, direction, target):
+    """
+    Reads the migrations a migrate in the given direction applies.
+
+    :return: Tuple of the (build number, blocks) list, the step limit and the baseline
+    :rtype: [tuple]
+    """
+    manifest = build.read_manifest()
+    build_numbers = build.migration_builds(direction=direction, target=target)
+    builds = [(x, build.read_migration(build_number=x, direction=direction, manifest=manifest)) for x in build_numbers]
+    steps = 1 if direction == "down" and target == "max" else None
+    baseline = build.read_baseline(target=target, manifest=manifest) if direction == "up" else None
+    return builds, steps, baseline
+
+
+def run_migrate(db_engine, settings, direction, target, lock=None):
+    build = Builder(settings=settings, engine=db_engine.NAME)
+    builds, steps, baseline = read_builds(build=build, direction=direction, target=target)
+
+    databases = db_engine.database_list(settings.DATABASE)
+    concurrency = getattr(settings, 'MIGRATION_CONCURRENCY', 4)
+    lock = lock or getattr(settings, 'MIGRATION_LOCK', 'block')
+    logger.info(f"Migrating {len(databases)} database(s) {direction}, {concurrency} at a time.")
+
+    report = asyncio.run(db_engine.migrate_many(
+        databases=databases, builds=builds, direction=direction, steps=steps, concurrency=concurrency,
+        baseline=baseline, chain=build.chain_hash(), lock=lock))
+    print(json.dumps(report, indent=2, default=str))
+
+    if report['locked']:
+        logger.warning(f"{report['locked']} database(s) are being migrated by another runner.")
+
+    if report['failed']:
+        logger.error(f"Migration failed on {report['failed']} of {report['databases']} database(s).")
+        exit(-1)
+
+
+def load_settings(settings_file):
+    """
+    Executes a settings file and returns it as a module.
+
+    :param settings_file: Path to the settings file
+    :type settings_file: [string]
+    :return: Settings module
+    :rtype: [module]
+    """
+    if not Path(settings_file).is_file():
+        logger.error("Settings file not found: {}".format(settings_file))
+        exit(-1)
+    logger.debug(f"Settings file: {settings_file}")
+    spec = importlib.util.spec_from_file_location(
+        "settings", settings_file)
+    settings = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(settings)
+    return settings
+
+
+def load_engine(engine_name, settings):
+    """
+    Loads a database engine module and returns its Engine.
+
+    :param engine_name: Engine name, postgres or greenplum
+    :type engine_name: [string]
+    :param settings: Settings module
+    :type settings: [module]
+    :return: Database engine
+    :rtype: [Engine]
+    """
+    logger.debug('Engine: {}'.format(engine_name))
+    specdb = importlib.util.spec_from_file_location(
+        "engine", check_engine(engine_name))
+    engine = importlib.util.module_from_spec(specdb)
+    specdb.loader.exec_module(engine)
+    return engine.Engine(settings=settings)
+
 
 def run(arguments):
-    if not Path(arguments.settings).is_file():
-        logger.error("Settings file not found: {}".format(arguments.settings))
-    else:
-        settings_file = Path(arguments.settings)
-        logger.debug(f"Settings file: {settings_file}")
-        spec = importlib.util.spec_from_file_location(
-            "settings", arguments.settings)
-        settings = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(settings)
-
-        # Configure the logger format from the settings
-        log = logging.getLogger()
-        handler = log.handlers[0]
-        logFormat = logging.Formatter(fmt=settings.LOGGING['format'])
-        handler.setFormatter(logFormat)
+    settings = load_settings(arguments.settings)
+
+    # Configure the logger format from the settings
+    log = logging.getLogger()
+    handler = log.handlers[0]
+    logFormat = logging.Formatter(fmt=settings.LOGGING['format'])
+    handler.setFormatter(logFormat)
 
     if arguments.engine:
-        logger.debug('Engine: {}'.format(arguments.engine))
-        specdb = importlib.util.spec_from_file_location(
-            "engine", check_engine(arguments.engine))
-        engine = importlib.util.module_from_spec(specdb)
-        specdb.loader.exec_module(engine)
+        db_engines = {name: load_engine(name, settings=settings) for name in dict.fromkeys(arguments.engine)}
+        db_engine = next(iter(db_engines.values()))
     else:
         logger.error("No database engine specified.")
         exit()
+    if len(db_engines) > 1 and (arguments.commands not in ("build", "daemon") or
+                                (arguments.commands == "build" and (arguments.dry_run or arguments.watch))):
+        logger.error("Only build and daemon accept more than one engine.")
+        exit(-1)
 
     logger.debug(f"Command arguments: {arguments}")
-    db_engine = engine.Engine()
-    migrator = Migrate()
+    if not arguments.no_daemon and forward_to_daemon(settings=settings, arguments=arguments):
+        return
+
+    migrator = Migrate(encoding=getattr(settings, 'SOURCE_ENCODING', 'UTF-8'))
 
     source_files = migrator.read_sql_files(srcpath=settings.SQL_SRC, str_regex=db_engine.sql_object_name)
     flat_files = migrator.flatten_files_list(source_list=source_files)
 
-    if arguments.commands == "build":
-        run_build(db_engine=db_engine, migrator=migrator, settings=settings, source_files=flat_files)
+    if arguments.commands == "build" and arguments.dry_run:
+        planner = Planner(db_engine=db_engine, builder=Builder(settings=settings, engine=db_engine.NAME),
+                          source_files=migrator.index_files_list(source_list=source_files))
+        print(planner.to_json(planner.plan_build(target=arguments.target)))
+
+    elif arguments.commands == "build" and arguments.watch:
+        watcher = Watcher(db_engine=db_engine, migrator=migrator, settings=settings, source_files=flat_files)
+        watcher.run()
+
+    elif arguments.commands == "build":
+        run_build(db_engines=db_engines, settings=settings, source_files=flat_files)
+
+    elif arguments.commands == "migrate" and arguments.dry_run:
+        planner = Planner(db_engine=db_engine, builder=Builder(settings=settings, engine=db_engine.NAME),
+                          source_files=migrator.index_files_list(source_list=source_files))
+        direction = getattr(arguments, 'up|down') or 'up'
+        catalog = None
+        estimator = None
+        applied = None
+        if arguments.introspect or arguments.estimate:
+            conn = db_engine.connect(db_engine.database_list(settings.DATABASE)[0])
+            try:
+                applied = db_engine.applied_builds(conn) if db_engine.ledger_exists(conn) else []
+                if arguments.introspect:
+                    catalog = db_engine.snapshot_catalog(conn)
+                if arguments.estimate:
+                    estimator = Estimator(db_engine=db_engine, history=db_engine.timing_history(conn),
+                                          sizes=db_engine.relation_sizes(conn))
+            finally:
+                conn.close()
+        print(planner.to_json(planner.plan_migrate(direction=direction, target=arguments.target, catalog=catalog,
+                                                   manifest=planner.builder.read_manifest(store=False), estimator=estimator,
+                                                   applied=applied)))
+
+    elif arguments.commands == "migrate":
+        direction = getattr(arguments, 'up|down') or 'up'
+        run_migrate(db_engine=db_engine, settings=settings, direction=direction, target=arguments.target, lock=arguments.lock)
+
+    elif arguments.commands == "verify":
+        build = Builder(settings=settings, engine=db_engine.NAME)
+        result = run_verify(build=build, manifest=build.read_manifest())
+        print(json.dumps(result, indent=2))
+        if result['pending']:
+            exit(-1)
+
+    elif arguments.commands == "daemon":
+        daemon = Daemon(db_engines=db_engines, migrator=migrator, settings=settings, settings_file=arguments.settings,
+                        source_files=flat_files, socket_path=getattr(settings, 'DAEMON_SOCKET', '.odyssey_db.sock'))
+        daemon.serve()
+
+    elif arguments.commands == "squash":
+        run_squash(db_engine=db_engine, settings=settings, upto=arguments.upto)
+
+    elif arguments.commands == "archive":
+        run_archive(settings=settings, upto=arguments.upto, engine=db_engine.NAME)
 
     elif arguments.commands == "fixture":
-        fix = Fixture()
+        run_fixture(db_engine=db_engine, settings=settings, action=getattr(arguments, 'load|dump'), subset=arguments.subset)
 
 
 def main():
@@ -0,0 +1,167 @@
+import json
+import logging
+from odyssey_db.models import ManifestEntry
+
+logger = logging.getLogger(__name__)
+
+
+class Planner:
+
+    def __init__(self, db_engine, builder, source_files):
+        """
+        Init method of the Planner class.
+
+        :param db_engine: Database engine used to split statements
+        :type db_engine: [Engine]
+        :param builder: Builder for the migration folder and manifest
+        :type builder: [Builder]
+        :param source_files: Indexed source catalogue from Migrate.index_files_list
+        :type source_files: [dict]
+        """
+        self.db_engine = db_engine
+        self.builder = builder
+        self.source_files = source_files
+
+    def describe_blocks(self, blocks, entries=None, catalog=None, estimator=None, direction="up"):
+        """
+        Sizes a list of ODESSEY blocks.
+
+        :param blocks: List of blocks from Builder.read_blocks
+        :type blocks: [list]
+        :param entries: Manifest entries matching the blocks, if known
+        :type entries: [list]
+        :param catalog: Catalog snapshot, adds the drift decision of each block when given
+        :type catalog: [Catalog]
+        :param estimator: Estimator, adds the expected wall time of each block and of the list when given
+        :type estimator: [Estimator]
+        :param direction: up or down, the direction the blocks are estimated for
+        :type direction: [string]
+        :return: Dictionary with the total and per block byte sizes and statement counts
+        :rtype: [dict]
+        """
+        described = []
+        for index, block in enumerate(blocks):
+            item = {
+                'name': block.name,
+                'type': block.type,
+                'bytes': len(block.sql.encode(encoding=self.builder.SOURCE_ENCODING, errors='strict')),
+                'statements': len(self.db_engine.split_statements(block.sql)),
+            }
+            if entries and index < len(entries):
+                item['action'] = ManifestEntry.coerce(entries[index]).action_key
+            if block.entry is not None and block.entry.get('group') is not None:
+                item['group'] = block.entry.get('group')
+            if catalog is not None:
+                item['decision'] = self.db_engine.drift_decision(block, catalog)
+                if item['decision'] != 'skip':
+                    catalog.record(block.type, block.name, self.db_engine.block_action(block))
+            if estimator is not None:
+                item['estimate'] = estimator.estimate_block(block, direction=direction, statements=item['statements'])
+                if item.get('decision') == 'skip':
+                    item['estimate'].update(seconds=0.0, low=0.0, high=0.0)
+            described.append(item)
+        described = {
+            'bytes': sum(x['bytes'] for x in described),
+            'statements': sum(x['statements'] for x in described),
+            'blocks': described,
+        }
+        if estimator is not None:
+            described['estimate'] = estimator.combine([x['estimate'] for x in described['blocks']])
+        return described
+
+    def plan_build(self, target="all"):
+        """
+        Computes the migrations a build would generate without writing any files.
+
+        :param target: Last build to plan, or all for every pending build
+        :type target: [string]
+        :return: Build plan
+        :rtype: [dict]
+        """
+        manifest = self.builder.read_manifest(store=False)
+        pending_builds = self.builder.pending_builds(
+            manifest=manifest, existing_files=self.builder.get_existing_files())
+        if target != "all":
+            pending_builds = [x for x in pending_builds if x <= target]
+
+        generated = {}
+        builds = []
+        for item in pending_builds:
+            logger.info(f"Planning build: {item}")
+            up_mig = self.builder.build_up_migration(
+                build_number=item, config=manifest, source_file_info=self.source_files)
+            generated[item] = b''.join(up_mig)
+            down_mig = self.builder.build_down_migration(
+                build_number=item, config=manifest, source_file_info=self.source_files, pending=generated)
+            builds.append({
+                'build': item,
+                'up': self.describe_blocks(
+                    blocks=self.builder.read_blocks(b''.join(up_mig)), entries=manifest[item]['up']),
+                'down': self.describe_blocks(
+                    blocks=self.builder.read_blocks(b''.join(down_mig)), entries=manifest[item]['down']),
+            })
+        return self.summarise(command="build", direction="up", builds=builds)
+
+    def plan_migrate(self, direction="up", target="max", catalog=None, manifest=None, estimator=None, applied=None):
+        """
+        Computes the migrations a migrate would apply, from the migration files and, when
+        given, the ledger of the target database. An up migration of a database with an
+        empty ledger starts from the baseline, as Engine.migrate_database does.
+
+        :param direction: up or down
+        :type direction: [string]
+        :param target: Build to migrate to. max migrates up to the latest build or down by one build.
+        :type target: [string]
+        :param catalog: Catalog snapshot of the target database, to plan the drift decision of each block
+        :type catalog: [Catalog]
+        :param manifest: Parsed manifest, supplies the entry options of each block
+        :type manifest: [dict]
+        :param estimator: Estimator built from the timings of the target database, to predict the wall time of each block and build
+        :type estimator: [Estimator]
+        :param applied: Builds in the ledger of the target database, only its outstanding builds are planned when given
+        :type applied: [list]
+        :return: Migration plan
+        :rtype: [dict]
+        """
+        build_numbers = self.builder.migration_builds(direction=direction, target=target)
+        baseline = None
+        if direction == "up" and applied is not None and not applied:
+            baseline = self.builder.read_baseline(target=target, manifest=manifest)
+        builds = []
+        if baseline:
+            baseline_build, applied, blocks = baseline
+            builds.append({
+                'build': f"{baseline_build}_baseline",
+                direction: self.describe_blocks(blocks=blocks, catalog=catalog, estimator=estimator, direction=direction),
+            })
+        if applied is not None:
+            build_numbers = [x for x in build_numbers if (x in applied) == (direction == "down")]
+        if direction == "down" and target == "max":
+            build_numbers = build_numbers[:1]
+        for item in build_numbers:
+            builds.append({
+                'build': item,
+                direction: self.describe_blocks(
+                    blocks=self.builder.read_migration(build_number=item, direction=direction, manifest=manifest),
+                    catalog=catalog, estimator=estimator, direction=direction),
+            })
+        plan = self.summarise(command="migrate", direction=direction, builds=builds)
+        if estimator is not None:
+            plan['totals']['estimate'] = estimator.combine([x[direction]['estimate'] for x in builds])
+        return plan
+
+    def summarise(self, command, direction, builds):
+        return {
+            'command': command,
+            'direction': direction,
+            'builds': builds,
+            'totals': {
+                'builds': len(builds),
+                'blocks': sum(len(x[direction]['blocks']) for x in builds),
+                'bytes': sum(x[direction]['bytes'] for x in builds),
+                'statements': sum(x[direction]['statements'] for x in builds),
+            },
+        }
+
+    def to_json(self, plan):
+        return json.dumps(plan, indent=2)
@@ -0,0 +1,313 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import re
+import select
+import struct
+import time
+from pathlib import Path
+from odyssey_db.builder import Builder
+from odyssey_db.models import SourceObject
+
+logger = logging.getLogger(__name__)
+
+# inotify event masks, see inotify(7).
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_HEADER = struct.Struct('iIII')
+
+# Migration files written by the builder, changes to them never trigger a rebuild.
+MIGRATION_FILE = re.compile(r'^\d+_(up|down)\.sql$')
+
+
+class Inotify:
+
+    def __init__(self):
+        """
+        Thin ctypes wrapper around the Linux inotify API. Raises OSError when inotify is unavailable.
+        """
+        libc_name = ctypes.util.find_library('c')
+        if not libc_name:
+            raise OSError("libc not found")
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {}
+
+    def add_tree(self, folder):
+        """
+        Watches a folder and all folders below it.
+
+        :param folder: Folder to watch
+        :type folder: [string]
+        """
+        for root, dirs, files in os.walk(folder):
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(root), WATCH_MASK)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {root}")
+            self.watches[wd] = root
+
+    def read(self, timeout):
+        """
+        Waits for events and returns the paths that changed.
+
+        :param timeout: Seconds to wait for the first event
+        :type timeout: [float]
+        :return: Set of changed paths
+        :rtype: [set]
+        """
+        changed = set()
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return changed
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0').decode()
+            offset += length
+            path = os.path.join(self.watches.get(wd, ''), name)
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                self.add_tree(path)
+            elif not mask & IN_ISDIR:
+                changed.add(path)
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Poller:
+
+    def __init__(self):
+        """
+        Polling fallback for platforms without inotify, compares file modification times.
+        """
+        self.folders = []
+        self.snapshot = {}
+
+    def add_tree(self, folder):
+        self.folders.append(folder)
+        self.snapshot.update(self.scan(folder))
+
+    def scan(self, folder):
+        files = {}
+        for root, dirs, names in os.walk(folder):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files[path] = (stat.st_mtime_ns, stat.st_size)
+        return files
+
+    def read(self, timeout):
+        time.sleep(timeout)
+        current = {}
+        for folder in self.folders:
+            current.update(self.scan(folder))
+        changed = {x for x in set(current) | set(self.snapshot) if current.get(x) != self.snapshot.get(x)}
+        self.snapshot = current
+        return changed
+
+    def close(self):
+        pass
+
+
+class Watcher:
+
+    def __init__(self, db_engine, migrator, settings, source_files, interval=0.5, debounce=0.05):
+        """
+        Keeps the source catalogue and manifest in memory and regenerates pending builds when
+        SQL_SRC, the manifest or MIGRATION_FOLDER change.
+
+        Builds generated by the watcher are the pending builds of the session. When a source
+        file, an execute location or a manifest section they use changes, the earliest affected
+        build and the session builds after it are generated again. Builds that existed before
+        the watcher started are never touched.
+
+        :param db_engine: Database engine, supplies the object name regex
+        :type db_engine: [Engine]
+        :param migrator: Migrate instance
+        :type migrator: [Migrate]
+        :param settings: Settings module
+        :type settings: [module]
+        :param source_files: Flat source catalogue from Migrate.flatten_files_list
+        :type source_files: [list]
+        :param interval: Seconds between polls when inotify is unavailable
+        :type interval: [float]
+        :param debounce: Seconds to collect further events after the first one
+        :type debounce: [float]
+        """
+        self.db_engine = db_engine
+        self.migrator = migrator
+        self.settings = settings
+        self.builder = Builder(settings=settings, engine=db_engine.NAME)
+        self.interval = interval
+        self.debounce = debounce
+
+        self.sql_src = str(Path(settings.SQL_SRC).resolve())
+        self.migration_folder = str(Path(settings.MIGRATION_FOLDER).resolve())
+        self.manifest_file = str(Path(settings.MIGRATION_MAINIFEST).resolve())
+
+        self.catalogue = {str(Path(x.file).resolve()): x for x in source_files}
+        self.manifest = self.builder.read_manifest()
+        self.session_builds = []
+        # Session builds whose last generation did not finish, regenerated with the next change.
+        self.stale = set()
+
+    def source_index(self):
+        index = {}
+        for item in self.catalogue.values():
+            index.setdefault(item.key, item.file)
+        return index
+
+    def refresh_source(self, path):
+        """
+        Parses one source file again and updates the catalogue.
+
+        :param path: Resolved path of the source file
+        :type path: [string]
+        :return: Lower case object names defined by the file before and after the change
+        :rtype: [set]
+        """
+        names = set()
+        old = self.catalogue.pop(path, None)
+        if old:
+            names.add(old.key)
+        if Path(path).is_file():
+            result = self.migrator.get_name_from_file(file_name=path, str_regex=self.db_engine.sql_object_name)
+            if len(result) > 0:
+                self.catalogue[path] = SourceObject.of(path, result[0].type, result[0].name)
+                names.add(result[0].key)
+        return names
+
+    def entry_uses(self, entry, names, paths):
+        if entry.action_key == 'create' and entry.key in names:
+            return True
+        location = entry.location
+        return bool(location) and str(Path(location).resolve()) in paths
+
+    def affected_builds(self, changed):
+        """
+        Works out which session builds need to be regenerated for a set of changed paths.
+
+        :param changed: Resolved paths that changed
+        :type changed: [set]
+        :return: Sorted build numbers to regenerate
+        :rtype: [list]
+        """
+        names = set()
+        manifest_builds = set()
+        for path in changed:
+            if path == self.manifest_file:
+                manifest = self.builder.read_manifest()
+                manifest_builds = {x for x in set(manifest) | set(self.manifest)
+                                   if manifest.get(x) != self.manifest.get(x)}
+                self.manifest = manifest
+            elif path.startswith(self.sql_src + os.sep) and path.endswith('.sql'):
+                names |= self.refresh_source(path)
+
+        existing = [x.name.replace('_up.sql', '') for x in self.builder.get_existing_files()]
+        affected = set(manifest_builds) | self.stale | {x for x in self.session_builds if x not in existing}
+        for build_number in self.session_builds:
+            section = self.manifest.get(build_number, {})
+            entries = section.get('up', []) + section.get('down', [])
+            if any(self.entry_uses(x, names, changed) for x in entries):
+                affected.add(build_number)
+
+        frozen = [x for x in existing if x not in self.session_builds]
+        ready = sorted(x for x in affected if x in self.manifest and x not in frozen)
+        if not ready:
+            return []
+        return sorted({x for x in self.session_builds if x >= ready[0]} | set(ready))
+
+    def generate(self, build_numbers):
+        """
+        Writes the migration files of the given builds, in order. The up and down files of a
+        build are written to temporary files and replace the old ones together once both are
+        built, so a build that fails keeps its previous files and is marked stale.
+
+        :param build_numbers: Build numbers to generate
+        :type build_numbers: [list]
+        """
+        index = self.source_index()
+        self.stale |= set(build_numbers)
+        for item in build_numbers:
+            started = time.monotonic()
+            up_mig = self.builder.build_up_migration(build_number=item, config=self.manifest, source_file_info=index)
+            down_mig = self.builder.build_down_migration(build_number=item, config=self.manifest, source_file_info=index)
+            files = []
+            for direction, build_spec in (('up', up_mig), ('down', down_mig)):
+                migration_file = self.builder.migration_file_name(build_number=item, direction=direction)
+                temp_file = migration_file.with_name(migration_file.name + '.tmp')
+                if not self.builder.write_migration(file=temp_file, build_spec=build_spec):
+                    exit(-1)
+                files.append((temp_file, migration_file))
+            for temp_file, migration_file in files:
+                os.replace(temp_file, migration_file)
+            if item not in self.session_builds:
+                self.session_builds.append(item)
+            self.stale.discard(item)
+            logger.info(f"Generated build {item} in {(time.monotonic() - started) * 1000:.1f}ms")
+        self.session_builds.sort()
+
+    def open_watch(self):
+        try:
+            watch = Inotify()
+            logger.info("Watching for changes with inotify.")
+        except OSError as e:
+            logger.info(f"inotify unavailable ({e}), polling every {self.interval}s.")
+            watch = Poller()
+        for folder in {self.sql_src, self.migration_folder, str(Path(self.manifest_file).parent)}:
+            watch.add_tree(folder)
+        return watch
+
+    def relevant(self, path):
+        if path == self.manifest_file:
+            return True
+        if path.startswith(self.migration_folder + os.sep) and MIGRATION_FILE.match(os.path.basename(path)):
+            return False
+        return path.endswith('.sql') and (
+            path.startswith(self.sql_src + os.sep) or path.startswith(self.migration_folder + os.sep))
+
+    def run(self):
+        """
+        Generates the pending builds, then regenerates them on every change until interrupted.
+        """
+        self.generate(self.builder.pending_builds(
+            manifest=self.manifest, existing_files=self.builder.get_existing_files()))
+
+        watch = self.open_watch()
+        try:
+            while True:
+                changed = watch.read(self.interval)
+                if not changed:
+                    continue
+                changed |= watch.read(self.debounce)
+                changed = {str(Path(x).resolve()) for x in changed}
+                changed = {x for x in changed if self.relevant(x)}
+                if not changed:
+                    continue
+                logger.debug(f"Changed: {changed}")
+                try:
+                    self.generate(self.affected_builds(changed))
+                except SystemExit:
+                    logger.error("Build failed, waiting for the next change.")
+        except KeyboardInterrupt:
+            logger.info("Stopped watching.")
+        finally:
+            watch.close()
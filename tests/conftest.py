@@ -7,6 +7,8 @@ from odyssey_db.builder import Builder
 from odyssey_db.migrate import Migrate
 from types import SimpleNamespace, ModuleType
 
+pytest_plugins = ['odyssey_template']
+
 
 @pytest.fixture(scope="module")
 def postgres():
@@ -28,7 +30,7 @@ def builder(mocker, tmpdir):
     modfile.write(version_data)
     modfile.flush()
 
-    s = {'MIGRATION_FOLDER': td}
+    s = {'MIGRATION_FOLDER': td, 'MIGRATION_MAINIFEST': Path(td.strpath, 'manifest.toml')}
     settings = SimpleNamespace(**s)
 
     build = Builder(settings=settings)
@@ -36,6 +38,48 @@ def builder(mocker, tmpdir):
     modfile.close()
 
 
+@pytest.fixture()
+def project(tmpdir, postgres):
+    """
+    Build a temporary project with a source folder, a migration folder and a manifest holding one
+    create/drop build per table, numbered in the order given.
+
+    :return: factory taking the table names and returning the project base, settings, migrator and source files
+    :rtype: function
+    """
+    def make(tables):
+        base = Path(tmpdir.strpath)
+        (base / 'src').mkdir()
+        (base / 'migrations').mkdir()
+        (base / 'migrations' / '__init__.py').write_text("__version__='1.0'\n__release__='1.0.1'\n")
+        manifest = []
+        for number, table in enumerate(tables, start=1):
+            (base / 'src' / f'{table}.sql').write_text(f"CREATE TABLE util.{table} (id INT);")
+            manifest.append(f'[{number:04d}]\n'
+                            f'up = [{{name = "util.{table}", type = "table", action = "create"}}]\n'
+                            f'down = [{{name = "util.{table}", type = "table", action = "drop"}}]\n')
+        (base / 'manifest.toml').write_text('\n'.join(manifest))
+        settings = SimpleNamespace(SQL_SRC=str(base / 'src'), MIGRATION_FOLDER=str(base / 'migrations'),
+                                   MIGRATION_MAINIFEST=str(base / 'manifest.toml'))
+        migrator = Migrate()
+        source_files = migrator.flatten_files_list(
+            migrator.read_sql_files(srcpath=settings.SQL_SRC, str_regex=postgres.sql_object_name))
+        return SimpleNamespace(base=base, settings=settings, migrator=migrator, source_files=source_files)
+    return make
+
+
+@pytest.fixture()
+def conn(mocker):
+    connection = mocker.MagicMock()
+    connection.closed = False
+    return connection
+
+
+@pytest.fixture()
+def cursor(conn):
+    return conn.cursor.return_value.__enter__.return_value
+
+
 @pytest.fixture(scope="module")
 def migrate():
     migrator = Migrate()
@@ -0,0 +1,55 @@
+import pytest
+from pathlib import Path
+from odyssey_db.models import ManifestEntry
+
+
+@pytest.mark.builder
+def test_archive_migrations(builder):
+    builds = {
+        '0001': ('util.fn', 'function', 'CREATE FUNCTION util.fn() RETURNS INT AS $$ SELECT 1 $$ LANGUAGE sql;'),
+        '0002': ('util.fn', 'function', 'CREATE OR REPLACE FUNCTION util.fn() RETURNS INT AS $$ SELECT 2 $$ LANGUAGE sql;'),
+    }
+    for build_number, (name, objtype, sql) in builds.items():
+        for direction in ['up', 'down']:
+            spec = [builder.wrap_odessey_cmd(objname=name, objtype=objtype, sql_cmd=sql)]
+            builder.write_migration(file=builder.migration_file_name(build_number=build_number, direction=direction),
+                                    build_spec=spec)
+    chain = builder.chain_hash()
+
+    archived = builder.archive_migrations(upto='0001')
+
+    assert archived == ['0001_down.sql', '0001_up.sql']
+    assert not Path(builder.MIGRATION_FOLDER, '0001_up.sql').is_file()
+    assert builder.migration_builds(direction="up") == ['0001', '0002']
+    assert builder.chain_hash() == chain
+    assert builder.read_migration(build_number='0001', direction='up')[0].sql == builds['0001'][2]
+    assert builder.migration_file_exists(builder.migration_file_name(build_number='0001', direction='down'))
+
+    rollback = ManifestEntry.from_dict({'name': 'util.fn', 'type': 'function', 'action': 'rollback'})
+    wrapped = builder.build_cmds(manifest=rollback, source_file_info=[],
+                                 old_migrations=[builder.migration_file_name(build_number='0001', direction='up')])
+    assert builder.read_blocks(wrapped)[0].sql.strip() == builds['0001'][2]
+
+
+@pytest.mark.builder
+def test_archive_rerun_and_corruption(builder):
+    sql = 'CREATE FUNCTION util.fn() RETURNS INT AS $$ SELECT 1 $$ LANGUAGE sql;'
+    migration = builder.migration_file_name(build_number='0001', direction='up')
+    builder.write_migration(file=migration, build_spec=[builder.wrap_odessey_cmd(objname='util.fn', objtype='function', sql_cmd=sql)])
+    contents = migration.read_bytes()
+    assert builder.archive_migrations(upto='0001') == ['0001_up.sql']
+
+    # Left behind by an archive interrupted after the index was written.
+    migration.write_bytes(contents)
+    assert builder.archive_migrations(upto='0001') == []
+    assert not migration.is_file()
+
+    pack = builder.pack
+    start, end, _ = pack.index['blocks']['0001_up.sql']['util.fn|function']
+    data = bytearray(pack.pack_file.read_bytes())
+    data[start + 1] ^= 0xff
+    pack.pack_file.write_bytes(bytes(data))
+    with pytest.raises(SystemExit):
+        pack.read_block('0001_up.sql', 'util.fn', 'function')
+    with pytest.raises(SystemExit):
+        pack.read('0001_up.sql')
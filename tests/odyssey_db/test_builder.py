@@ -3,6 +3,8 @@ import tempfile
 from io import StringIO
 from pathlib import Path
 from unittest.mock import patch, mock_open
+from odyssey_db.migrate import Migrate
+from odyssey_db.models import SourceObject
 
 
 @pytest.mark.builder
@@ -39,7 +41,7 @@ def test_read_manifest(builder):
 
 @pytest.mark.builder
 def test_generate_file_hash(mocker, builder):
-    hash_data = "Random Data For the file"
+    hash_data = b"Random Data For the file"
     with patch('builtins.open', mock_open(read_data=hash_data)) as mock_file:
         result_hash = builder.generate_file_hash('/dev/null')
 
@@ -50,10 +52,9 @@ def test_generate_file_hash(mocker, builder):
 def test_migration_file_name(builder):
     build_number = '0001'
     direction = 'up'
-    migration_folder = 'src/migrations/'
-    expected_result = Path('src/migrations/0001_up.sql')
+    expected_result = Path(builder.MIGRATION_FOLDER, '0001_up.sql')
     result = builder.migration_file_name(
-        build_number=build_number, direction=direction, migration_folder=migration_folder)
+        build_number=build_number, direction=direction)
 
     assert result == expected_result
 
@@ -132,11 +133,11 @@ def test_match_previous_definition(builder, tmpdir):
         filename=ofile, objname=o_name, objtype=o_type)
 
     assert result == True
-    assert expected_result == contents
+    assert expected_result.encode() == contents
 
 
 @pytest.mark.builder
-def test_build_up_migration(mocker, builder):
+def test_build_up_migration(mocker, builder, tmpdir):
     sql_source = """
     CREATE OR REPLACE FUNCTION util.function()
     RETURNS VOID AS
@@ -159,11 +160,16 @@ def test_build_up_migration(mocker, builder):
         '\n-- ODESSEY BEGIN |data fix|dml\n\n    CREATE OR REPLACE FUNCTION util.function()\n    RETURNS VOID AS\n    $BODY$\n        DECLARE v_sql = text();\n        BEGIN;\n            SELECT 1;\n        END;\n    $BODY$\n    LANGUAGE plpgsql;\n    \n-- ODESSEY END |data fix|dml\n'
     ]
 
-    source_file_dict = [{'file': '/home/functions/function.sql', 'name': 'util.function'},
-                        {'file': '/home/tables/table1.sql', 'name': 'util.table1'},
-                        {'file': '/home/tables/table2.sql', 'name': 'util.table2'},
-                        {'file': 'migrations/0001/up/meh.sql', 'name': 'util.table.inital_load'},
-                        {'file': 'migrations/0001/up/data_fix.sql', 'name': 'datafix'},
+    src = Path(tmpdir.strpath, 'src')
+    for file in ['functions/function.sql', 'tables/table1.sql', 'tables/table2.sql', 'migrations/0001/up/meh.sql', 'migrations/0001/up/data_fix.sql']:
+        Path(src, file).parent.mkdir(parents=True, exist_ok=True)
+        Path(src, file).write_text(sql_source)
+
+    source_file_dict = [SourceObject.of(str(src / 'functions/function.sql'), 'FUNCTION', 'util.function'),
+                        SourceObject.of(str(src / 'tables/table1.sql'), 'TABLE', 'util.table1'),
+                        SourceObject.of(str(src / 'tables/table2.sql'), 'TABLE', 'util.table2'),
+                        SourceObject.of(str(src / 'migrations/0001/up/meh.sql'), 'TABLE', 'util.table.inital_load'),
+                        SourceObject.of(str(src / 'migrations/0001/up/data_fix.sql'), 'TABLE', 'datafix'),
                         ]
 
     config_dict = {'0001': {'up': [
@@ -172,15 +178,14 @@ def test_build_up_migration(mocker, builder):
                                     {'name': 'util.table1', 'type': 'table', 'action': 'drop'},
                                     {'name': 'util.table2', 'type': 'table', 'action': 'create'},
                                     {'name': 'util.function', 'type': 'function', 'action': 'create'},
-                                    {'name': 'util.table.inital_load', 'type': 'ddl', 'action': 'execute', 'location': 'migrations/0001/up/meh.sql'},
-                                    {'name': 'data fix', 'type': 'dml', 'action': 'execute', 'location': 'migrations/0001/up/data_fix.sql'}
+                                    {'name': 'util.table.inital_load', 'type': 'ddl', 'action': 'execute', 'location': str(src / 'migrations/0001/up/meh.sql')},
+                                    {'name': 'data fix', 'type': 'dml', 'action': 'execute', 'location': str(src / 'migrations/0001/up/data_fix.sql')}
                                     ],
                             'down': [{'name': 'data fix', 'type': 'dml', 'action': 'execute', 'location': 'migrations/0001/down/data_fix.sql'}, {'name': 'util.table3', 'type': 'ddl', 'action': 'execute', 'location': 'migrations/0001/down/meh.sql'}, {'name': 'util.function', 'type': 'function', 'action': 'drop'}, {'name': 'util.table2', 'type': 'table', 'action': 'drop'}, {'name': 'util', 'type': 'schema', 'action': 'drop'}]}, '0002': {'up': [{'name': 'sandbox', 'type': 'schema', 'action': 'create'}], 'down': [{'name': 'sandbox', 'type': 'schema', 'action': 'drop'}]}}
-    with patch('builtins.open', mock_open(read_data=sql_source)) as mock_file:
-        result = builder.build_up_migration(
-            '0001', config_dict, source_file_dict)
+    result = builder.build_up_migration(
+        '0001', config_dict, source_file_dict)
     assert len(result) == len(expected_result)
-    assert result == expected_result
+    assert result == [x.encode() for x in expected_result]
 
 
 @pytest.mark.builder
@@ -214,11 +219,13 @@ def test_build_down_migration(mocker, builder, tmpdir):
                         '\n-- ODESSEY BEGIN |util.table1|table\n\n    CREATE TABLE util.table1\n    (\n        id SERIAL\n    )\n    DISTRIBUTED BY(id);\n    \n-- ODESSEY END |util.table1|table\n'
                         ]
 
-    source_file_dict = [{'file': '/home/functions/function.sql', 'name': 'util.function'},
-                        {'file': '/home/tables/table1.sql', 'name': 'util.table1'},
-                        {'file': '/home/tables/table2.sql', 'name': 'util.table2'},
-                        {'file': 'migrations/0001/up/meh.sql', 'name': 'util.table.inital_load'},
-                        {'file': 'migrations/0001/up/data_fix.sql', 'name': 'datafix'},
+    src = Path(tmpdir.strpath, 'src')
+    src.mkdir()
+    Path(src, 'table1.sql').write_text(bad_sql_source)
+
+    source_file_dict = [SourceObject.of(str(src / 'function.sql'), 'FUNCTION', 'util.function'),
+                        SourceObject.of(str(src / 'table1.sql'), 'TABLE', 'util.table1'),
+                        SourceObject.of(str(src / 'table2.sql'), 'TABLE', 'util.table2'),
                         ]
 
     gen_up_names = [f"{x:0>4}_up.sql" for x in list(range(1, 31))]
@@ -272,7 +279,93 @@ def test_build_down_migration(mocker, builder, tmpdir):
                                 }
                     }
 
-    with patch('builtins.open', mock_open(read_data=bad_sql_source)) as mock_file:
-        result = builder.build_down_migration(build_number='0003', config=config_dict, source_file_info=source_file_dict)
+    result = builder.build_down_migration(build_number='0003', config=config_dict, source_file_info=source_file_dict)
+
+    assert result == [x.encode() for x in expected_result]
+
+@pytest.mark.builder
+def test_read_migration(builder):
+    spec = [builder.wrap_odessey_cmd(objname='util', objtype='schema', sql_cmd='CREATE SCHEMA util;'),
+            builder.wrap_odessey_cmd(objname='backfill', objtype='dml', sql_cmd='UPDATE util.t SET x = 1;')]
+    builder.migration_file_name(build_number='0001', direction='up').write_text(''.join(spec))
+    manifest = {'0001': {'up': [{'name': 'util', 'type': 'schema', 'action': 'create'},
+                                {'name': 'backfill', 'type': 'dml', 'action': 'execute', 'chunk_size': 10}]}}
+
+    blocks = builder.read_migration(build_number='0001', direction='up', manifest=manifest)
+
+    assert [(x.name, x.type, x.sql) for x in blocks] == [('util', 'schema', 'CREATE SCHEMA util;'),
+                                                                 ('backfill', 'dml', 'UPDATE util.t SET x = 1;')]
+    assert blocks[1].entry.get('chunk_size') == 10
+
 
-    assert result == expected_result
\ No newline at end of file
+@pytest.mark.builder
+def test_squash_blocks(builder, postgres):
+    builds = {
+        '0001': [('util', 'schema', 'CREATE SCHEMA util;'),
+                 ('util.table1', 'table', 'CREATE TABLE util.table1 (id INT);'),
+                 ('util.function', 'function', 'CREATE OR REPLACE FUNCTION util.function() ... v1'),
+                 ('util.table1', 'ddl', 'ALTER TABLE util.table1 ADD x INT;'),
+                 ('util.table1_idx', 'index', 'CREATE INDEX table1_idx ON util.table1 (id);'),
+                 ('util.table1_fk', 'constraint', 'ALTER TABLE util.table1 ADD CONSTRAINT table1_fk FOREIGN KEY (id) REFERENCES util.table3 (id);')],
+        '0002': [('util.table2', 'table', 'CREATE TABLE util.table2 (id INT);'),
+                 ('util.table1', 'table', 'DROP TABLE util.table1;'),
+                 ('seed', 'dml', 'INSERT INTO util.table2 VALUES (1);')],
+        '0003': [('util.view', 'view', 'CREATE VIEW util.view AS SELECT util.function();'),
+                 ('util.function', 'function', 'CREATE OR REPLACE FUNCTION util.function() ... v2')],
+        '0004': [('sandbox', 'schema', 'CREATE SCHEMA sandbox;')],
+    }
+    for build_number, blocks in builds.items():
+        spec = [builder.wrap_odessey_cmd(objname=x[0], objtype=x[1], sql_cmd=x[2]) for x in blocks]
+        builder.migration_file_name(build_number=build_number, direction='up').write_text(''.join(spec))
+
+    squashed, blocks = builder.squash_blocks(upto='0003', db_engine=postgres)
+
+    assert squashed == ['0001', '0002', '0003']
+    assert [(x.name, x.type) for x in blocks] == [('util', 'schema'), ('util.function', 'function'), ('util.table2', 'table'),
+                                                       ('seed', 'dml'), ('util.view', 'view')]
+    assert blocks[1].sql.endswith('v2')
+
+
+@pytest.mark.builder
+def test_baseline_target(builder):
+    for upto in ['0002', '0004']:
+        header = f"-- ODESSEY BASELINE |{upto}|0001,{upto}\n"
+        block = builder.wrap_odessey_cmd(objname='backfill', objtype='dml', sql_cmd='UPDATE util.t SET x = 1 RETURNING id;')
+        builder.migration_file_name(build_number=upto, direction='baseline').write_text(header + block)
+    manifest = {'0001': {'up': [{'name': 'backfill', 'type': 'dml', 'action': 'execute', 'chunk_size': 100}]}}
+
+    assert builder.get_baseline(target='0003')[0] == '0002'
+    assert builder.get_baseline(target='0001') == (None, None)
+    assert builder.get_baseline()[0] == '0004'
+
+    baseline_build, squashed, blocks = builder.read_baseline(target='0003', manifest=manifest)
+    assert (baseline_build, squashed) == ('0002', ['0001', '0002'])
+    assert blocks[0].entry.get('chunk_size') == 100
+
+
+@pytest.mark.builder
+def test_source_bytes_copied(builder, tmpdir, postgres):
+    source = Path(tmpdir.strpath, 'comment.sql')
+    source.write_bytes("COMMENT ON SCHEMA util IS 'café';".encode('latin-1'))
+    builder.SOURCE_ENCODING = builder.check_encoding('latin-1')
+
+    wrapped = builder.read_and_wrap(objname='util', objtype='comment', file=source)
+    migration = builder.migration_file_name(build_number='0001', direction='up')
+    builder.write_migration(file=migration, build_spec=[wrapped])
+
+    assert source.read_bytes() in migration.read_bytes()
+    assert builder.read_blocks(migration.read_bytes())[0].sql == "COMMENT ON SCHEMA util IS 'café';"
+    table = Path(tmpdir.strpath, 'table1.sql')
+    table.write_bytes("-- café\nCREATE TABLE util.table1 (id INT);".encode('latin-1'))
+    assert Migrate(encoding='latin-1').get_name_from_file(table, postgres.sql_object_name)[0].name == 'util.table1'
+    with pytest.raises(SystemExit):
+        Migrate().get_name_from_file(table, postgres.sql_object_name)
+    builder.SOURCE_ENCODING = builder.check_encoding('UTF-8')
+    assert builder.read_source_bytes(source) == source.read_bytes()
+    execute = {'name': 'comment', 'type': 'ddl', 'action': 'execute', 'location': str(source)}
+    with pytest.raises(SystemExit):
+        builder.build_cmds(manifest=execute, source_file_info=[])
+    with pytest.raises(SystemExit):
+        builder.check_encoding('UTF-16')
+    with pytest.raises(SystemExit):
+        builder.check_encoding('no-such-encoding')
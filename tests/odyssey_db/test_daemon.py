@@ -0,0 +1,58 @@
+import pytest
+import socket
+import stat
+import threading
+import time
+from odyssey_db.builder import Builder
+from odyssey_db.daemon import Daemon, request_daemon
+
+
+@pytest.mark.builder
+def test_daemon_requests(project, postgres):
+    proj = project(['table1'])
+    base, settings = proj.base, proj.settings
+    (base / 'settings.py').write_text("")
+    socket_path = base / 'odyssey.sock'
+
+    daemon = Daemon(db_engines={'postgres': postgres}, migrator=proj.migrator, settings=settings,
+                    settings_file=base / 'settings.py', source_files=proj.source_files, socket_path=socket_path, interval=0.05,
+                    client_timeout=0.2)
+    thread = threading.Thread(target=daemon.serve, daemon=True)
+    thread.start()
+    while not daemon.running:
+        time.sleep(0.01)
+
+    request = {'settings': str((base / 'settings.py').resolve()), 'engines': ['postgres']}
+    assert stat.S_IMODE(socket_path.stat().st_mode) == 0o600
+
+    # A client that never sends its request is dropped instead of blocking the others.
+    idle = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    idle.connect(str(socket_path))
+    assert request_daemon(socket_path, {**request, 'command': 'ping'})['status'] == 'ok'
+    idle.close()
+
+    assert request_daemon(socket_path, {**request, 'engines': ['greenplum'], 'command': 'ping'})['status'] == 'mismatch'
+    assert request_daemon(socket_path, {**request, 'command': 'ping'})['output']['sources'] == 1
+
+    verify = request_daemon(socket_path, {**request, 'command': 'verify'})
+    assert verify['status'] == 'failed'
+    assert verify['output']['pending'] == ['0001']
+
+    (base / 'src' / 'table1.sql').write_text("CREATE TABLE util.table1 (id BIGINT);")
+    time.sleep(0.1)
+    plan = request_daemon(socket_path, {**request, 'command': 'plan', 'plan': 'build', 'target': 'all'})
+    assert [x['build'] for x in plan['output']['builds']] == ['0001']
+
+    assert request_daemon(socket_path, {**request, 'command': 'build'})['status'] == 'ok'
+    assert 'BIGINT' in (base / 'migrations' / '0001_up.sql').read_text()
+    assert request_daemon(socket_path, {**request, 'command': 'verify'})['output']['builds'] == ['0001']
+
+    Builder(settings=settings).archive_migrations(upto='0001')
+    time.sleep(0.1)
+    assert not (base / 'migrations' / '0001_up.sql').exists()
+    assert request_daemon(socket_path, {**request, 'command': 'verify'})['output']['builds'] == ['0001']
+
+    assert request_daemon(socket_path, {**request, 'command': 'stop'})['status'] == 'ok'
+    thread.join(timeout=5)
+    assert not socket_path.exists()
+    assert request_daemon(socket_path, {**request, 'command': 'ping'}) is None
@@ -0,0 +1,38 @@
+import pytest
+from pathlib import Path
+from odyssey_db.manifest import Manifest, load_manifest
+
+
+@pytest.mark.builder
+def test_manifest_lookups():
+    manifest = Manifest({'0003': {}, '0001': {}, '0002': {}, '0010': {}})
+
+    assert manifest.builds == ['0001', '0002', '0003', '0010']
+    assert manifest.next_pending([]) == '0001'
+    assert manifest.next_pending(['0001', '0002']) == '0003'
+    assert manifest.next_pending(['0001', '0003']) == '0002'
+    assert manifest.next_pending(['0001', '0002', '0003', '0010']) is None
+    assert manifest.builds_from('0003') == ['0003', '0010']
+    assert manifest.builds_upto('0002') == ['0001', '0002']
+
+
+@pytest.mark.builder
+def test_load_manifest_cache(tmpdir, mocker):
+    manifest_file = Path(tmpdir.strpath, 'manifest.toml')
+    cache_file = Path(tmpdir.strpath, 'cache.json')
+    manifest_file.write_text('[0001]\nup = [{name = "util", type = "schema", action = "create"}]\n')
+
+    first = load_manifest(manifest_file, cache_file=cache_file)
+    parse = mocker.patch('odyssey_db.manifest.parse_manifest')
+    mocker.patch.dict('odyssey_db.manifest._parsed', clear=True)
+    second = load_manifest(manifest_file, cache_file=cache_file)
+
+    assert parse.call_count == 0
+    assert second == first
+    assert second.digest == first.digest
+    assert second['0001']['up'][0].action_key == 'create'
+
+    manifest_file.write_text('[0002]\nup = []\n')
+    mocker.stopall()
+    third = load_manifest(manifest_file, cache_file=cache_file)
+    assert third.builds == ['0002']
@@ -1,12 +1,20 @@
 import pytest
+import asyncio
 from unittest.mock import patch, mock_open
 import io
 from io import StringIO
 import tempfile
 from pathlib import Path
+from types import SimpleNamespace
+from psycopg2 import errors
+from psycopg2.extras import Json
 from odyssey_db.migrate import Migrate
 from odyssey_db.fixture import Fixture
 from odyssey_db.builder import Builder
+from odyssey_db.models import Block, ManifestEntry, SourceObject
+from odyssey_db.db import greenplum
+from odyssey_db.db.postgres import Engine
+from odyssey_db.odyssey_db import run_build
 
 
 @pytest.mark.migrate
@@ -85,9 +93,413 @@ def test_read_files(mocker, postgres, migrate):
         results_schema = migrate.read_sql_files(
             srcpath='/', str_regex=regex_compile)
 
-    assert results_table['EXTERNAL TABLE'][0]['file'] == '/home/functions/function.sql'
-    assert results_table['EXTERNAL TABLE'][0]['name'] == 'util.external_table'
-    assert results_schema['SCHEMA'][0]['file'] == '/home/functions/function.sql'
-    assert results_schema['SCHEMA'][0]['name'] == 'util'
+    assert results_table['EXTERNAL TABLE'][0].file == '/home/functions/function.sql'
+    assert results_table['EXTERNAL TABLE'][0].name == 'util.external_table'
+    assert results_schema['SCHEMA'][0].file == '/home/functions/function.sql'
+    assert results_schema['SCHEMA'][0].name == 'util'
 
 
+
+
+@pytest.mark.postgres
+def test_split_statements_postgres(postgres):
+    sql = """
+    -- Comment; not a statement
+    CREATE FUNCTION util.fn() RETURNS TEXT AS $BODY$ BEGIN; RETURN ';'; END; $BODY$ LANGUAGE plpgsql;
+    INSERT INTO util.t VALUES ('a;''b'); /* ; */
+    """
+    statements = postgres.split_statements(sql)
+
+    assert len(statements) == 2
+    assert statements[0].endswith('LANGUAGE plpgsql')
+    assert statements[1].endswith("VALUES ('a;''b')")
+    assert postgres.strip_comments("SELECT '--x', $$/*y*/$$ -- z\nFROM t /* w */") == "SELECT '--x', $$/*y*/$$ \nFROM t "
+
+
+@pytest.mark.postgres
+def test_migrate_many_postgres(mocker, postgres):
+
+    def connect(database):
+        if database['NAME'] == 'broken':
+            raise Exception("could not connect")
+        conn = mocker.MagicMock()
+        conn.closed = False
+        cur = conn.cursor.return_value.__enter__.return_value
+        cur.fetchall.return_value = [('0001',)] if database['NAME'] == 'shard2' else []
+        return conn
+
+    mocker.patch.object(postgres, 'connect', side_effect=connect)
+    databases = [{'NAME': 'shard1'}, {'NAME': 'shard2'}, {'NAME': 'broken'}]
+    builds = [('0001', [Block.of('util', 'schema', 'CREATE SCHEMA util;')]),
+              ('0002', [Block.of('sandbox', 'schema', 'CREATE SCHEMA sandbox;')])]
+
+    report = asyncio.run(postgres.migrate_many(databases=databases, builds=builds, concurrency=2))
+    results = {x['database']: x for x in report['results']}
+
+    assert report['succeeded'] == 2
+    assert report['failed'] == 1
+    assert results['shard1']['applied'] == ['0001', '0002']
+    assert results['shard2']['applied'] == ['0002']
+    assert results['broken']['error'] == 'could not connect'
+
+
+@pytest.mark.postgres
+def test_online_statements_postgres():
+    engine = Engine(settings=SimpleNamespace(ONLINE_DDL=True))
+
+    index = Block.of('util.t_idx', 'index', 'CREATE UNIQUE INDEX t_idx ON util.t (id);\nDROP INDEX util.old_idx;')
+    constraint = Block.of('util.t_fk', 'constraint', 'ALTER TABLE util.t ADD CONSTRAINT t_fk FOREIGN KEY (pid) REFERENCES util.p (id);')
+    table = Block.of('util.t', 'table', 'CREATE INDEX t_idx ON util.t (id);')
+
+    assert engine.online_statements(index) == ['CREATE UNIQUE INDEX CONCURRENTLY t_idx ON util.t (id)',
+                                               'DROP INDEX CONCURRENTLY util.old_idx']
+    assert engine.online_statements(constraint) == [
+        'ALTER TABLE util.t ADD CONSTRAINT t_fk FOREIGN KEY (pid) REFERENCES util.p (id) NOT VALID',
+        'ALTER TABLE util.t VALIDATE CONSTRAINT t_fk']
+    assert engine.online_statements(table) is None
+    assert Engine().online_statements(index) is None
+
+
+@pytest.mark.postgres
+def test_execute_online_index_retry_postgres(mocker, conn, cursor):
+    engine = Engine(settings=SimpleNamespace(ONLINE_DDL=True, MIGRATION_POLICY={'index': {'backoff': 0, 'retries': 2}}))
+    mocker.patch('odyssey_db.db.postgres.time.sleep')
+    timeouts = {'CREATE INDEX CONCURRENTLY t_idx ON util.t (id)': 1, 'CREATE INDEX CONCURRENTLY ON util.t (x)': 1,
+                'CREATE INDEX CONCURRENTLY IF NOT EXISTS t_idx ON util.t (id)': 1}
+    executed = []
+
+    def execute(sql, params=None):
+        if timeouts.get(sql):
+            timeouts[sql] -= 1
+            raise errors.LockNotAvailable('lock timeout')
+        executed.append(sql)
+
+    cursor.execute.side_effect = execute
+    cursor.fetchone.return_value = (True,)
+    named = Block.of('t_idx', 'index', 'CREATE INDEX t_idx ON util.t (id);')
+    engine.execute_online(conn, build_number='0001', block=named, statements=engine.online_statements(named))
+
+    assert executed[-3:] == ['DROP INDEX CONCURRENTLY IF EXISTS util.t_idx',
+                             'CREATE INDEX CONCURRENTLY t_idx ON util.t (id)', 'RESET lock_timeout']
+
+    # The index a guarded statement found is valid and is kept.
+    cursor.fetchone.return_value = (False,)
+    executed.clear()
+    guarded = Block.of('t_idx', 'index', 'CREATE INDEX IF NOT EXISTS t_idx ON util.t (id);')
+    engine.execute_online(conn, build_number='0001', block=guarded, statements=engine.online_statements(guarded))
+    assert executed[-2:] == ['CREATE INDEX CONCURRENTLY IF NOT EXISTS t_idx ON util.t (id)', 'RESET lock_timeout']
+    assert 'DROP INDEX CONCURRENTLY IF EXISTS util.t_idx' not in executed
+
+    # A rerun after a failed VALIDATE CONSTRAINT validates the NOT VALID constraint left behind.
+    cursor.fetchone.return_value = (True,)
+    executed.clear()
+    constraint = Block.of('t_fk', 'constraint', 'ALTER TABLE util.t ADD CONSTRAINT t_fk CHECK (id > 0);')
+    engine.execute_online(conn, build_number='0001', block=constraint, statements=engine.online_statements(constraint))
+    assert [x for x in executed if x.startswith('ALTER')] == ['ALTER TABLE util.t VALIDATE CONSTRAINT t_fk']
+
+    unnamed = Block.of('t_x', 'index', 'CREATE INDEX ON util.t (x);')
+    with pytest.raises(errors.LockNotAvailable):
+        engine.execute_online(conn, build_number='0001', block=unnamed, statements=engine.online_statements(unnamed))
+    assert conn.autocommit is False
+
+
+@pytest.mark.postgres
+def test_apply_build_lock_retry_postgres(mocker, conn, cursor):
+    engine = Engine(settings=SimpleNamespace(MIGRATION_POLICY={'default': {'backoff': 0, 'reorder': True}}))
+    mocker.patch('odyssey_db.db.postgres.time.sleep')
+
+    attempts = {'CREATE INDEX t1_a ON util.t1 (a);': 2, 'ALTER TABLE util.t1 ADD x INT;': 1}
+    executed = []
+
+    def execute(sql, params=None):
+        if attempts.get(sql):
+            attempts[sql] -= 1
+            raise errors.LockNotAvailable('lock timeout')
+        executed.append(sql)
+
+    cursor.execute.side_effect = execute
+    blocks = [Block.of('t1_a', 'index', 'CREATE INDEX t1_a ON util.t1 (a);'),
+              Block.of('t2_a', 'index', 'CREATE INDEX t2_a ON util.t2 (a);'),
+              Block.of('t1_b', 'index', 'CREATE INDEX t1_b ON util.t1 (b);'),
+              Block.of('util.t1', 'table', 'ALTER TABLE util.t1 ADD x INT;'),
+              Block.of('util.t2', 'table', 'ALTER TABLE util.t2 ADD x INT;')]
+
+    engine.apply_build(conn, build_number='0001', direction='up', blocks=blocks)
+    statements = [x for x in executed if x.startswith(('ALTER', 'CREATE'))]
+
+    assert statements == ['CREATE INDEX t2_a ON util.t2 (a);', 'CREATE INDEX t1_a ON util.t1 (a);', 'CREATE INDEX t1_b ON util.t1 (b);',
+                          'ALTER TABLE util.t1 ADD x INT;', 'ALTER TABLE util.t2 ADD x INT;']
+    assert executed.count('ROLLBACK TO SAVEPOINT odyssey_block') == 3
+    conn.commit.assert_called_once()
+    timings = cursor.execute.call_args_list
+    recorded = [x.args[1] for x in timings if x.args[0].startswith('INSERT INTO odyssey_timing')]
+    assert [x[2] for x in recorded] == [[1, 0, 2, 3, 4]]
+    assert recorded[0][5] == ['util.t2', 'util.t1', 'util.t1', 'util.t1', 'util.t2']
+
+
+@pytest.mark.postgres
+def test_apply_build_groups_postgres(mocker, conn, cursor):
+    engine = Engine(settings=SimpleNamespace(MIGRATION_POLICY={'default': {'backoff': 0}, 'dml': {'on_error': 'retry'}}))
+    mocker.patch('odyssey_db.db.postgres.time.sleep')
+
+    def entry(name, objtype, **options):
+        return ManifestEntry.from_dict({'name': name, 'type': objtype, 'action': 'execute', **options})
+
+    blocks = [Block.of('util.t1', 'table', 'CREATE TABLE util.t1 (id INT);', entry=entry('util.t1', 'table', group='ddl')),
+              Block.of('util.t2', 'table', 'CREATE TABLE util.t2 (id INT);', entry=entry('util.t2', 'table', group='ddl')),
+              Block.of('fill', 'dml', 'INSERT INTO util.t1 VALUES (1);', entry=entry('fill', 'dml', group='data')),
+              Block.of('stats', 'dml', 'ANALYZE util.t9;', entry=entry('stats', 'dml', group='data', on_error='skip'))]
+    assert [x[0] for x in engine.build_units(blocks)] == ['ddl', 'data']
+
+    failures = {'INSERT INTO util.t1 VALUES (1);': 1, 'ANALYZE util.t9;': 10}
+    executed = []
+
+    def execute(sql, params=None):
+        if failures.get(sql):
+            failures[sql] -= 1
+            raise errors.UndefinedTable('relation does not exist')
+        executed.append((sql, params))
+
+    cursor.execute.side_effect = execute
+    cursor.fetchall.return_value = []
+
+    skipped = engine.apply_build(conn, build_number='0001', direction='up', blocks=blocks)
+    statements = [x[0] for x in executed]
+
+    assert skipped == ['stats|dml']
+    assert statements.count('INSERT INTO util.t1 VALUES (1);') == 1
+    assert statements.count('ROLLBACK TO SAVEPOINT odyssey_block') == 2
+    assert [x[1] for x in executed if x[0].startswith('INSERT INTO odyssey_group')] == [('0001', 'up', 0, 'ddl')]
+    assert conn.commit.call_count == 2
+
+    executed.clear()
+    cursor.fetchall.side_effect = [[(0, 'ddl')], []]
+    engine.apply_build(conn, build_number='0001', direction='up', blocks=blocks[:3])
+    statements = [x[0] for x in executed]
+
+    assert 'CREATE TABLE util.t1 (id INT);' not in statements
+    assert 'INSERT INTO util.t1 VALUES (1);' in statements
+    assert any(x.startswith('DELETE FROM odyssey_group') for x in statements)
+
+    failures['ANALYZE util.t9;'] = 1
+    blocks[3] = blocks[3]._replace(entry=entry('stats', 'dml', group='data'))
+    with pytest.raises(errors.UndefinedTable):
+        Engine(settings=SimpleNamespace(MIGRATION_POLICY={})).apply_build(conn, build_number='0002', direction='up', blocks=blocks[3:])
+
+
+@pytest.mark.postgres
+def test_apply_build_chunked_resume_postgres(mocker, postgres, conn, cursor):
+    mocker.patch('odyssey_db.db.postgres.time.sleep')
+    backfill = 'UPDATE util.t SET x = 1 WHERE id > %(last_key)s LIMIT %(chunk_size)s RETURNING id;'
+    blocks = [Block.of('util.t', 'table', 'CREATE TABLE util.t (id INT, x INT);'),
+              Block.of('backfill', 'dml', backfill,
+                       entry=ManifestEntry.from_dict({'name': 'backfill', 'type': 'dml', 'action': 'execute', 'chunk_size': 2})),
+              Block.of('t_x', 'index', 'CREATE INDEX t_x ON util.t (x);')]
+    assert [x[1] for x in postgres.build_units(blocks)] == [[0], [1], [2]]
+
+    executed = []
+    shutdowns = [errors.AdminShutdown('terminating connection')]
+
+    def execute(sql, params=None):
+        executed.append((sql, params))
+        if sql.startswith('UPDATE') and params['last_key'] == 2 and shutdowns:
+            raise shutdowns.pop()
+
+    cursor.execute.side_effect = execute
+    cursor.fetchone.return_value = None
+    cursor.fetchall.side_effect = [[], [], [(1,), (2,)]]
+    with pytest.raises(errors.AdminShutdown):
+        postgres.apply_build(conn, build_number='0001', direction='up', blocks=blocks)
+    assert [x[1] for x in executed if x[0].startswith('INSERT INTO odyssey_group')] == [('0001', 'up', 0, None)]
+
+    executed.clear()
+    cursor.fetchone.return_value = ('2', 2)
+    cursor.fetchall.side_effect = [[(0, None)], [], [(3,)], []]
+    postgres.apply_build(conn, build_number='0001', direction='up', blocks=blocks)
+    statements = [x[0] for x in executed]
+
+    assert 'CREATE TABLE util.t (id INT, x INT);' not in statements
+    assert [x[1]['last_key'] for x in executed if x[0].startswith('UPDATE')] == [2, 3]
+    assert [x[1][2] for x in executed if x[0].startswith('INSERT INTO odyssey_group')] == [1]
+    assert 'CREATE INDEX t_x ON util.t (x);' in statements
+    assert any(x.startswith('INSERT INTO odyssey_ledger') for x in statements)
+
+
+@pytest.mark.postgres
+def test_execute_chunked_postgres(mocker, postgres, conn, cursor):
+    mocker.patch('odyssey_db.db.postgres.time.sleep')
+    cursor.fetchone.return_value = ('100', 100)
+    cursor.fetchall.side_effect = [[(150,), (200,)], [(250,)], []]
+    block = Block.of('backfill', 'dml', 'UPDATE t SET x = 1 WHERE id > %(last_key)s LIMIT %(chunk_size)s RETURNING id;',
+                     entry=ManifestEntry.from_dict({'name': 'backfill', 'type': 'dml', 'action': 'execute', 'chunk_size': 2}))
+
+    postgres.execute_chunked(conn, build_number='0001', direction='up', position=3, block=block)
+
+    batches = [x.args for x in cursor.execute.call_args_list if x.args[0].startswith('UPDATE')]
+    checkpoints = [x.args[1] for x in cursor.execute.call_args_list if x.args[0].startswith('INSERT')]
+    assert [x[1] for x in batches] == [{'last_key': 100, 'chunk_size': 2},
+                                       {'last_key': 200, 'chunk_size': 2},
+                                       {'last_key': 250, 'chunk_size': 2}]
+    assert checkpoints == [('0001', 'up', 3, '200', 102), ('0001', 'up', 3, '250', 103)]
+
+
+@pytest.mark.postgres
+def test_drift_decision_postgres(mocker, conn, cursor):
+    engine = Engine(settings=SimpleNamespace(MIGRATION_POLICY={'default': {'drift': 'guard'}, 'function': {'drift': 'fail'}}))
+    cursor.fetchall.side_effect = [[('util',)], [('util.table1',)], [('util.fn',)], [], []]
+    catalog = engine.snapshot_catalog(conn)
+
+    drop_missing = Block.of('util.table2', 'table', 'DROP TABLE util.table2;')
+    create_existing = Block.of('util', 'schema', 'CREATE SCHEMA util;')
+    replace_existing = Block.of('util.fn', 'function', 'CREATE OR REPLACE FUNCTION util.fn() ...')
+    drop_function = Block.of('util.other', 'function', 'DROP FUNCTION util.other;')
+
+    assert engine.drift_decision(drop_missing, catalog) == 'guard'
+    assert engine.guard_block(drop_missing).sql == 'DROP TABLE IF EXISTS util.table2;'
+    assert engine.guard_block(create_existing).sql == 'CREATE SCHEMA IF NOT EXISTS util;'
+    assert engine.drift_decision(replace_existing, catalog) == 'run'
+    assert engine.drift_decision(drop_function, catalog) == 'fail'
+    catalog.record('table', 'util.table2', 'create')
+    assert engine.drift_decision(drop_missing, catalog) == 'run'
+
+
+@pytest.mark.postgres
+def test_migrate_database_baseline_postgres(mocker, postgres, conn, cursor):
+    cursor.fetchall.return_value = []
+    mocker.patch.object(postgres, 'connect', return_value=conn)
+    baseline = ('0002', ['0001', '0002'], [Block.of('util', 'schema', 'CREATE SCHEMA util;')])
+    builds = [(x, [Block.of('sandbox' + x, 'schema', f'CREATE SCHEMA sandbox{x};')]) for x in ['0001', '0002', '0003']]
+
+    result = postgres.migrate_database({'NAME': 'fresh'}, builds=builds, baseline=baseline)
+    ledger = [x.args[1][0] for x in cursor.execute.call_args_list if x.args[0].startswith('INSERT INTO odyssey_ledger')]
+
+    assert result['applied'] == ['0002_baseline', '0003']
+    assert ledger == ['0001', '0002', '0003']
+
+
+@pytest.mark.postgres
+def test_migrate_database_down_postgres(mocker, postgres, conn):
+    mocker.patch.object(postgres, 'connect', return_value=conn)
+    mocker.patch.object(postgres, 'ensure_ledger')
+    mocker.patch.object(postgres, 'applied_builds', return_value=['0001', '0002'])
+    apply = mocker.patch.object(postgres, 'apply_build', return_value=[])
+    builds = [(x, [Block.of('sandbox' + x, 'schema', f'DROP SCHEMA sandbox{x};')]) for x in ['0003', '0002', '0001']]
+
+    result = postgres.migrate_database({'NAME': 'behind'}, builds=builds, direction='down', steps=1)
+
+    assert result['applied'] == ['0002']
+    assert apply.call_args.kwargs['build_number'] == '0002'
+
+
+@pytest.mark.postgres
+def test_migrate_database_lock_postgres(mocker, postgres, conn):
+    mocker.patch.object(postgres, 'connect', return_value=conn)
+    ensure = mocker.patch.object(postgres, 'ensure_ledger')
+    mocker.patch.object(postgres, 'applied_builds', return_value=[])
+    mocker.patch.object(postgres, 'server_time', return_value='now')
+    mocker.patch.object(postgres, 'release_migration_lock')
+    apply = mocker.patch.object(postgres, 'apply_build')
+    publish = mocker.patch.object(postgres, 'publish_result')
+    builds = [('0001', [Block.of('util', 'schema', 'CREATE SCHEMA util;')])]
+
+    mocker.patch.object(postgres, 'acquire_migration_lock', return_value=False)
+    locked = postgres.migrate_database({'NAME': 'db'}, builds=builds, chain='abc', lock='exit')
+    assert locked['status'] == 'locked'
+    assert ensure.call_count == 0
+
+    mocker.patch.object(postgres, 'acquire_migration_lock', return_value=True)
+    mocker.patch.object(postgres, 'published_result',
+                        return_value={'status': 'failed', 'applied': [], 'skipped': ['0001:util'], 'error': 'boom', 'published_by': 'node1:1'})
+    follower = postgres.migrate_database({'NAME': 'db'}, builds=builds, chain='abc')
+    assert (follower['status'], follower['skipped'], follower['error']) == ('failed', ['0001:util'], 'boom')
+    assert apply.call_count == 0 and publish.call_count == 0
+
+    mocker.patch.object(postgres, 'published_result', return_value=None)
+    leader = postgres.migrate_database({'NAME': 'db'}, builds=builds, chain='abc')
+    assert leader['applied'] == ['0001']
+    assert publish.call_args.args[1] == 'abc|up|0001|None'
+    assert publish.call_args.args[2]['status'] == 'success'
+
+
+@pytest.mark.postgres
+def test_provision_template_postgres(mocker, postgres, conn, cursor):
+    cursor.fetchone.return_value = None
+    mocker.patch.object(postgres, 'admin_connection', return_value=conn)
+    migrate = mocker.patch.object(postgres, 'migrate_database', return_value={'status': 'success'})
+    connect = mocker.patch.object(postgres, 'connect')
+    load = mocker.MagicMock()
+
+    name = postgres.provision_template({'NAME': 'app'}, name='odyssey_tpl_abc', builds=[], load=load)
+
+    assert name == 'odyssey_tpl_abc'
+    assert migrate.call_args.args[0]['NAME'] == 'odyssey_tpl_abc_building'
+    load.assert_called_once_with(connect.return_value)
+    assert any('RENAME TO' in str(x) for x in cursor.execute.call_args_list)
+
+
+@pytest.mark.postgres
+def test_odyssey_database_plugin(odyssey_database):
+    with odyssey_database.cursor() as cur:
+        cur.execute("SELECT count(*) FROM odyssey_ledger")
+        assert cur.fetchone()[0] >= 0
+
+
+@pytest.mark.fixture
+def test_dump_subset(mocker, tmpdir, conn, cursor):
+    fix = Fixture()
+    foreign_keys = [('app.orders', 'app.customers', ['customer_id'], ['id']),
+                    ('app.customers', 'app.regions', ['region_id'], ['id']),
+                    ('app.regions', 'app.regions', ['parent_id'], ['id'])]
+    cursor.fetchall.return_value = foreign_keys
+    # Seed orders, then new customers, new regions, new parent regions and nothing more.
+    type(cursor).rowcount = mocker.PropertyMock(side_effect=[5, 3, 2, 1, 0])
+    stream = mocker.patch.object(Fixture, 'stream_rows', return_value=1)
+
+    files = fix.dump_subset(conn, seeds={'app.orders': 'LIMIT 5'}, folder=tmpdir.strpath)
+
+    assert [x.name for x in files] == ['0001_app.regions.json', '0002_app.customers.json', '0003_app.orders.json']
+    assert [x.args[2] for x in stream.call_args_list] == ['odyssey_subset_2', 'odyssey_subset_1', 'odyssey_subset_0']
+    assert fix.load_order(['a', 'b'], {'a': [('b', [], [])], 'b': [('a', [], [])]}) == ['a', 'b']
+
+
+@pytest.mark.fixture
+def test_fixture_bytea(mocker, tmpdir, conn, cursor):
+    fix = Fixture()
+    file = Path(tmpdir.strpath, '0001_app.files.json')
+    cursor.__iter__.return_value = iter([{'id': 1, 'data': memoryview(b'\x00\xff'), 'meta': {'a': [1]}, 'tags': ['x']},
+                                         {'id': 2, 'data': None, 'meta': None, 'tags': [1, 2]}])
+    cursor.description = [SimpleNamespace(name='id', type_code=23), SimpleNamespace(name='data', type_code=17),
+                          SimpleNamespace(name='meta', type_code=3802), SimpleNamespace(name='tags', type_code=114)]
+    assert fix.stream_rows(conn, 'app.files', 'odyssey_subset_0', file, batch_size=10) == 2
+    table, rows = fix.read_fixture(file)
+    assert (table, rows[0]['id'], rows[0]['data'], rows[1]['data'], rows[1]['meta']) == ('app.files', 1, b'\x00\xff', None, None)
+    assert [(x['meta'].adapted if x['meta'] else None, x['tags'].adapted) for x in rows] == [({'a': [1]}, ['x']), (None, [1, 2])]
+
+    execute_values = mocker.patch('odyssey_db.fixture.execute_values')
+    mocker.patch('odyssey_db.fixture.sql.Composed.as_string', return_value='INSERT')
+    assert fix.load(conn, [file]) == 2
+    assert cursor.execute.call_args_list[-1].args == ("SET CONSTRAINTS ALL DEFERRED",)
+    loaded = execute_values.call_args.args[2]
+    assert [x[:2] for x in loaded] == [(1, b'\x00\xff'), (2, None)]
+    assert all(isinstance(x[3], Json) for x in loaded)
+
+
+@pytest.mark.greenplum
+def test_run_build_engines(builder, tmpdir, postgres):
+
+    source = Path(tmpdir.strpath, 't_idx.sql')
+    source.write_text('CREATE INDEX CONCURRENTLY t_idx ON util.t (id);')
+    manifest = Path(builder.MIGRATION_FOLDER, 'manifest.toml')
+    manifest.write_text('[0001]\nup = [{name = "util.t_idx", type = "index", action = "create"}]\n'
+                        'down = [{name = "util.t_idx", type = "index", action = "drop"}]\n')
+    settings = SimpleNamespace(MIGRATION_FOLDER=builder.MIGRATION_FOLDER, MIGRATION_MAINIFEST=manifest)
+
+    run_build(db_engines={'postgres': postgres, 'greenplum': greenplum.Engine()}, settings=settings,
+              source_files=[SourceObject.of(source, 'INDEX', 'util.t_idx')])
+
+    pg_up = Path(builder.MIGRATION_FOLDER, '0001_up.sql').read_text()
+    gp_up = Path(builder.MIGRATION_FOLDER, 'greenplum', '0001_up.sql').read_text()
+    assert 'CREATE INDEX CONCURRENTLY t_idx' in pg_up
+    assert 'CREATE INDEX t_idx ON util.t (id);' in gp_up
+    assert Path(builder.MIGRATION_FOLDER, 'greenplum', '0001_down.sql').is_file()
+    assert Builder(settings=settings, engine='greenplum').migration_builds(direction="up") == ['0001']
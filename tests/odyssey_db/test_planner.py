@@ -0,0 +1,108 @@
+import pytest
+from pathlib import Path
+from odyssey_db.planner import Planner
+
+
+@pytest.mark.planner
+def test_plan_build(builder, postgres, tmpdir):
+    manifest = """
+    [0001]
+    up = [
+        {name = "util", type="schema", action="create"},
+        {name = "util.function", type = "function", action = "create"},
+    ]
+    down = [
+        {name = "util.function", type = "function", action = "drop"},
+        {name = "util", type="schema", action="drop"},
+    ]
+
+    [0002]
+    up = [
+        {name="util.function", type = "function", action = "create"},
+    ]
+    down = [
+        {name="util.function", type = "function", action = "rollback"},
+    ]
+    """
+    Path(builder.MIGRATION_MAINIFEST).write_text(manifest)
+    source = Path(tmpdir.strpath, 'function.sql')
+    source.write_text("CREATE FUNCTION util.function() RETURNS int AS $$ BEGIN; RETURN 1; END; $$ LANGUAGE plpgsql;")
+
+    builder.MANIFEST_CACHE = Path(tmpdir.strpath, 'manifest_cache.json')
+    planner = Planner(db_engine=postgres, builder=builder, source_files={'util.function': str(source)})
+    plan = planner.plan_build()
+
+    assert not builder.MANIFEST_CACHE.exists()
+
+    assert [x['build'] for x in plan['builds']] == ['0001', '0002']
+    assert plan['builds'][0]['up']['blocks'][0] == {'name': 'util', 'type': 'schema', 'bytes': 19, 'statements': 1, 'action': 'create'}
+    assert plan['builds'][0]['up']['blocks'][1]['statements'] == 1
+    assert plan['builds'][1]['down']['blocks'][0]['action'] == 'rollback'
+    assert plan['totals']['blocks'] == 3
+    assert builder.get_existing_files() == []
+
+
+@pytest.mark.planner
+def test_plan_migrate(builder, postgres):
+    for build_number in ['0001', '0002']:
+        for direction in ['up', 'down']:
+            sql = builder.wrap_odessey_cmd(
+                objname='util.t' + build_number, objtype='table', sql_cmd="SELECT ';'; SELECT 2;")
+            builder.migration_file_name(build_number=build_number, direction=direction).write_text(sql)
+
+    planner = Planner(db_engine=postgres, builder=builder, source_files={})
+    up_plan = planner.plan_migrate(direction='up', target='0001')
+    down_plan = planner.plan_migrate(direction='down', target='0000')
+
+    assert [x['build'] for x in up_plan['builds']] == ['0001']
+    assert up_plan['totals']['statements'] == 2
+    assert [x['build'] for x in down_plan['builds']] == ['0002', '0001']
+    assert builder.migration_builds(direction='down') == ['0002', '0001']
+    assert [x['build'] for x in planner.plan_migrate(direction='down')['builds']] == ['0002']
+    assert [x['build'] for x in planner.plan_migrate(direction='up', applied=['0001'])['builds']] == ['0002']
+    assert [x['build'] for x in planner.plan_migrate(direction='down', applied=['0001'])['builds']] == ['0001']
+    assert [x['build'] for x in planner.plan_migrate(direction='up', applied=[])['builds']] == ['0001', '0002']
+
+    header = "-- ODESSEY BASELINE |0001|0001\n"
+    builder.migration_file_name(build_number='0001', direction='baseline').write_text(
+        header + builder.wrap_odessey_cmd(objname='util.t0001', objtype='table', sql_cmd="SELECT 1;"))
+    baseline_plan = planner.plan_migrate(direction='up', applied=[])
+    assert [x['build'] for x in baseline_plan['builds']] == ['0001_baseline', '0002']
+    assert baseline_plan['totals']['statements'] == 3
+    assert [x['build'] for x in planner.plan_migrate(direction='up', applied=['0001'])['builds']] == ['0002']
+
+
+@pytest.mark.planner
+def test_plan_migrate_estimate(builder, postgres):
+    from odyssey_db.estimate import Estimator
+    blocks = {
+        'util.t1_idx': ('index', 'CREATE INDEX util.t1_idx ON util.t1 (a);'),
+        'util.t2_idx': ('index', 'CREATE INDEX util.t2_idx ON util.t2 (a);'),
+        'util.fn': ('function', 'CREATE FUNCTION util.fn() RETURNS INT AS $$ SELECT 1 $$ LANGUAGE sql;'),
+    }
+    sql = ''.join(builder.wrap_odessey_cmd(objname=x, objtype=y[0], sql_cmd=y[1]) for (x, y) in blocks.items())
+    builder.migration_file_name(build_number='0001', direction='up').write_text(sql)
+    history = [
+        {'direction': 'up', 'name': 'util.t1_idx', 'type': 'index', 'relation': 'util.t1', 'seconds': 10.0, 'relpages': 1000, 'reltuples': 1e5},
+        {'direction': 'up', 'name': 'util.t1_idx', 'type': 'index', 'relation': 'util.t1', 'seconds': 12.0, 'relpages': 1000, 'reltuples': 1e5},
+        {'direction': 'down', 'name': 'util.t1_idx', 'type': 'index', 'relation': 'util.t1', 'seconds': 0.1, 'relpages': 1000, 'reltuples': 1e5},
+        {'direction': 'up', 'name': 'util.t3_idx', 'type': 'index', 'relation': 'util.t3', 'seconds': 4.0, 'relpages': 100, 'reltuples': 1e4},
+        {'direction': 'down', 'name': 'util.fn', 'type': 'function', 'relation': None, 'seconds': 3.0, 'relpages': None, 'reltuples': None},
+    ]
+    sizes = {'util.t1': (2000, 2e5), 'util.t2': (500, 5e4)}
+    estimator = Estimator(db_engine=postgres, history=history, sizes=sizes)
+
+    planner = Planner(db_engine=postgres, builder=builder, source_files={})
+    plan = planner.plan_migrate(direction='up', target='0001', estimator=estimator)
+    estimates = {x['name']: x['estimate'] for x in plan['builds'][0]['up']['blocks']}
+
+    assert estimates['util.t1_idx']['basis'] == 'history'
+    assert estimates['util.t1_idx']['seconds'] == 22.0
+    assert estimates['util.t1_idx']['low'] < 22.0 < estimates['util.t1_idx']['high']
+    assert estimates['util.t2_idx']['basis'] == 'rate'
+    assert estimates['util.t2_idx']['low'] <= estimates['util.t2_idx']['seconds'] <= estimates['util.t2_idx']['high']
+    assert estimates['util.fn'] == {'seconds': 0.05, 'low': 0.013, 'high': 0.2, 'basis': 'default', 'samples': 0}
+    assert plan['totals']['estimate']['seconds'] == plan['builds'][0]['up']['estimate']['seconds']
+    applied = planner.plan_migrate(direction='up', target='0001', estimator=estimator, applied=['0001'])
+    assert applied['builds'] == []
+    assert applied['totals']['estimate']['seconds'] == 0
@@ -0,0 +1,36 @@
+import pytest
+from odyssey_db.watch import Watcher
+
+
+@pytest.mark.builder
+def test_watch_affected_builds(project, postgres):
+    proj = project(['table1', 'table2'])
+    base = proj.base
+
+    watcher = Watcher(db_engine=postgres, migrator=proj.migrator, settings=proj.settings,
+                      source_files=proj.source_files)
+    watcher.generate(['0002'])
+    (base / 'src' / 'table2.sql').write_text("CREATE TABLE util.table2 (id BIGINT);")
+    (base / 'src' / 'table1.sql').write_text("CREATE TABLE util.table1 (id BIGINT);")
+
+    changed = {str((base / 'src' / x).resolve()) for x in ('table1.sql', 'table2.sql')}
+    affected = watcher.affected_builds(changed)
+    watcher.generate(affected)
+
+    assert watcher.session_builds == ['0002']
+    assert affected == ['0002']
+    assert 'BIGINT' in (base / 'migrations' / '0002_up.sql').read_text()
+    assert not (base / 'migrations' / '0001_up.sql').exists()
+
+    # A failed regeneration keeps the previous files and is retried with the next change.
+    watcher.generate(['0001', '0002'])
+    (base / 'src' / 'table1.sql').unlink()
+    with pytest.raises(SystemExit):
+        watcher.generate(watcher.affected_builds({str((base / 'src' / 'table1.sql').resolve())}))
+    assert (base / 'migrations' / '0001_up.sql').exists() and (base / 'migrations' / '0002_up.sql').exists()
+    (base / 'src' / 'table2.sql').write_text("CREATE TABLE util.table2 (id TEXT);")
+    assert watcher.affected_builds({str((base / 'src' / 'table2.sql').resolve())}) == ['0001', '0002']
+    (base / 'src' / 'table1.sql').write_text("CREATE TABLE util.table1 (id TEXT);")
+    watcher.generate(watcher.affected_builds({str((base / 'src' / 'table1.sql').resolve())}))
+    assert watcher.stale == set()
+    assert 'TEXT' in (base / 'migrations' / '0001_up.sql').read_text()
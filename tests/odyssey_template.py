@@ -0,0 +1,67 @@
+"""
+pytest plugin providing migrated PostgreSQL databases cloned from a cached template.
+
+The template is migrated once and named after the hash of the migration chain and of
+any preloaded fixtures, so it is rebuilt only when they change. Each test using the
+odyssey_database fixture gets a fresh copy made with CREATE DATABASE ... TEMPLATE.
+
+    pytest --odyssey-settings config/settings.py --odyssey-fixture fixtures/users.json
+"""
+import os
+import uuid
+import pytest
+import psycopg2
+from pathlib import Path
+from types import SimpleNamespace
+from odyssey_db.builder import Builder
+from odyssey_db.fixture import Fixture
+from odyssey_db.odyssey_db import load_settings, load_engine, read_builds
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('odyssey')
+    group.addoption('--odyssey-settings', default=os.environ.get('ODYSSEY_SETTINGS', 'config/settings.py'),
+                    help="Settings file of the migrations to provision test databases from.")
+    group.addoption('--odyssey-engine', default='postgres', help="Database engine.")
+    group.addoption('--odyssey-fixture', action='append', default=[],
+                    help="Fixture file to preload into the template database, may be repeated.")
+
+
+@pytest.fixture(scope="session")
+def odyssey_template(request):
+    try:
+        settings = load_settings(request.config.getoption('odyssey_settings'))
+    except SystemExit:
+        pytest.skip("Odyssey settings file not found.")
+    if not Path(settings.MIGRATION_MAINIFEST).is_file():
+        pytest.skip(f"Migration manifest not found: {settings.MIGRATION_MAINIFEST}")
+    engine = load_engine(request.config.getoption('odyssey_engine'), settings=settings)
+    build = Builder(settings=settings, engine=engine.NAME)
+    fixtures = request.config.getoption('odyssey_fixture')
+
+    name = f"odyssey_tpl_{build.chain_hash(extra_files=fixtures)[:16]}"
+    builds, steps, baseline = read_builds(build=build, direction='up', target='max')
+    database = engine.database_list(settings.DATABASE)[0]
+
+    def load(conn):
+        if fixtures:
+            Fixture().load(conn, fixtures)
+
+    try:
+        engine.provision_template(database, name=name, builds=builds, baseline=baseline, load=load)
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"PostgreSQL is not available: {e}")
+    return SimpleNamespace(engine=engine, database=database, name=name)
+
+
+@pytest.fixture()
+def odyssey_database(odyssey_template):
+    engine = odyssey_template.engine
+    name = f"odyssey_test_{uuid.uuid4().hex[:12]}"
+    database = engine.clone_database(odyssey_template.database, template=odyssey_template.name, name=name)
+    conn = engine.connect(database)
+    try:
+        yield conn
+    finally:
+        conn.close()
+        engine.remove_database(odyssey_template.database, name)